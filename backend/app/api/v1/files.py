@@ -0,0 +1,147 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, List, Optional
+from datetime import datetime, timedelta
+from ...database import get_async_db, async_engine, upgrade_schema
+from ...models.log import LogFile, LogEntry, LogLevel
+from ...services.log_storage import drop_log_file_entries, apply_retention
+from pydantic import BaseModel
+
+
+router = APIRouter()
+
+# 日志条目分页上限
+ENTRIES_MAX_PAGE = 1000
+
+
+@router.on_event("startup")
+async def _upgrade_schema():
+    """注册本路由时随应用启动执行：为旧库补齐新增列（storage_mode、message_offset）"""
+    async with async_engine.begin() as conn:
+        await conn.run_sync(upgrade_schema)
+
+
+# 简单的认证依赖（临时解决方案，与 rules 路由一致）
+def get_current_user():
+    return {"id": 1, "username": "admin"}
+
+
+@router.delete("/files/{file_id}")
+async def delete_file(
+    file_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """删除日志文件及其全部条目（分区表上为并发脱离后 DROP 分区，不逐条删除）"""
+    log_file = await db.get(LogFile, file_id)
+    if not log_file:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="日志文件不存在"
+        )
+
+    await db.run_sync(drop_log_file_entries, file_id)
+    await db.delete(log_file)
+    await db.commit()
+
+    return {"message": "日志文件删除成功"}
+
+
+@router.post("/files/retention")
+async def run_retention(
+    days: int = Query(..., ge=1, description="删除早于该天数上传的文件"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """按上传时间清理过期文件"""
+    cutoff = datetime.now().astimezone() - timedelta(days=days)
+    removed = await db.run_sync(apply_retention, cutoff)
+    return {"removed": removed, "count": len(removed)}
+
+
+class LogEntryResponse(BaseModel):
+    id: int
+    line_number: int
+    raw_content: str
+    parsed_content: Optional[Any]
+    timestamp: Optional[datetime]
+    log_level: Optional[LogLevel]
+    source: Optional[str]
+    message: Optional[str]
+    problem_detected: bool
+    problem_type: Optional[str]
+    problem_description: Optional[str]
+
+    class Config:
+        from_attributes = True
+
+
+def _entry_cursor(entry: LogEntry, order_by: str) -> str:
+    key = entry.timestamp.isoformat() if order_by == "time" else entry.line_number
+    return f"{key}|{entry.id}"
+
+
+def _entry_cursor_key(cursor: str, order_by: str):
+    key, _, entry_id = cursor.rpartition("|")
+    try:
+        return (datetime.fromisoformat(key) if order_by == "time" else int(key)), int(entry_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的游标")
+
+
+@router.get("/files/{file_id}/entries")
+async def list_file_entries(
+    file_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=ENTRIES_MAX_PAGE),
+    order_by: str = Query("line", pattern="^(line|time)$"),
+    level: Optional[List[LogLevel]] = Query(None),
+    problem_type: Optional[str] = None,
+    problems_only: bool = False,
+    source: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """日志条目列表（键集分页）。
+    order_by：line 按 (line_number, id)，time 按 (timestamp, id)，time 排序时不含无时间戳的行；
+    cursor 取自上一页返回的 next_cursor，任意页的查询代价与首页相同；
+    level（可多选）/problem_type/problems_only/source/since/until：按级别、问题类型、来源、时间范围过滤。
+    """
+    if not await db.get(LogFile, file_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="日志文件不存在"
+        )
+
+    keys = (LogEntry.timestamp, LogEntry.id) if order_by == "time" else (LogEntry.line_number, LogEntry.id)
+    query = select(LogEntry).where(LogEntry.log_file_id == file_id)
+    if order_by == "time":
+        query = query.where(LogEntry.timestamp.isnot(None))
+    if level:
+        query = query.where(LogEntry.log_level.in_(level))
+    if problem_type:
+        query = query.where(LogEntry.problem_detected == True, LogEntry.problem_type == problem_type)
+    elif problems_only:
+        query = query.where(LogEntry.problem_detected == True)
+    if source:
+        query = query.where(LogEntry.source == source)
+    if since:
+        query = query.where(LogEntry.timestamp >= since)
+    if until:
+        query = query.where(LogEntry.timestamp <= until)
+    if cursor:
+        query = query.where(tuple_(*keys) > tuple_(*_entry_cursor_key(cursor, order_by)))
+
+    result = await db.execute(query.order_by(*keys).limit(limit + 1))
+    entries = result.scalars().all()
+    more = len(entries) > limit
+    entries = entries[:limit]
+
+    return {
+        "entries": [LogEntryResponse.model_validate(e) for e in entries],
+        "next_cursor": _entry_cursor(entries[-1], order_by) if more else None,
+        "count": len(entries),
+    }
@@ -0,0 +1,172 @@
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import datetime
+from ...database import get_async_db
+from ...models.report import Report, ReportType, ReportStatus
+from ...services.report_service import (
+    ReportService, report_to_dict, get_cached_report, cache_report, invalidate_report_cache,
+    submit_report_generation,
+)
+from pydantic import BaseModel, Field
+
+
+router = APIRouter()
+
+
+# 简单的认证依赖（临时解决方案，与 rules 路由一致）
+def get_current_user():
+    return {"id": 1, "username": "admin"}
+
+
+class ReportCreate(BaseModel):
+    title: str = Field(..., max_length=200)
+    description: Optional[str] = None
+    report_type: ReportType
+    log_file_ids: List[int] = Field(..., min_length=1)
+    date_range_start: Optional[datetime] = None
+    date_range_end: Optional[datetime] = None
+    filters: Optional[dict] = None
+
+
+class ReportShareRequest(BaseModel):
+    is_public: bool
+    expires_hours: Optional[int] = Field(24, ge=1)
+
+
+def _not_found():
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="报表不存在"
+    )
+
+
+async def _get_report(db: AsyncSession, report_id: int, owner_id: int) -> Report:
+    """读取当前用户自己的报表；他人的报表与不存在一样返回 404，不暴露报表是否存在"""
+    report = await db.get(Report, report_id)
+    if not report or report.generated_by != owner_id:
+        raise _not_found()
+    return report
+
+
+async def _report_payload(db: AsyncSession, report_id: int, owner_id: Optional[int] = None) -> dict:
+    """已完成的报表优先读缓存，未命中时读库并回填。
+    owner_id 不为 None 时只返回该用户的报表，缓存命中也按缓存内容中的 generated_by 校验；
+    分享链接（owner_id 为 None）由调用方先校验分享状态
+    """
+    cached = await asyncio.to_thread(get_cached_report, report_id)
+    if cached:
+        if owner_id is not None and cached.get("generated_by") != owner_id:
+            raise _not_found()
+        return cached
+    if owner_id is None:
+        report = await db.get(Report, report_id)
+        if not report:
+            raise _not_found()
+    else:
+        report = await _get_report(db, report_id, owner_id)
+    data = report_to_dict(report)
+    if report.status == ReportStatus.COMPLETED:
+        await asyncio.to_thread(cache_report, data)
+    return data
+
+
+@router.post("/reports", status_code=status.HTTP_202_ACCEPTED)
+async def create_report(
+    report_data: ReportCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """创建报表并提交后台生成，立即返回（状态为 pending）"""
+    report = await db.run_sync(
+        lambda s: ReportService(s).create_report(report_data.model_dump(), current_user["id"])
+    )
+    submit_report_generation(report.id)
+    return report_to_dict(report, include_content=False)
+
+
+@router.get("/reports")
+async def list_reports(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """报表列表（不含内容）"""
+    result = await db.execute(
+        select(Report).where(Report.generated_by == current_user["id"]).order_by(Report.id.desc())
+    )
+    return [report_to_dict(r, include_content=False) for r in result.scalars().all()]
+
+
+@router.get("/reports/shared/{share_token}")
+async def get_shared_report(share_token: str, db: AsyncSession = Depends(get_async_db)):
+    """通过分享链接查看已完成的报表"""
+    result = await db.execute(select(Report.id, Report.is_public, Report.share_expires_at)
+                              .where(Report.share_token == share_token))
+    row = result.first()
+    # 无时区的时间（SQLite）按本地时间比较
+    if (not row or not row.is_public
+            or (row.share_expires_at and row.share_expires_at.astimezone() < datetime.now().astimezone())):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="分享链接无效或已过期"
+        )
+    return await _report_payload(db, row.id)
+
+
+@router.get("/reports/{report_id}")
+async def get_report(
+    report_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """查看报表（含内容）"""
+    return await _report_payload(db, report_id, current_user["id"])
+
+
+@router.post("/reports/{report_id}/regenerate", status_code=status.HTTP_202_ACCEPTED)
+async def regenerate_report(
+    report_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """重新生成报表（如文件重新解析后）"""
+    report = await _get_report(db, report_id, current_user["id"])
+    if report.status in (ReportStatus.PENDING, ReportStatus.GENERATING):
+        return report_to_dict(report, include_content=False)
+    report.status = ReportStatus.PENDING
+    await db.commit()
+    await asyncio.to_thread(invalidate_report_cache, report_id)
+    submit_report_generation(report_id)
+    return report_to_dict(report, include_content=False)
+
+
+@router.post("/reports/{report_id}/share")
+async def share_report(
+    report_id: int,
+    share_data: ReportShareRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """开启/关闭分享"""
+    await _get_report(db, report_id, current_user["id"])
+    report = await db.run_sync(
+        lambda s: ReportService(s).share_report(s.get(Report, report_id), share_data.is_public,
+                                                share_data.expires_hours)
+    )
+    return report_to_dict(report, include_content=False)
+
+
+@router.delete("/reports/{report_id}")
+async def delete_report(
+    report_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """删除报表"""
+    report = await _get_report(db, report_id, current_user["id"])
+    await db.delete(report)
+    await db.commit()
+    await asyncio.to_thread(invalidate_report_cache, report_id)
+    return {"message": "报表删除成功"}
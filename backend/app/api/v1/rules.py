@@ -1,11 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from ...database import get_db
+from datetime import datetime
+from ...database import get_async_db
 from ...models.log import ParseRule, ParseRuleType
 # from ...models.user import User  # 暂时注释，使用简单认证
 # from ...auth.jwt_auth import get_current_user  # 暂时注释
 from ...services.dsl_parser import DSLRuleEngine
+from ...services.log_parser import invalidate_rule_cache
 from pydantic import BaseModel
 
 
@@ -37,7 +40,7 @@ class ParseRuleResponse(BaseModel):
     problem_description: Optional[str]
     is_active: bool
     priority: int
-    created_at: str
+    created_at: datetime
     
     class Config:
         from_attributes = True
@@ -68,7 +71,7 @@ async def test_dsl_rule(
 @router.post("/rules", response_model=ParseRuleResponse)
 async def create_rule(
     rule_data: ParseRuleCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """创建解析规则"""
@@ -104,30 +107,31 @@ async def create_rule(
     )
     
     db.add(db_rule)
-    db.commit()
-    db.refresh(db_rule)
+    await db.commit()
+    await db.refresh(db_rule)
+    invalidate_rule_cache()
     
     return db_rule
 
 
 @router.get("/rules", response_model=List[ParseRuleResponse])
 async def get_rules(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """获取所有解析规则"""
-    rules = db.query(ParseRule).order_by(ParseRule.priority.desc()).all()
-    return rules
+    result = await db.execute(select(ParseRule).order_by(ParseRule.priority.desc()))
+    return result.scalars().all()
 
 
 @router.get("/rules/{rule_id}", response_model=ParseRuleResponse)
 async def get_rule(
     rule_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """获取单个解析规则"""
-    rule = db.query(ParseRule).filter(ParseRule.id == rule_id).first()
+    rule = await db.get(ParseRule, rule_id)
     if not rule:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -140,11 +144,11 @@ async def get_rule(
 async def update_rule(
     rule_id: int,
     rule_data: ParseRuleCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """更新解析规则"""
-    rule = db.query(ParseRule).filter(ParseRule.id == rule_id).first()
+    rule = await db.get(ParseRule, rule_id)
     if not rule:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -178,8 +182,9 @@ async def update_rule(
     rule.problem_description = rule_data.problem_description
     rule.priority = rule_data.priority
     
-    db.commit()
-    db.refresh(rule)
+    await db.commit()
+    await db.refresh(rule)
+    invalidate_rule_cache()
     
     return rule
 
@@ -187,19 +192,20 @@ async def update_rule(
 @router.delete("/rules/{rule_id}")
 async def delete_rule(
     rule_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """删除解析规则"""
-    rule = db.query(ParseRule).filter(ParseRule.id == rule_id).first()
+    rule = await db.get(ParseRule, rule_id)
     if not rule:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="规则不存在"
         )
     
-    db.delete(rule)
-    db.commit()
+    await db.delete(rule)
+    await db.commit()
+    invalidate_rule_cache()
     
     return {"message": "规则删除成功"}
 
@@ -207,11 +213,11 @@ async def delete_rule(
 @router.patch("/rules/{rule_id}/toggle")
 async def toggle_rule(
     rule_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """启用/禁用规则"""
-    rule = db.query(ParseRule).filter(ParseRule.id == rule_id).first()
+    rule = await db.get(ParseRule, rule_id)
     if not rule:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -219,6 +225,7 @@ async def toggle_rule(
         )
     
     rule.is_active = not rule.is_active
-    db.commit()
+    await db.commit()
+    invalidate_rule_cache()
     
     return {"message": f"规则已{'启用' if rule.is_active else '禁用'}"}
\ No newline at end of file
@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends
+from ...database import get_pool_metrics
+
+
+router = APIRouter()
+
+
+# 简单的认证依赖（临时解决方案，与 rules 路由一致）
+def get_current_user():
+    return {"id": 1, "username": "admin"}
+
+
+@router.get("/system/db-pool")
+async def db_pool_metrics(current_user: dict = Depends(get_current_user)):
+    """数据库连接池状态：大小、已借出/空闲/溢出连接数，以及取连接等待时间统计（毫秒）；"async" 为异步引擎的连接池"""
+    return get_pool_metrics()
@@ -5,6 +5,10 @@ from typing import List
 from pydantic_settings import BaseSettings
 
 
+# 日志保留天数：内存版 main.py 的后台过期清理与 services.log_storage.apply_retention 共用；0 表示不自动清理
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "30"))
+
+
 def get_local_ip() -> str:
     """自动获取本机IPv4地址"""
     try:
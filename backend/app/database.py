@@ -1,28 +1,187 @@
-from sqlalchemy import create_engine
+import os
+import time
+import threading
+from collections import deque
+from typing import List
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 import redis
 from .config import get_settings
 
 settings = get_settings()
 
+
+def _pool_sizing(kind: str = "sync") -> dict:
+    """连接池大小：所有 uvicorn 进程的连接总数不超过 DB_MAX_CONNECTIONS（默认 90，低于 PostgreSQL 默认上限 100）。
+    每个进程的份额中，异步引擎（API 路由）占 2×DB_ASYNC_POOL_SIZE（至多一半），
+    其余给同步引擎（分析线程 + 解析流水线），默认 ANALYSIS_WORKERS + 4 个常驻连接
+    """
+    processes = max(1, int(os.environ.get("WEB_CONCURRENCY", os.environ.get("UVICORN_WORKERS", "1"))))
+    budget = max(2, int(os.environ.get("DB_MAX_CONNECTIONS", "90")) // processes)
+    async_budget = max(1, min(int(os.environ.get("DB_ASYNC_POOL_SIZE", "4")) * 2, budget // 2))
+    timeout = int(os.environ.get("DB_POOL_TIMEOUT", "30"))
+    if kind == "async":
+        pool_size = max(1, async_budget // 2)
+        return {"pool_size": pool_size, "max_overflow": async_budget - pool_size, "pool_timeout": timeout}
+    sync_budget = budget - async_budget
+    analysis_workers = int(os.environ.get("ANALYSIS_WORKERS", "2"))
+    pool_size = max(1, min(int(os.environ.get("DB_POOL_SIZE", str(analysis_workers + 4))), sync_budget))
+    max_overflow = min(int(os.environ.get("DB_MAX_OVERFLOW", str(pool_size))), sync_budget - pool_size)
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max(0, max_overflow),
+        "pool_timeout": timeout,
+    }
+
+
+def _async_url(url: str) -> str:
+    """同步连接串转换为异步驱动（asyncpg / aiosqlite）"""
+    for prefix, async_prefix in (("postgresql+psycopg2://", "postgresql+asyncpg://"),
+                                 ("postgresql://", "postgresql+asyncpg://"),
+                                 ("postgres://", "postgresql+asyncpg://"),
+                                 ("sqlite://", "sqlite+aiosqlite://")):
+        if url.startswith(prefix):
+            return async_prefix + url[len(prefix):]
+    return url
+
+
+class _PoolWaitStats:
+    """单个连接池的取连接等待统计"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waits: "deque[float]" = deque(maxlen=1000)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, waited: float, timed_out: bool) -> None:
+        with self.lock:
+            self.checkouts += 1
+            self.timeouts += int(timed_out)
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.waits.append(waited)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            waits = sorted(self.waits)
+            checkouts = self.checkouts
+            return {
+                "checkouts": checkouts,
+                "timeouts": self.timeouts,
+                "avg": round(self.total_wait / checkouts * 1000, 3) if checkouts else 0.0,
+                "max": round(self.max_wait * 1000, 3),
+                "p50_recent": round(waits[len(waits) // 2] * 1000, 3) if waits else 0.0,
+                "p95_recent": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 3) if waits else 0.0,
+            }
+
+
+class _TimedPoolMixin:
+    """记录每次取连接的等待时间（含新建连接），供 /api/v1/system/db-pool 查看。
+    统计挂在子类上（每个引擎一个池类），dispose/recreate 重建池实例后仍然累计；
+    只有等待池位超时（sqlalchemy.exc.TimeoutError）计入 timeouts，连接失败等其它异常不计
+    """
+    _stats: _PoolWaitStats
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except sa_exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self._stats.record(time.perf_counter() - start, timed_out)
+
+
+class _TimedQueuePool(_TimedPoolMixin, QueuePool):
+    """同步引擎（分析线程、解析流水线）的连接池"""
+    _stats = _PoolWaitStats()
+
+
+class _TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    """异步引擎（API 路由）的连接池"""
+    _stats = _PoolWaitStats()
+
+
 # PostgreSQL 数据库连接
-engine = create_engine(
-    settings.database_url,
-    poolclass=StaticPool,
-    echo=settings.debug,
-    future=True
-)
+if settings.database_url.startswith("sqlite"):
+    # 本地调试：SQLite 不使用连接池参数
+    engine = create_engine(
+        settings.database_url,
+        connect_args={"check_same_thread": False},
+        echo=settings.debug,
+        future=True
+    )
+else:
+    engine = create_engine(
+        settings.database_url,
+        poolclass=_TimedQueuePool,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        echo=settings.debug,
+        future=True,
+        **_pool_sizing()
+    )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 异步引擎：供 async 路由使用，数据库往返不阻塞事件循环
+if settings.database_url.startswith("sqlite"):
+    async_engine = create_async_engine(_async_url(settings.database_url), echo=settings.debug)
+else:
+    async_engine = create_async_engine(
+        _async_url(settings.database_url),
+        poolclass=_TimedAsyncQueuePool,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        echo=settings.debug,
+        **_pool_sizing("async")
+    )
+
+# expire_on_commit=False：提交后仍可直接序列化 ORM 对象（异步会话不能隐式懒加载）
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# 线程作用域会话：后台线程（分析线程池、解析流水线）各自持有独立会话，用完调用 ScopedSession.remove()
+ScopedSession = scoped_session(SessionLocal)
+
 Base = declarative_base()
 
 # Redis 连接
 redis_client = redis.from_url(settings.redis_url, decode_responses=True)
 
 
+# 已部署数据库的增量列：create_all 不会给已存在的表补列，由 upgrade_schema() 在启动时补齐。
+# (表, 列, 类型与默认值)；带默认值的列在加列时即为已有行填上该值
+SCHEMA_UPGRADES = (
+    ("log_files", "storage_mode", "VARCHAR(20) DEFAULT 'full'"),
+    ("log_entries", "message_offset", "INTEGER"),
+)
+
+
+def upgrade_schema(conn) -> List[str]:
+    """为旧库补齐 SCHEMA_UPGRADES 中缺少的列（幂等，可在每次启动时执行），返回新增的 "表.列"；调用方负责提交。
+    PostgreSQL 使用 ADD COLUMN IF NOT EXISTS，多个进程同时启动也不会冲突；表尚不存在时跳过（由建表负责）
+    """
+    added = []
+    inspector = inspect(conn)
+    tables = set(inspector.get_table_names())
+    if_not_exists = "IF NOT EXISTS " if conn.dialect.name == "postgresql" else ""
+    for table, column, ddl in SCHEMA_UPGRADES:
+        if table not in tables or column in {c["name"] for c in inspector.get_columns(table)}:
+            continue
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {if_not_exists}{column} {ddl}"))
+        added.append(f"{table}.{column}")
+    return added
+
+
 # 数据库依赖注入
 def get_db():
     db = SessionLocal()
@@ -32,6 +191,33 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def _pool_metrics(pool) -> dict:
+    metrics = {"pool_class": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, QueuePool):
+        metrics.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "max_overflow": pool._max_overflow,
+        })
+    if isinstance(pool, _TimedPoolMixin):
+        metrics["checkout_wait_ms"] = pool._stats.snapshot()
+    return metrics
+
+
+def get_pool_metrics() -> dict:
+    """连接池状态与取连接等待时间（毫秒）：顶层为同步引擎，"async" 为异步引擎（API 路由）"""
+    metrics = _pool_metrics(engine.pool)
+    metrics["async"] = _pool_metrics(async_engine.sync_engine.pool)
+    return metrics
+
+
 # Redis 依赖注入
 def get_redis():
-    return redis_client 
\ No newline at end of file
+    return redis_client
@@ -0,0 +1,78 @@
+"""
+单文件正则检索的工作进程。
+由 main.py 以 spawn 方式启动，子进程只导入本模块（不加载应用与数据索引）；
+用户提供的正则可能出现灾难性回溯，超时后由主进程直接终止进程，而不是等待匹配结束。
+"""
+import mmap
+import re
+import time
+from typing import Any, Dict, List
+
+GREP_LINE_MAX = 2000  # 单行返回的最大字符数
+
+
+def grep_text(text: str, regex, max_hits: int, deadline: float) -> Dict[str, Any]:
+    """在一段按行对齐的文本中找出命中行（每行最多报告一次）。
+    返回 hits[(块内行号0-based, 行文本)]、newlines（完整扫描时为块内换行数）与 stopped（None/max_hits/timeout）
+    """
+    hits: List[tuple] = []
+    n = len(text)
+    line = 0
+    counted = 0
+    pos = 0
+    stopped = None
+    while pos <= n:
+        m = regex.search(text, pos)
+        if not m or (m.start() == n and n and text[n - 1] == "\n"):
+            break
+        if len(hits) >= max_hits:
+            stopped = "max_hits"
+            break
+        s = text.rfind("\n", 0, m.start()) + 1
+        e = text.find("\n", m.start())
+        e = n if e < 0 else e
+        line += text.count("\n", counted, s)
+        counted = s
+        hits.append((line, text[s:e].rstrip("\r")[:GREP_LINE_MAX]))
+        pos = e + 1
+        if time.time() > deadline:
+            stopped = "timeout"
+            break
+    if stopped is None:
+        line += text.count("\n", counted)
+    return {"hits": hits, "newlines": line, "stopped": stopped}
+
+
+def grep_chunk(path: str, start: int, end: int, regex, max_hits: int, deadline: float) -> Dict[str, Any]:
+    """映射文件并扫描 [start, end) 区间"""
+    if time.time() > deadline:
+        return {"hits": [], "newlines": 0, "stopped": "timeout"}
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode("utf-8", errors="replace")
+    return grep_text(text, regex, max_hits, deadline)
+
+
+def serve(conn):
+    """工作进程主循环：接收任务 {"path"|"text", "start", "end", "pattern", "flags", "max_hits", "deadline"}，
+    回复 ("ok", 结果) 或 ("error", 信息)；管道关闭时退出
+    """
+    compiled: Dict[tuple, Any] = {}
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            key = (job["pattern"], job["flags"])
+            regex = compiled.get(key)
+            if regex is None:
+                if len(compiled) > 32:
+                    compiled.clear()
+                regex = compiled[key] = re.compile(job["pattern"], job["flags"])
+            if job.get("path") is None:
+                res = grep_text(job["text"], regex, job["max_hits"], job["deadline"])
+            else:
+                res = grep_chunk(job["path"], job["start"], job["end"], regex, job["max_hits"], job["deadline"])
+            conn.send(("ok", res))
+        except Exception as e:
+            conn.send(("error", str(e)))
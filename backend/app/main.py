@@ -1,6 +1,6 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Body, Header
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Body, Header, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response, FileResponse
 import uvicorn
 import os
 from typing import List, Dict, Any, Optional
@@ -9,19 +9,46 @@ from datetime import datetime, timedelta
 from pydantic import BaseModel
 import re
 import uuid
+import hashlib
 from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
 import bisect
+import heapq
+import itertools
+import asyncio
+import mmap
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+import sqlite3
+import time
+from array import array
+
+try:
+    from . import grep_worker
+    from .config import LOG_RETENTION_DAYS
+except ImportError:  # 以顶层模块 main 导入时（如根目录测试）
+    import grep_worker
+    from config import LOG_RETENTION_DAYS
 
 # 暂时注释掉数据库相关导入，等依赖安装好后再启用
 # from .api.v1 import rules as rules_router
+# from .api.v1 import system as system_router
+# from .api.v1 import files as files_router
+# from .api.v1 import reports as reports_router
 
 # 可存储内容的最大字节数（默认20MB，可通过环境变量覆盖）
 MAX_CONTENT_BYTES = int(os.environ.get("MAX_CONTENT_BYTES", str(20 * 1024 * 1024)))
+# 上传时每次读取/写盘的块大小
+UPLOAD_CHUNK_BYTES = int(os.environ.get("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
 
 # 会话有效期
 DEFAULT_TTL_HOURS = 24
 REMEMBER_TTL_DAYS = 30
-RETENTION_DAYS = int(os.environ.get("LOG_RETENTION_DAYS", "30"))  # 日志保留天数
+RETENTION_DAYS = LOG_RETENTION_DAYS  # 日志保留天数（0 表示不自动清理）
+PURGE_INTERVAL_SECONDS = int(os.environ.get("LOG_PURGE_INTERVAL", "600"))  # 后台清理间隔
+PURGE_BATCH = int(os.environ.get("LOG_PURGE_BATCH", "200"))  # 每批最多删除文件数
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -39,8 +66,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# multipart 请求体中除文件内容外的边界、表单头等开销上限
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+
+class UploadSizeLimitMiddleware:
+    """在 Starlette 解析（缓存到内存/临时文件）multipart 请求体之前限制上传大小：
+    Content-Length 超限直接返回 413；未声明长度（chunked）时边接收边计数，超限即中止读取
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != "/api/logs/upload":
+            await self.app(scope, receive, send)
+            return
+        limit = MAX_CONTENT_BYTES + UPLOAD_FORM_OVERHEAD
+        detail = f"文件过大，最大支持 {int(MAX_CONTENT_BYTES/1024/1024)}MB"
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # 暂时注释掉API路由注册，等依赖安装好后再启用
 # app.include_router(rules_router.router, prefix="/api/v1", tags=["规则管理"])
+# app.include_router(system_router.router, prefix="/api/v1", tags=["系统状态"])
+# app.include_router(files_router.router, prefix="/api/v1", tags=["日志文件"])
+# app.include_router(reports_router.router, prefix="/api/v1", tags=["报表"])
 
 # 内存存储（临时）
 uploaded_files: List[Dict[str, Any]] = []
@@ -219,6 +287,158 @@ def _compile_dsl(rule_id: Any, expr: str):
     DSL_CACHE[key] = c
     return c
 
+# —— 块级三元组布隆跳过索引：上传后为每个约64KB（按行对齐）的块记录一个 trigram 布隆过滤器 ——
+SKIP_BLOCK_BYTES = 64 * 1024
+_BLOOM_BITS = 1 << 15  # 每块 4KB
+_BLOOM_MASK = _BLOOM_BITS - 1
+
+def _trigram_bits(v: int):
+    # 两个哈希位置（k=2）
+    return (v * 2654435761) & _BLOOM_MASK, ((v ^ (v >> 11)) * 40503 + 0x9E37) & _BLOOM_MASK
+
+# re.IGNORECASE 下与 ASCII 字母等价、但 str.lower() 之后仍不是 ASCII 的字符（ı、ſ）；
+# 另两个等价字符 İ、K（KELVIN SIGN）经 str.lower() 已变为 i̇、k
+_ASCII_CASE_FOLD = str.maketrans({"\u0131": "i", "\u017f": "s"})
+SKIP_INDEX_VERSION = 2
+
+def _block_bloom(block: bytes) -> bytearray:
+    # 与匹配时看到的文本保持一致：按 errors="ignore" 解码后 str.lower()（块按行对齐，解码结果与逐行解码相同）；
+    # 含非 ASCII 字符时再加入折叠为 ASCII 字母后的三元组，覆盖 re.IGNORECASE 的等价字符
+    text = block.decode("utf-8", errors="ignore").lower()
+    variants = [text.encode("utf-8")]
+    if not text.isascii() and ("\u0131" in text or "\u017f" in text):
+        variants.append(text.translate(_ASCII_CASE_FOLD).encode("utf-8"))
+    bits = bytearray(_BLOOM_BITS >> 3)
+    for data in variants:
+        for t in {data[i:i + 3] for i in range(len(data) - 2)}:
+            for h in _trigram_bits((t[0] << 16) | (t[1] << 8) | t[2]):
+                bits[h >> 3] |= 1 << (h & 7)
+    return bits
+
+def _phrase_trigrams(phrase: str) -> List[int]:
+    """短语的 ASCII 三元组（非 ASCII 字符大小写折叠与字节级不一致，不参与过滤）"""
+    b = (phrase or "").lower().encode("utf-8")
+    return [(b[i] << 16) | (b[i + 1] << 8) | b[i + 2]
+            for i in range(len(b) - 2) if b[i] < 0x80 and b[i + 1] < 0x80 and b[i + 2] < 0x80]
+
+def _skip_index_path(file_id: int) -> str:
+    return os.path.join(SKIP_INDEX_DIR, f"{file_id}.skip")
+
+def build_skip_index(file_info: Dict[str, Any]):
+    """为上传文件生成块级跳过索引：首行 JSON 头（块起始行号），其后为各块定长布隆位图"""
+    path = file_info.get("path")
+    if not path or not os.path.exists(path):
+        return
+    try:
+        st = os.stat(path)
+        starts: List[int] = []
+        blooms: List[bytes] = []
+        line = 0
+        with open(path, "rb") as fh:
+            pending = b""
+            while True:
+                chunk = fh.read(SKIP_BLOCK_BYTES)
+                buf = pending + chunk
+                if not buf:
+                    break
+                cut = buf.rfind(b"\n") + 1 if chunk else len(buf)
+                if cut == 0:
+                    # 超长行：继续累积直到出现换行，保证块按行对齐
+                    pending = buf
+                    continue
+                block, pending = buf[:cut], buf[cut:]
+                starts.append(line)
+                blooms.append(bytes(_block_bloom(block)))
+                line += block.count(b"\n")
+                if not chunk:
+                    break
+        os.makedirs(SKIP_INDEX_DIR, exist_ok=True)
+        tmp = _skip_index_path(file_info["id"]) + ".tmp"
+        with open(tmp, "wb") as fw:
+            header = {"version": SKIP_INDEX_VERSION, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "newlines": line,
+                      "bloom_bytes": _BLOOM_BITS >> 3, "starts": starts}
+            fw.write(json.dumps(header).encode("utf-8") + b"\n")
+            for b in blooms:
+                fw.write(b)
+        os.replace(tmp, _skip_index_path(file_info["id"]))
+    except Exception as e:
+        print(f"建立跳过索引失败 {file_info.get('id')}: {e}")
+
+def load_skip_index(file_info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """读取跳过索引；文件大小/修改时间不一致（索引过期）或索引格式版本不同时返回 None"""
+    try:
+        path = file_info.get("path")
+        st = os.stat(path)
+        with open(_skip_index_path(file_info["id"]), "rb") as fr:
+            header = json.loads(fr.readline())
+            if (header.get("version") != SKIP_INDEX_VERSION
+                    or header["size"] != st.st_size or header["mtime_ns"] != st.st_mtime_ns):
+                return None
+            n = header["bloom_bytes"]
+            data = fr.read()
+        header["blooms"] = [data[i * n:(i + 1) * n] for i in range(len(header["starts"]))]
+        return header
+    except Exception:
+        return None
+
+def remove_skip_index(file_id: int):
+    try:
+        p = _skip_index_path(file_id)
+        if os.path.exists(p):
+            os.remove(p)
+    except Exception:
+        pass
+
+def _bloom_maybe(bloom: bytes, trigrams: List[int]) -> bool:
+    for v in trigrams:
+        for h in _trigram_bits(v):
+            if not bloom[h >> 3] & (1 << (h & 7)):
+                return False
+    return True
+
+def _ast_maybe(ast: Optional[_Ast], bloom: bytes, tri: Dict[str, List[int]]) -> bool:
+    """块内是否可能存在命中行：短语三元组全部在布隆中；NOT 无法据此排除"""
+    if ast is None:
+        return False
+    if ast.op is None:
+        return _bloom_maybe(bloom, tri.setdefault(ast.value or "", _phrase_trigrams(ast.value or "")))
+    if ast.op == "NOT":
+        return True
+    if ast.op == "AND":
+        return _ast_maybe(ast.left, bloom, tri) and _ast_maybe(ast.right, bloom, tri)
+    return _ast_maybe(ast.left, bloom, tri) or _ast_maybe(ast.right, bloom, tri)
+
+def _literal_alternatives(patterns: List[str], is_regex: bool) -> Optional[List[str]]:
+    """把 OR 规则还原为字面量列表；含正则元字符时返回 None（不做块过滤）"""
+    out: List[str] = []
+    for p in patterns:
+        if not is_regex:
+            out.append(p)
+            continue
+        for alt in p.split("|"):
+            if not alt or re.search(r"[\\.^$*+?{}\[\]()]", alt):
+                return None
+            out.append(alt)
+    return out
+
+def _candidate_line_spans(skip: Optional[Dict[str, Any]], maybe, n_lines: int) -> Optional[List[tuple]]:
+    """按块过滤，返回需要扫描的行区间 [start, end)（已合并相邻块）；无索引时返回 None"""
+    if not skip:
+        return None
+    starts = skip["starts"]
+    spans: List[tuple] = []
+    for i, bloom in enumerate(skip["blooms"]):
+        if not maybe(bloom):
+            continue
+        a = starts[i]
+        b = starts[i + 1] if i + 1 < len(starts) else n_lines
+        a, b = min(a, n_lines), min(b, n_lines)
+        if spans and spans[-1][1] == a:
+            spans[-1] = (spans[-1][0], b)
+        elif a < b:
+            spans.append((a, b))
+    return spans
+
 def evaluate_rule_matches(content: str, rule: Dict[str, Any], pre: Optional[Dict[str, Any]] = None) -> List[Any]:
     """根据规则返回匹配列表。支持 DSL(| & ! () 和引号短语)；
     若未检测到DSL符号，则回退到旧的 OR/AND/NOT/正则 行为。
@@ -239,34 +459,42 @@ def evaluate_rule_matches(content: str, rule: Dict[str, Any], pre: Optional[Dict
         compiled = _compile_dsl(rule.get('id','0'), expr)
         tokens = compiled["tokens"]
         ast = compiled["ast"]
+        # 构造一个与正则匹配对象类似的轻量对象
+        class M:
+            def __init__(self, s, e, g):
+                self._s=s; self._e=e; self._g=g
+            def start(self): return self._s
+            def end(self): return self._e
+            def group(self): return self._g
+        # 借助跳过索引只扫描可能命中的块
+        tri: Dict[str, List[int]] = {}
+        spans = _candidate_line_spans(prectx.get("skip"), lambda b: _ast_maybe(ast, b, tri), len(lines))
+        if spans is None:
+            spans = [(0, len(lines))]
+        newline_positions = prectx["newline_positions"]
         # 按行评估
         matches = []
-        offset = 0
         matched_lines = 0
-        for idx, line_lower in enumerate(lines_lower):
-            if _eval_ast(ast, line_lower):
-                matched_lines += 1
-                # 代表性的命中位置：取任意短语首次出现
-                pos = 0
-                found = False
-                for p in compiled["phrases"]:
-                    pl = p.lower()
-                    k = line_lower.find(pl)
-                    if k >= 0:
-                        pos = k
-                        found = True
-                        break
-                start_index = offset + (pos if found else 0)
-                end_index = start_index + (len(compiled["phrases"][0]) if (found and compiled["phrases"]) else max(1, len(lines[idx])))
-                # 构造一个与正则匹配对象类似的轻量对象
-                class M:
-                    def __init__(self, s, e, g):
-                        self._s=s; self._e=e; self._g=g
-                    def start(self): return self._s
-                    def end(self): return self._e
-                    def group(self): return lines[idx].strip()
-                matches.append(M(start_index, end_index, lines[idx].strip()))
-            offset += len(lines[idx]) + 1
+        for span_start, span_end in spans:
+            offset = newline_positions[span_start - 1] + 1 if span_start > 0 else 0
+            for idx in range(span_start, span_end):
+                line_lower = lines_lower[idx]
+                if _eval_ast(ast, line_lower):
+                    matched_lines += 1
+                    # 代表性的命中位置：取任意短语首次出现
+                    pos = 0
+                    found = False
+                    for p in compiled["phrases"]:
+                        pl = p.lower()
+                        k = line_lower.find(pl)
+                        if k >= 0:
+                            pos = k
+                            found = True
+                            break
+                    start_index = offset + (pos if found else 0)
+                    end_index = start_index + (len(compiled["phrases"][0]) if (found and compiled["phrases"]) else max(1, len(lines[idx])))
+                    matches.append(M(start_index, end_index, lines[idx].strip()))
+                offset += len(lines[idx]) + 1
         return matches
 
     # —— 旧逻辑回退（保留向后兼容） ——
@@ -297,7 +525,21 @@ def evaluate_rule_matches(content: str, rule: Dict[str, Any], pre: Optional[Dict
             else:
                 union = "|".join(re.escape(p) for p in patterns)
                 reg = re.compile(union, re.IGNORECASE)
-            flat = list(reg.finditer(content))
+            # 纯字面量的 OR 规则可借助跳过索引只扫描可能命中的块
+            spans = None
+            literals = _literal_alternatives(patterns, is_regex)
+            if literals is not None:
+                tris = [_phrase_trigrams(lit) for lit in literals]
+                spans = _candidate_line_spans(prectx.get("skip"), lambda b: any(_bloom_maybe(b, t) for t in tris), len(lines))
+            if spans is None:
+                flat = list(reg.finditer(content))
+            else:
+                nl = prectx["newline_positions"]
+                flat = []
+                for span_start, span_end in spans:
+                    pos = nl[span_start - 1] + 1 if span_start > 0 else 0
+                    endpos = nl[span_end - 1] if span_end - 1 < len(nl) else len(content)
+                    flat.extend(reg.finditer(content, pos, endpos))
             # 保护：零宽匹配只取首个，避免 O(n) 命中
             if flat and any((m.end() - m.start()) == 0 for m in flat):
                 return flat[:1]
@@ -331,6 +573,7 @@ ANALYSIS_RUNS_PATH = os.path.join(DATA_DIR, "analysis_runs.json")
 PROBLEMS_PATH = os.path.join(DATA_DIR, "problems.json")
 RULES_PATH = os.path.join(DATA_DIR, "detection_rules.json")  # 新增规则持久化路径
 USERS_PATH = os.path.join(DATA_DIR, "users.json")
+SKIP_INDEX_DIR = os.path.join(DATA_DIR, "skip_index")  # 块级跳过索引
 
 os.makedirs(FILES_DIR, exist_ok=True)
 
@@ -391,18 +634,39 @@ except Exception:
     ]
 
 
-def save_index():
+# 索引写入：后台线程写的是事件循环上取的快照，写入前比较快照序号，不让较旧的快照覆盖较新的内容；
+# 先写临时文件再替换，并发写入不会留下残缺的索引文件
+_INDEX_SAVE_LOCK = threading.Lock()
+_index_saved_seq: Dict[str, int] = {}
+_index_seq = itertools.count(1)
+
+def snapshot_indexes() -> tuple:
+    """在事件循环上复制文件索引与分析结果，返回 (序号, 文件索引, 分析结果)，交给后台线程写入"""
+    return next(_index_seq), [dict(f) for f in uploaded_files], list(analysis_results)
+
+def _write_index(path: str, data: Any, seq: Optional[int]):
+    with _INDEX_SAVE_LOCK:
+        if seq is None:
+            seq = next(_index_seq)
+        if _index_saved_seq.get(path, 0) > seq:
+            return
+        _index_saved_seq[path] = seq
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+def save_index(files: Optional[List[Dict[str, Any]]] = None, seq: Optional[int] = None):
+    """files/seq 来自 snapshot_indexes()；不传时写当前 uploaded_files（须在事件循环上调用）"""
     try:
         os.makedirs(DATA_DIR, exist_ok=True)
-        with open(INDEX_PATH, "w", encoding="utf-8") as f:
-            json.dump(uploaded_files, f, ensure_ascii=False, indent=2)
+        _write_index(INDEX_PATH, uploaded_files if files is None else files, seq)
     except Exception:
         pass
 
-def save_analysis_index():
+def save_analysis_index(results: Optional[List[Dict[str, Any]]] = None, seq: Optional[int] = None):
     try:
-        with open(ANALYSIS_INDEX_PATH, "w", encoding="utf-8") as f:
-            json.dump(analysis_results, f, ensure_ascii=False, indent=2)
+        _write_index(ANALYSIS_INDEX_PATH, analysis_results if results is None else results, seq)
     except Exception:
         pass
 
@@ -452,35 +716,86 @@ def load_rules():
     except Exception as e:
         print(f"加载规则失败: {e}")
 
-def purge_old_uploads():
-    """清理超过保留期的日志文件及分析结果"""
-    global uploaded_files, analysis_results
+# —— 保留期清理：按过期时间排序的小顶堆，后台批量删除 ——
+# 堆元素：(过期时间戳, file_id, upload_time)；upload_time 用于识别已删除/ID复用的陈旧条目
+RETENTION_HEAP: List[tuple] = []
+_retention_task: Optional[asyncio.Task] = None
+
+def _retention_expiry(upload_time: str) -> float:
+    if RETENTION_DAYS <= 0:
+        return float("inf")
     try:
-        cutoff = datetime.now() - timedelta(days=RETENTION_DAYS)
-        remain = []
-        removed_ids = set()
-        for f in uploaded_files:
-            try:
-                ts = datetime.fromisoformat(f.get("upload_time", ""))
-            except Exception:
-                ts = datetime.now()
-            if ts < cutoff:
-                removed_ids.add(f.get("id"))
-                p = f.get("path")
-                try:
-                    if p and os.path.exists(p):
-                        os.remove(p)
-                except Exception:
-                    pass
-            else:
-                remain.append(f)
-        if removed_ids:
-            uploaded_files = remain
-            analysis_results = [r for r in analysis_results if r.get("file_id") not in removed_ids]
-            save_index()
-            save_analysis_index()
+        ts = datetime.fromisoformat(upload_time)
     except Exception:
-        pass
+        ts = datetime.now()
+    return (ts + timedelta(days=RETENTION_DAYS)).timestamp()
+
+def schedule_retention(file_info: Dict[str, Any]):
+    """登记文件的过期时间（上传时调用，O(log n)）"""
+    ut = file_info.get("upload_time", "")
+    heapq.heappush(RETENTION_HEAP, (_retention_expiry(ut), file_info.get("id"), ut))
+
+def rebuild_retention_heap():
+    """启动时根据索引一次性构建过期堆"""
+    RETENTION_HEAP.clear()
+    for f in uploaded_files:
+        ut = f.get("upload_time", "")
+        RETENTION_HEAP.append((_retention_expiry(ut), f.get("id"), ut))
+    heapq.heapify(RETENTION_HEAP)
+
+def _pop_expired(now: float, batch: int) -> Dict[Any, str]:
+    """弹出至多 batch 个已过期条目，返回 {file_id: upload_time}"""
+    expired: Dict[Any, str] = {}
+    while RETENTION_HEAP and RETENTION_HEAP[0][0] <= now and len(expired) < batch:
+        _, fid, ut = heapq.heappop(RETENTION_HEAP)
+        expired[fid] = ut
+    return expired
+
+def _remove_files_and_save(removed: List[Dict[str, Any]], snapshot: tuple):
+    for f in removed:
+        p = f.get("path")
+        try:
+            evict_mapped(p)
+            if p and os.path.exists(p):
+                os.remove(p)
+        except Exception:
+            pass
+    remove_from_search_index([f.get("id") for f in removed])
+    for f in removed:
+        remove_skip_index(f.get("id"))
+    seq, files, results = snapshot
+    save_index(files, seq)
+    save_analysis_index(results, seq)
+
+async def purge_old_uploads(batch: int = PURGE_BATCH) -> int:
+    """清理超过保留期的日志文件及分析结果（单批），返回删除数量"""
+    global uploaded_files, analysis_results
+    expired = _pop_expired(datetime.now().timestamp(), batch)
+    if not expired:
+        return 0
+    # 只删除 upload_time 仍一致的记录；已被手动删除或 ID 复用的条目直接丢弃
+    removed = [f for f in uploaded_files if expired.get(f.get("id"), None) == f.get("upload_time", "")]
+    if not removed:
+        return 0
+    removed_ids = {f.get("id") for f in removed}
+    # 与 delete_log_file 相同：分钟汇总在释放 ID 之前同步删除，避免误删复用该 ID 的新文件的汇总
+    remove_rollups(list(removed_ids))
+    uploaded_files = [f for f in uploaded_files if f.get("id") not in removed_ids]
+    analysis_results = [r for r in analysis_results if r.get("file_id") not in removed_ids]
+    # 上传/删除在事件循环上修改 uploaded_files，后台线程只序列化此处取的快照
+    await asyncio.to_thread(_remove_files_and_save, removed, snapshot_indexes())
+    return len(removed)
+
+async def _retention_loop():
+    while True:
+        try:
+            # 堆顶仍已过期说明还有积压，逐批清理，批间让出事件循环
+            while RETENTION_HEAP and RETENTION_HEAP[0][0] <= datetime.now().timestamp():
+                await purge_old_uploads()
+                await asyncio.sleep(0)
+        except Exception as e:
+            print(f"过期清理失败: {e}")
+        await asyncio.sleep(PURGE_INTERVAL_SECONDS)
 
 # 简易用户模型与内存用户表
 class UserCreate(BaseModel):
@@ -506,11 +821,18 @@ class ChangePasswordPayload(BaseModel):
     new_password: str
 
 
-# 在应用启动时执行一次过期清理，避免导入阶段调用
+# 在应用启动时启动后台过期清理，避免导入阶段调用
 @app.on_event("startup")
 async def _startup_cleanup():
-    purge_old_uploads()
     load_rules()  # 启动时加载保存的规则
+    rebuild_retention_heap()
+    EXECUTOR.submit(_backfill_indexes)
+    global _retention_task
+    _retention_task = asyncio.create_task(_retention_loop())
+
+@app.on_event("shutdown")
+async def _shutdown_pools():
+    _GREP_POOL.shutdown()
 
 # 规则与文件夹模型
 class RuleCreate(BaseModel):
@@ -850,21 +1172,40 @@ async def get_dashboard_stats(ctx: Dict[str, Any] = Depends(require_auth)):
 # 日志管理
 @app.post("/api/logs/upload")
 async def upload_log_file(file: UploadFile = File(...), ctx: Dict[str, Any] = Depends(require_auth)):
+    # 请求体大小已由 UploadSizeLimitMiddleware 在解析前限制；这里分块写盘，边写边计算哈希与行数。
+    # 按原始字节保存（不再转码为 UTF-8），下载接口返回原文件；预览/分析读取时以 errors="ignore" 解码，结果与转码保存一致
+    tmp_path = os.path.join(FILES_DIR, f".upload_{uuid.uuid4().hex}.part")
     try:
         # 放宽文件类型限制：接受所有类型
-        content = await file.read()
-        if len(content) > MAX_CONTENT_BYTES:
-            raise HTTPException(status_code=400, detail=f"文件过大，最大支持 {int(MAX_CONTENT_BYTES/1024/1024)}MB")
-        content_str = content.decode('utf-8', errors='ignore')
+        size = 0
+        lines = 0
+        last = b""
+        digest = hashlib.sha256()
+        with open(tmp_path, "wb") as fw:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_CONTENT_BYTES:
+                    raise HTTPException(status_code=400, detail=f"文件过大，最大支持 {int(MAX_CONTENT_BYTES/1024/1024)}MB")
+                digest.update(chunk)
+                lines += chunk.count(b"\n")
+                last = chunk[-1:]
+                await asyncio.to_thread(fw.write, chunk)
+        if size and last != b"\n":
+            lines += 1
+        # 写盘完成后再分配ID，避免并发上传期间ID冲突
         file_id = (max([f["id"] for f in uploaded_files]) + 1) if uploaded_files else 1
         filename = file.filename
         save_path = os.path.join(FILES_DIR, f"{file_id}_{filename}")
-        with open(save_path, "w", encoding="utf-8", errors="ignore") as fw:
-            fw.write(content_str)
+        os.replace(tmp_path, save_path)
         file_info = {
             "id": file_id,
             "filename": filename,
-            "size": len(content),
+            "size": size,
+            "lines": lines,
+            "sha256": digest.hexdigest(),
             "upload_time": datetime.now().isoformat(),
             "path": save_path,
             "status": "uploaded",
@@ -872,11 +1213,19 @@ async def upload_log_file(file: UploadFile = File(...), ctx: Dict[str, Any] = De
         }
         uploaded_files.append(file_info)
         save_index()
-        # 上传后也清理一次过期数据
-        purge_old_uploads()
-        return {"message": "文件上传成功", "file_id": file_info["id"], "filename": filename, "size": len(content)}
+        schedule_retention(file_info)
+        EXECUTOR.submit(_index_uploaded_file, file_info)
+        return {"message": "文件上传成功", "file_id": file_info["id"], "filename": filename, "size": size, "lines": lines, "sha256": file_info["sha256"]}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"文件上传失败: {str(e)}")
+    finally:
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        except Exception:
+            pass
 
 @app.get("/api/logs")
 async def get_uploaded_files(ctx: Dict[str, Any] = Depends(require_auth)):
@@ -891,26 +1240,93 @@ async def get_uploaded_files(ctx: Dict[str, Any] = Depends(require_auth)):
 
 @app.get("/api/logs/{file_id}")
 async def get_log_file(file_id: int, ctx: Dict[str, Any] = Depends(require_auth)):
+    """仅返回文件元数据；原始内容通过 /api/logs/{file_id}/raw 获取"""
     f = next((x for x in uploaded_files if x["id"] == file_id), None)
     if not f:
         raise HTTPException(status_code=404, detail="文件不存在")
     is_admin = (str(ctx["user"].get("username", "")).lower() == "admin")
     if not is_admin and f.get("owner_id", 1) != ctx["user"]["id"]:
         raise HTTPException(status_code=403, detail="无权访问该文件")
-    content = ""
-    try:
-        with open(f.get("path"), "r", encoding="utf-8", errors="ignore") as fr:
-            content = fr.read(MAX_CONTENT_BYTES)
-    except Exception:
-        content = f.get("content", "")  # 向后兼容
     return {
         "id": f["id"],
         "filename": f["filename"],
         "size": f["size"],
+        "lines": f.get("lines"),
+        "sha256": f.get("sha256"),
         "upload_time": f["upload_time"],
-        "content": content
+        "raw_url": f"/api/logs/{file_id}/raw",
     }
 
+RAW_CHUNK_BYTES = 64 * 1024
+
+def _parse_byte_range(header: str, total: int) -> Optional[tuple]:
+    """解析单个 bytes 区间，返回闭区间 (start, end)；多区间只取第一个。无法满足时抛出 416"""
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    first = spec.split(",")[0].strip()
+    a, _, b = first.partition("-")
+    try:
+        if a == "":
+            n = int(b)
+            start, end = max(0, total - n), total - 1
+        else:
+            start = int(a)
+            end = min(int(b), total - 1) if b else total - 1
+    except ValueError:
+        return None
+    if start >= total or start > end:
+        raise HTTPException(status_code=416, detail="请求的范围无效", headers={"Content-Range": f"bytes */{total}"})
+    return start, end
+
+async def _iter_file_range(path: str, start: int, end: int):
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = await asyncio.to_thread(fh.read, min(RAW_CHUNK_BYTES, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+@app.get("/api/logs/{file_id}/raw")
+async def download_log_file(request: Request, file_id: int, download: bool = False, ctx: Dict[str, Any] = Depends(require_auth)):
+    """原始日志内容：整文件用 FileResponse 直接从磁盘分块发送，支持 Range（206）与条件请求（304）"""
+    f = next((x for x in uploaded_files if x["id"] == file_id), None)
+    if not f:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    is_admin = (str(ctx["user"].get("username", "")).lower() == "admin")
+    if not is_admin and f.get("owner_id", 1) != ctx["user"]["id"]:
+        raise HTTPException(status_code=403, detail="无权访问该文件")
+    media_type = "text/plain"
+    path = f.get("path")
+    if not path or not os.path.exists(path):
+        # 向后兼容：粘贴文本分析的记录只存在于内存
+        return Response(content=f.get("content", ""), media_type=media_type)
+    st = os.stat(path)
+    etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+    }
+    if download:
+        headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(f.get('filename') or str(file_id))}"
+    if _not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+    rng = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if rng and st.st_size and (not if_range or if_range.strip() == etag):
+        span = _parse_byte_range(rng, st.st_size)
+        if span:
+            start, end = span
+            headers["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(_iter_file_range(path, start, end), status_code=206, media_type=media_type, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=st)
+
 @app.delete("/api/logs/{file_id}")
 async def delete_log_file(file_id: int, ctx: Dict[str, Any] = Depends(require_auth)):
     global uploaded_files, analysis_results
@@ -920,21 +1336,178 @@ async def delete_log_file(file_id: int, ctx: Dict[str, Any] = Depends(require_au
     is_admin = (str(ctx["user"].get("username", "")).lower() == "admin")
     if not is_admin and target.get("owner_id", 1) != ctx["user"]["id"]:
         raise HTTPException(status_code=403, detail="无权删除该文件")
+    # ID 按 max+1 分配，删除后可能立即被新上传复用：分钟汇总在释放 ID 的同一步同步删除，
+    # 放到后台执行会在新文件分析完成后误删它的汇总
+    remove_rollups([file_id])
     uploaded_files = [f for f in uploaded_files if f["id"] != file_id]
     analysis_results = [r for r in analysis_results if r.get("file_id") != file_id]
     try:
+        evict_mapped(target.get("path"))
         if target.get("path") and os.path.exists(target["path"]):
             os.remove(target["path"])
     except Exception:
         pass
+    EXECUTOR.submit(remove_from_search_index, [file_id])
+    remove_skip_index(file_id)
     save_index()
     save_analysis_index()
     return {"message": "文件已删除"}
 
+# —— 预览：按文件缓存 mmap 与稀疏行索引 ——
+PREVIEW_MAX_BYTES = 1024 * 1024  # 每次预览上限1MB
+PREVIEW_MMAP_CACHE_SIZE = int(os.environ.get("PREVIEW_MMAP_CACHE", "16"))
+_LINE_INDEX_BLOCK = 64 * 1024  # 行索引检查点间隔（字节）
+
+class _MappedFile:
+    """只读 mmap + 按块累计换行数的稀疏行索引（按需向后扩展）"""
+    def __init__(self, path: str, st: os.stat_result):
+        self.path = path
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.mtime_ns = st.st_mtime_ns
+        self._fh = open(path, "rb")
+        self.mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        # cum[i] = 偏移 i*_LINE_INDEX_BLOCK 之前的换行符数量
+        self.cum = [0]
+
+    def close(self):
+        try:
+            self.mm.close()
+        finally:
+            self._fh.close()
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.size:x}-{self.mtime_ns:x}"'
+
+    @property
+    def fully_indexed(self) -> bool:
+        return (len(self.cum) - 1) * _LINE_INDEX_BLOCK >= self.size
+
+    @property
+    def total_lines(self) -> Optional[int]:
+        if not self.fully_indexed:
+            return None
+        n = self.cum[-1]
+        return n + 1 if self.size and self.mm[self.size - 1:self.size] != b"\n" else n
+
+    def _extend_until(self, newlines: int):
+        while self.cum[-1] < newlines and not self.fully_indexed:
+            b = (len(self.cum) - 1) * _LINE_INDEX_BLOCK
+            self.cum.append(self.cum[-1] + self.mm[b:b + _LINE_INDEX_BLOCK].count(b"\n"))
+
+    def line_offset(self, line: int) -> int:
+        """返回第 line 行（0-based）的起始偏移；超出末尾时返回文件大小"""
+        if line <= 0:
+            return 0
+        self._extend_until(line)
+        # 最后一个满足 cum[i] < line 的块，从块首向后数剩余的换行
+        i = bisect.bisect_left(self.cum, line) - 1
+        if i < 0 or i >= len(self.cum) - 1 and self.cum[-1] < line:
+            return self.size
+        pos = i * _LINE_INDEX_BLOCK
+        for _ in range(line - self.cum[i]):
+            k = self.mm.find(b"\n", pos)
+            if k < 0:
+                return self.size
+            pos = k + 1
+        return pos
+
+_MMAP_CACHE: "OrderedDict[str, _MappedFile]" = OrderedDict()
+_MMAP_LOCK = threading.Lock()
+
+def _get_mapped(path: str) -> Optional[_MappedFile]:
+    """获取（或重建）文件的 mmap 缓存；文件大小或修改时间变化时失效。调用方需持有 _MMAP_LOCK"""
+    st = os.stat(path)
+    mf = _MMAP_CACHE.get(path)
+    if mf and (mf.size != st.st_size or mf.mtime_ns != st.st_mtime_ns):
+        _MMAP_CACHE.pop(path, None)
+        mf.close()
+        mf = None
+    if mf is None:
+        if st.st_size == 0:
+            return None
+        mf = _MappedFile(path, st)
+        _MMAP_CACHE[path] = mf
+        while len(_MMAP_CACHE) > PREVIEW_MMAP_CACHE_SIZE:
+            _, old = _MMAP_CACHE.popitem(last=False)
+            old.close()
+    else:
+        _MMAP_CACHE.move_to_end(path)
+    return mf
+
+def evict_mapped(path: Optional[str]):
+    """删除文件前释放其 mmap（Windows 下映射中的文件无法删除）"""
+    if not path:
+        return
+    with _MMAP_LOCK:
+        mf = _MMAP_CACHE.pop(path, None)
+        if mf:
+            mf.close()
+
+def _utf8_boundary(buf, pos: int, lo: int) -> int:
+    """将切分点回退到 UTF-8 字符边界（不早于 lo）"""
+    while pos > lo and (buf[pos] & 0xC0) == 0x80:
+        pos -= 1
+    return pos
+
+def _line_aligned_window(buf, total: int, offset: int, size: int):
+    """按字节窗口取片段：起点对齐到行首，终点对齐到窗口内最后一个换行之后"""
+    offset = max(0, min(int(offset), total))
+    if 0 < offset < total and buf[offset - 1:offset] != b"\n":
+        k = buf.find(b"\n", offset, min(total, offset + PREVIEW_MAX_BYTES))
+        offset = k + 1 if k >= 0 else _utf8_boundary(buf, offset, 0)
+    end = min(total, offset + size)
+    if end < total:
+        k = buf.rfind(b"\n", offset, end)
+        # 单行超过窗口时只能在行内切分，至少保证不切断多字节字符
+        end = k + 1 if k >= 0 else _utf8_boundary(buf, end, offset + 1)
+    return offset, end
+
+def _preview_slice(mf: _MappedFile, offset: int, size: int, start_line: Optional[int], line_count: int) -> Dict[str, Any]:
+    if start_line is not None:
+        start_line = max(1, int(start_line))
+        begin = mf.line_offset(start_line - 1)
+        stop = min(mf.line_offset(start_line - 1 + max(1, int(line_count))), begin + size)
+        if stop < mf.size and stop > begin and mf.mm[stop - 1:stop] != b"\n":
+            k = mf.mm.rfind(b"\n", begin, stop)
+            stop = k + 1 if k >= 0 else _utf8_boundary(mf.mm, stop, begin + 1)
+        data = mf.mm[begin:stop]
+        return {
+            "offset": begin, "next_offset": stop,
+            "start_line": start_line, "next_line": start_line + data.count(b"\n"),
+            "data": data,
+        }
+    begin, stop = _line_aligned_window(mf.mm, mf.size, offset, size)
+    return {"offset": begin, "next_offset": stop, "data": mf.mm[begin:stop]}
+
+def _read_preview(path: str, offset: int, size: int, start_line: Optional[int], line_count: int):
+    with _MMAP_LOCK:
+        mf = _get_mapped(path)
+        if mf is None:
+            return None, {"offset": 0, "next_offset": 0, "data": b""}
+        return mf, _preview_slice(mf, offset, size, start_line, line_count)
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        return etag in [t.strip() for t in inm.split(",")] or inm.strip() == "*"
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(mtime) <= int(parsedate_to_datetime(ims).timestamp())
+        except Exception:
+            return False
+    return False
+
 @app.get("/api/logs/{file_id}/preview")
-async def preview_log_file(file_id: int, offset: int = 0, size: int = 512*1024, ctx: Dict[str, Any] = Depends(require_auth)):
-    """按字节偏移返回日志片段，用于大文件分片预览。
-    返回：chunk(字符串)、offset、next_offset、eof、total_size、filename
+async def preview_log_file(request: Request, file_id: int, offset: int = 0, size: int = 512*1024,
+                           start_line: Optional[int] = None, line_count: int = 1000,
+                           ctx: Dict[str, Any] = Depends(require_auth)):
+    """分片预览日志，切分点总是对齐到行边界。
+    按字节：offset/size；按行：start_line(1-based)/line_count（优先）。
+    返回：chunk(字符串)、offset、next_offset、eof、total_size、filename，按行时另含 start_line、next_line、total_lines。
+    响应携带 ETag/Last-Modified，条件请求命中时返回 304。
     """
     try:
         f = next((x for x in uploaded_files if x["id"] == file_id), None)
@@ -945,56 +1518,557 @@ async def preview_log_file(file_id: int, offset: int = 0, size: int = 512*1024,
         if not is_admin and f.get("owner_id", 1) != ctx["user"]["id"]:
             raise HTTPException(status_code=403, detail="无权预览该文件")
         filename = f.get("filename") or str(file_id)
-        # 确定总大小
-        total_size = 0
-        content_bytes = None
+        size = max(1, min(int(size), PREVIEW_MAX_BYTES))
         if f.get("path") and os.path.exists(f["path"]):
             try:
-                total_size = os.path.getsize(f["path"])
-                size = max(1, min(int(size), 1024 * 1024))  # 上限1MB每次
-                offset = max(0, min(int(offset), total_size))
-                with open(f["path"], "rb") as frb:
-                    frb.seek(offset)
-                    data = frb.read(size)
-                next_offset = offset + len(data)
-                eof = next_offset >= total_size
-                chunk = data.decode("utf-8", errors="ignore")
-                return {
+                st = os.stat(f["path"])
+                etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+                headers = {
+                    "ETag": etag,
+                    "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+                    "Cache-Control": "private, no-cache",
+                }
+                if _not_modified(request, etag, st.st_mtime):
+                    return Response(status_code=304, headers=headers)
+                mf, part = await asyncio.to_thread(_read_preview, f["path"], offset, size, start_line, line_count)
+                total_size = mf.size if mf else 0
+                body = {
                     "file_id": file_id,
                     "filename": filename,
-                    "offset": offset,
-                    "next_offset": next_offset,
-                    "eof": eof,
+                    "offset": part["offset"],
+                    "next_offset": part["next_offset"],
+                    "eof": part["next_offset"] >= total_size,
                     "total_size": total_size,
-                    "chunk": chunk
+                    "chunk": part["data"].decode("utf-8", errors="ignore"),
                 }
-            except Exception as e:
+                if "start_line" in part:
+                    body.update({"start_line": part["start_line"], "next_line": part["next_line"],
+                                 "total_lines": mf.total_lines if mf else 0})
+                return JSONResponse(content=body, headers=headers)
+            except Exception:
                 # 回退到内存内容
                 pass
         # 内存内容回退
         content_str = f.get("content", "")
         content_bytes = content_str.encode("utf-8", errors="ignore")
         total_size = len(content_bytes)
-        size = max(1, min(int(size), 1024 * 1024))
-        offset = max(0, min(int(offset), total_size))
-        data = content_bytes[offset: offset + size]
-        next_offset = offset + len(data)
-        eof = next_offset >= total_size
-        chunk = data.decode("utf-8", errors="ignore")
+        begin, stop = _line_aligned_window(content_bytes, total_size, offset, size)
         return {
             "file_id": file_id,
             "filename": filename,
-            "offset": offset,
-            "next_offset": next_offset,
-            "eof": eof,
+            "offset": begin,
+            "next_offset": stop,
+            "eof": stop >= total_size,
             "total_size": total_size,
-            "chunk": chunk
+            "chunk": content_bytes[begin:stop].decode("utf-8", errors="ignore")
         }
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"预览失败: {e}")
 
+# —— 单文件正则检索：按行对齐分块，多进程并行扫描，NDJSON 流式返回 ——
+GREP_CHUNK_BYTES = int(os.environ.get("GREP_CHUNK_BYTES", str(4 * 1024 * 1024)))
+GREP_WORKERS = int(os.environ.get("GREP_WORKERS", str(min(4, os.cpu_count() or 1))))
+GREP_MAX_HITS = 10000
+GREP_MAX_TIMEOUT_MS = 60000
+
+class _GrepWorkerPool:
+    """至多 GREP_WORKERS 个常驻检索进程。用户正则可能灾难性回溯且 re 匹配期间不释放 GIL，
+    因此所有扫描（包括单块文件与粘贴文本）都放到子进程中执行；子进程以 spawn 启动（不 fork 多线程的服务进程），
+    只导入 grep_worker。任务超过截止时间或被调用方取消时直接终止该进程，空位由后续任务按需补新进程
+    """
+    def __init__(self):
+        self._ctx = multiprocessing.get_context("spawn")
+        self._cond = threading.Condition()
+        self._idle: List[tuple] = []
+        self._busy = 0
+
+    def _spawn(self) -> tuple:
+        conn, child = self._ctx.Pipe()
+        proc = self._ctx.Process(target=grep_worker.serve, args=(child,), daemon=True)
+        proc.start()
+        child.close()
+        return proc, conn
+
+    @staticmethod
+    def _kill(worker: tuple):
+        proc, conn = worker
+        proc.terminate()
+        proc.join(1)
+        conn.close()
+
+    def _acquire(self, deadline: float):
+        """取一个空闲进程；返回 None 表示可新建进程，返回 False 表示等到截止时间仍无空位"""
+        with self._cond:
+            while True:
+                if self._idle:
+                    self._busy += 1
+                    return self._idle.pop()
+                if self._busy < max(1, GREP_WORKERS):
+                    self._busy += 1
+                    return None
+                remain = deadline - time.time()
+                if remain <= 0:
+                    return False
+                self._cond.wait(remain)
+
+    def _release(self, worker: Optional[tuple], reusable: bool):
+        with self._cond:
+            self._busy -= 1
+            keep = reusable and worker is not None and self._busy + len(self._idle) < max(1, GREP_WORKERS)
+            if keep:
+                self._idle.append(worker)
+            self._cond.notify()
+        if worker is not None and not keep:
+            self._kill(worker)
+
+    def run(self, job: Dict[str, Any], deadline: float, cancelled: threading.Event) -> Optional[Dict[str, Any]]:
+        """在工作进程中执行一个扫描任务（阻塞，供 asyncio.to_thread 调用）；超时或取消时终止进程并返回 None"""
+        worker = self._acquire(deadline)
+        if worker is False:
+            return None
+        reusable = False
+        try:
+            if worker is None:
+                worker = self._spawn()
+            conn = worker[1]
+            conn.send(job)
+            while True:
+                remain = deadline - time.time()
+                if remain <= 0 or cancelled.is_set():
+                    return None
+                if conn.poll(min(remain, 0.05)):
+                    status, res = conn.recv()
+                    reusable = True
+                    if status == "error":
+                        raise RuntimeError(res)
+                    return res
+        finally:
+            self._release(worker, reusable)
+
+    def shutdown(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            self._kill(worker)
+
+_GREP_POOL = _GrepWorkerPool()
+
+def _grep_chunk_bounds(path: str, chunk: int) -> List[tuple]:
+    """把文件切成约 chunk 字节、终点落在换行之后的区间"""
+    with _MMAP_LOCK:
+        mf = _get_mapped(path)
+        if mf is None:
+            return []
+        bounds = []
+        pos = 0
+        while pos < mf.size:
+            end = min(mf.size, pos + chunk)
+            if end < mf.size:
+                k = mf.mm.find(b"\n", end - 1)
+                end = k + 1 if k >= 0 else mf.size
+            bounds.append((pos, end))
+            pos = end
+        return bounds
+
+async def _grep_stream(path: Optional[str], text: Optional[str], pattern: str, flags: int, max_hits: int, timeout_ms: int):
+    """按块顺序输出命中行（{"line","text"}），最后输出一行汇总（done/matches/truncated/reason）。
+    块按顺序消费以累加行号；同时最多有 GREP_WORKERS 个块在工作进程中并行扫描，
+    到达 timeout_ms 时终止仍在扫描的进程并立即返回
+    """
+    t0 = time.perf_counter()
+    deadline = time.time() + timeout_ms / 1000.0
+    cancelled = threading.Event()
+    emitted = 0
+    scanned = 0
+    base = 0
+    reason = None
+    error = None
+    pending: List[tuple] = []
+    total = 0
+    try:
+        if path is None:
+            data = text or ""
+            total = len(data.encode("utf-8"))
+            jobs = [(0, total)]
+        else:
+            jobs = await asyncio.to_thread(_grep_chunk_bounds, path, GREP_CHUNK_BYTES)
+            total = jobs[-1][1] if jobs else 0
+        it = iter(jobs)
+
+        def submit_next():
+            nxt = next(it, None)
+            if nxt is None:
+                return
+            job = {"path": path, "text": data if path is None else None, "start": nxt[0], "end": nxt[1],
+                   "pattern": pattern, "flags": flags, "max_hits": max_hits, "deadline": deadline}
+            task = asyncio.ensure_future(asyncio.to_thread(_GREP_POOL.run, job, deadline, cancelled))
+            # 提前结束后不再等待的任务：取走其异常，避免未检索异常告警
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            pending.append((nxt, task))
+
+        for _ in range(max(1, GREP_WORKERS)):
+            submit_next()
+        while pending and reason is None:
+            (start, end), task = pending.pop(0)
+            res = await task
+            if res is None:
+                reason = "timeout"
+                break
+            submit_next()
+            for rel, line_text in res["hits"]:
+                if emitted >= max_hits:
+                    reason = "max_hits"
+                    break
+                emitted += 1
+                yield json.dumps({"line": base + rel + 1, "text": line_text}, ensure_ascii=False) + "\n"
+            if reason is None and res["stopped"]:
+                reason = res["stopped"]
+            if reason is None:
+                base += res["newlines"]
+                scanned += end - start
+    except Exception as e:
+        error = str(e)
+    finally:
+        # 提前结束（截断、超时、客户端断开）时通知仍在等待的任务终止其工作进程
+        cancelled.set()
+    summary = {
+        "done": True,
+        "matches": emitted,
+        "truncated": reason is not None,
+        "reason": reason,
+        "scanned_bytes": scanned,
+        "total_bytes": total,
+        "took_ms": round((time.perf_counter() - t0) * 1000, 2),
+    }
+    if error:
+        summary["error"] = error
+    yield json.dumps(summary, ensure_ascii=False) + "\n"
+
+@app.get("/api/logs/{file_id}/grep")
+async def grep_log_file(file_id: int, pattern: str, ignore_case: bool = False, max_hits: int = 1000,
+                        timeout_ms: int = 10000, ctx: Dict[str, Any] = Depends(require_auth)):
+    """在单个日志文件中按正则逐行检索，以 NDJSON 流式返回：
+    每个命中行一行 {"line": 行号(1-based), "text": 行内容}，最后一行为汇总
+    {"done": true, "matches", "truncated", "reason": null|"max_hits"|"timeout", "scanned_bytes", "total_bytes", "took_ms"}。
+    达到 max_hits 或超过 timeout_ms 时提前结束。
+    """
+    f = next((x for x in uploaded_files if x["id"] == file_id), None)
+    if not f:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    is_admin = (str(ctx["user"].get("username", "")).lower() == "admin")
+    if not is_admin and f.get("owner_id", 1) != ctx["user"]["id"]:
+        raise HTTPException(status_code=403, detail="无权访问该文件")
+    if not pattern:
+        raise HTTPException(status_code=400, detail="检索表达式不能为空")
+    flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+    try:
+        re.compile(pattern, flags)
+    except re.error as e:
+        raise HTTPException(status_code=400, detail=f"正则表达式无效: {e}")
+    max_hits = max(1, min(int(max_hits), GREP_MAX_HITS))
+    timeout_ms = max(1, min(int(timeout_ms), GREP_MAX_TIMEOUT_MS))
+    path = f.get("path")
+    if path and os.path.exists(path):
+        gen = _grep_stream(path, None, pattern, flags, max_hits, timeout_ms)
+    else:
+        # 向后兼容：粘贴文本分析的记录只存在于内存
+        gen = _grep_stream(None, f.get("content", ""), pattern, flags, max_hits, timeout_ms)
+    return StreamingResponse(gen, media_type="application/x-ndjson", headers={"Cache-Control": "no-store"})
+
+# —— 跨文件倒排索引：SQLite 存储 token -> (文件, 行号) 倒排表，上传后后台增量构建 ——
+SEARCH_INDEX_PATH = os.path.join(DATA_DIR, "search_index.sqlite3")
+SEARCH_MAX_HITS = 5000
+SEARCH_VERIFY_RANDOM_MAX = 256  # 待校验行数超过此值时改为顺序扫描文件
+# 词元：小写字母数字下划线序列，或单个非ASCII字符（兼容中文短语）
+_TOKEN_RE = re.compile(r"[a-z0-9_]+|[^\x00-\x7f\s]")
+# 不入索引的高基数噪声词元：纯数字、0x十六进制、8位以上含数字的十六进制串、超长串
+_NOISE_TOKEN_RE = re.compile(r"[0-9]+|0x[0-9a-f]*|(?=[0-9a-f]*[0-9])[0-9a-f]{8,}|.{65,}")
+_SEARCH_DB_LOCK = threading.Lock()
+
+def _indexable(token: str) -> bool:
+    return not _NOISE_TOKEN_RE.fullmatch(token)
+
+def _search_db():
+    db = sqlite3.connect(SEARCH_INDEX_PATH, timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE IF NOT EXISTS postings (token TEXT NOT NULL, file_id INTEGER NOT NULL, lines BLOB NOT NULL, PRIMARY KEY (token, file_id)) WITHOUT ROWID")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_postings_file ON postings (file_id)")
+    db.execute("CREATE TABLE IF NOT EXISTS files (file_id INTEGER PRIMARY KEY, lines INTEGER NOT NULL, upload_time TEXT)")
+    return db
+
+def build_search_index(file_info: Dict[str, Any]):
+    """为单个文件建立倒排表（在后台线程中执行）"""
+    path = file_info.get("path")
+    if not path or not os.path.exists(path):
+        return
+    fid = file_info["id"]
+    postings: Dict[str, List[int]] = {}
+    n = 0
+    try:
+        # 以二进制按 \n 切行，行号与预览/分析保持一致
+        with open(path, "rb") as fh:
+            for n, raw in enumerate(fh, 1):
+                for t in set(_TOKEN_RE.findall(raw.decode("utf-8", errors="ignore").lower())):
+                    if _indexable(t):
+                        postings.setdefault(t, []).append(n)
+        with _SEARCH_DB_LOCK:
+            db = _search_db()
+            try:
+                with db:
+                    db.execute("DELETE FROM postings WHERE file_id = ?", (fid,))
+                    db.executemany("INSERT INTO postings (token, file_id, lines) VALUES (?, ?, ?)",
+                                   ((t, fid, array("I", ls).tobytes()) for t, ls in postings.items()))
+                    db.execute("INSERT OR REPLACE INTO files (file_id, lines, upload_time) VALUES (?, ?, ?)",
+                               (fid, n, file_info.get("upload_time", "")))
+            finally:
+                db.close()
+    except Exception as e:
+        print(f"建立搜索索引失败 {fid}: {e}")
+
+def remove_from_search_index(file_ids: List[int]):
+    if not file_ids:
+        return
+    try:
+        with _SEARCH_DB_LOCK:
+            db = _search_db()
+            try:
+                with db:
+                    for fid in file_ids:
+                        db.execute("DELETE FROM postings WHERE file_id = ?", (fid,))
+                        db.execute("DELETE FROM files WHERE file_id = ?", (fid,))
+            finally:
+                db.close()
+    except Exception as e:
+        print(f"删除搜索索引失败: {e}")
+
+def _index_uploaded_file(file_info: Dict[str, Any]):
+    """上传后在后台建立倒排索引与块级跳过索引"""
+    build_search_index(file_info)
+    build_skip_index(file_info)
+
+def _backfill_indexes():
+    """启动时为尚未建立索引（或 ID 已被复用）的文件补建索引"""
+    try:
+        db = _search_db()
+        try:
+            known = {fid: ut for fid, ut in db.execute("SELECT file_id, upload_time FROM files")}
+        finally:
+            db.close()
+        for f in list(uploaded_files):
+            if not f.get("path"):
+                continue
+            if known.get(f["id"]) != f.get("upload_time", ""):
+                build_search_index(f)
+            if load_skip_index(f) is None:
+                build_skip_index(f)
+    except Exception as e:
+        print(f"补建索引失败: {e}")
+
+def _phrase_info(phrase: str) -> Dict[str, Any]:
+    pl = (phrase or "").lower().strip()
+    tokens = _TOKEN_RE.findall(pl)
+    keys = [t for t in tokens if _indexable(t)]
+    # 仅当短语恰为一个可索引词元时，倒排表结果即为精确结果
+    return {"lower": pl, "tokens": set(tokens), "keys": keys, "exact": len(tokens) == 1 and keys == [pl]}
+
+def _phrase_hits_line(info: Dict[str, Any], line_lower: str, line_tokens: set) -> bool:
+    """短语语义：短语的全部词元都是该行词元，且短语整体是该行的子串"""
+    return bool(info["lower"]) and info["tokens"] <= line_tokens and info["lower"] in line_lower
+
+class _SearchPlan:
+    """DSL 表达式在倒排表上的求值。
+    行集合用 ("pos", S) 表示 S，用 ("neg", S) 表示"除 S 外的全部行"，避免物化全集；
+    exact=False 表示结果只是候选超集，需要回到原文逐行校验。
+    """
+    def __init__(self, ast: _Ast, db):
+        self.ast = ast
+        self.db = db
+        self.phrases: Dict[str, Dict[str, Any]] = {}
+        self.postings: Dict[str, Dict[int, bytes]] = {}
+        self._collect(ast)
+        for info in self.phrases.values():
+            for t in info["keys"]:
+                if t not in self.postings:
+                    self.postings[t] = {fid: blob for fid, blob in db.execute(
+                        "SELECT file_id, lines FROM postings WHERE token = ?", (t,))}
+
+    def _collect(self, node):
+        if node is None:
+            return
+        if node.op is None:
+            self.phrases.setdefault(node.value or "", _phrase_info(node.value or ""))
+            return
+        self._collect(node.left)
+        self._collect(node.right)
+
+    def candidate_files(self, node=None, top=True) -> Optional[set]:
+        """文件级候选（None 表示无法裁剪）"""
+        node = self.ast if top else node
+        if node is None:
+            return set()
+        if node.op is None:
+            keys = self.phrases[node.value or ""]["keys"]
+            if not keys:
+                return None
+            out = None
+            for t in keys:
+                fs = set(self.postings[t])
+                out = fs if out is None else out & fs
+            return out
+        if node.op == "NOT":
+            return None
+        a = self.candidate_files(node.left, False)
+        b = self.candidate_files(node.right, False)
+        if node.op == "AND":
+            return b if a is None else a if b is None else a & b
+        return None if a is None or b is None else a | b
+
+    def _lines(self, fid: int, token: str) -> set:
+        blob = self.postings[token].get(fid)
+        return set(array("I", blob)) if blob else set()
+
+    def eval_file(self, fid: int, node=None, top=True):
+        node = self.ast if top else node
+        if node is None:
+            return ("pos", set()), True
+        if node.op is None:
+            info = self.phrases[node.value or ""]
+            if not info["lower"]:
+                return ("pos", set()), True
+            if not info["keys"]:
+                return ("neg", set()), False
+            out = None
+            for t in info["keys"]:
+                ls = self._lines(fid, t)
+                out = ls if out is None else out & ls
+            return ("pos", out), info["exact"]
+        if node.op == "NOT":
+            (kind, st), exact = self.eval_file(fid, node.left, False)
+            if not exact:
+                return ("neg", set()), False
+            return ("neg" if kind == "pos" else "pos", st), True
+        (ka, a), ea = self.eval_file(fid, node.left, False)
+        (kb, b), eb = self.eval_file(fid, node.right, False)
+        exact = ea and eb
+        if node.op == "AND":
+            if ka == "pos" and kb == "pos":
+                return ("pos", a & b), exact
+            if ka == "pos":
+                return ("pos", a - b), exact
+            if kb == "pos":
+                return ("pos", b - a), exact
+            return ("neg", a | b), exact
+        if ka == "pos" and kb == "pos":
+            return ("pos", a | b), exact
+        if ka == "neg" and kb == "neg":
+            return ("neg", a & b), exact
+        return ("neg", (a - b) if ka == "neg" else (b - a)), exact
+
+    def eval_line(self, line_lower: str, node=None, top=True) -> bool:
+        node = self.ast if top else node
+        if node is None:
+            return False
+        if node.op is None:
+            return _phrase_hits_line(self.phrases[node.value or ""], line_lower, set(_TOKEN_RE.findall(line_lower)))
+        if node.op == "NOT":
+            return not self.eval_line(line_lower, node.left, False)
+        if node.op == "AND":
+            return self.eval_line(line_lower, node.left, False) and self.eval_line(line_lower, node.right, False)
+        return self.eval_line(line_lower, node.left, False) or self.eval_line(line_lower, node.right, False)
+
+def _read_lines(path: str, numbers: List[int]) -> Dict[int, str]:
+    """通过 mmap 行索引读取指定行（1-based，升序）；相邻行从上一行末尾继续，不再回到检查点"""
+    out: Dict[int, str] = {}
+    with _MMAP_LOCK:
+        mf = _get_mapped(path)
+        if mf is None:
+            return out
+        prev, e = None, 0
+        for n in numbers:
+            b = e if prev is not None and n == prev + 1 else mf.line_offset(n - 1)
+            if b >= mf.size:
+                break
+            k = mf.mm.find(b"\n", b)
+            e = mf.size if k < 0 else k + 1
+            out[n] = mf.mm[b:e].decode("utf-8", errors="ignore").rstrip("\r\n")
+            prev = n
+    return out
+
+def _verify_lines(path: str, lines: List[int], plan: "_SearchPlan") -> List[int]:
+    """回到原文逐行校验候选行。候选较少时按 mmap 行索引读取；
+    较多时（如短语只含噪声词元，倒排表无法裁剪）用独立文件句柄顺序扫描一遍，不持有 _MMAP_LOCK
+    """
+    if len(lines) <= SEARCH_VERIFY_RANDOM_MAX:
+        texts = _read_lines(path, lines)
+        return [n for n in lines if n in texts and plan.eval_line(texts[n].lower())]
+    wanted = set(lines)
+    last = lines[-1]
+    out = []
+    with open(path, "rb") as fh:
+        for n, raw in enumerate(fh, 1):
+            if n in wanted and plan.eval_line(raw.decode("utf-8", errors="ignore").rstrip("\r\n").lower()):
+                out.append(n)
+            if n >= last:
+                break
+    return out
+
+def run_search(expr: str, files: Dict[int, Dict[str, Any]], limit: int, with_text: bool) -> Dict[str, Any]:
+    ast = _compile_dsl("search", expr)["ast"]
+    db = _search_db()
+    try:
+        plan = _SearchPlan(ast, db)
+        # upload_time 不一致说明索引属于已删除文件（ID 被复用），跳过
+        indexed = {fid: n for fid, n, ut in db.execute("SELECT file_id, lines, upload_time FROM files")
+                   if fid in files and files[fid].get("upload_time", "") == ut}
+    finally:
+        db.close()
+    cands = plan.candidate_files()
+    fids = sorted(fid for fid in (indexed.keys() if cands is None else cands & indexed.keys()))
+    results = []
+    total = 0
+    budget = limit
+    for fid in fids:
+        (kind, st), exact = plan.eval_file(fid)
+        if kind == "neg":
+            st = set(range(1, indexed[fid] + 1)) - st
+        lines = sorted(st)
+        if not exact and lines:
+            path = files[fid].get("path")
+            lines = _verify_lines(path, lines, plan) if path and os.path.exists(path) else []
+        if not lines:
+            continue
+        total += len(lines)
+        shown = lines[:max(0, budget)]
+        budget -= len(shown)
+        item: Dict[str, Any] = {"file_id": fid, "filename": files[fid].get("filename"), "match_count": len(lines), "lines": shown}
+        if with_text and shown:
+            texts = _read_lines(files[fid]["path"], shown)
+            item["matches"] = [{"line": n, "text": texts.get(n, "")[:500]} for n in shown]
+        results.append(item)
+    return {"query": expr, "total_files": len(results), "total_matches": total,
+            "truncated": total > limit, "files": results}
+
+@app.get("/api/search")
+async def search_logs(q: str, limit: int = 200, with_text: bool = True, ctx: Dict[str, Any] = Depends(require_auth)):
+    """在倒排索引上执行 DSL 表达式（| & ! () 与引号短语），跨全部已索引日志按行检索。
+    短语按词元匹配：短语的全部词元出现在同一行且短语为该行子串。
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="查询表达式不能为空")
+    is_admin = (str(ctx["user"].get("username", "")).lower() == "admin")
+    user_id = ctx["user"]["id"]
+    files = {f["id"]: f for f in uploaded_files if f.get("path") and (is_admin or f.get("owner_id", 1) == user_id)}
+    limit = max(1, min(int(limit), SEARCH_MAX_HITS))
+    t0 = time.perf_counter()
+    try:
+        res = await asyncio.to_thread(run_search, q.strip(), files, limit, with_text)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"搜索失败: {e}")
+    res["took_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    return res
+
 class AnalyzeTextPayload(BaseModel):
     text: str
     filename: Optional[str] = "pasted.log"
@@ -1015,6 +2089,7 @@ async def analyze_text(payload: AnalyzeTextPayload, ctx: Dict[str, Any] = Depend
         "owner_id": ctx["user"]["id"],
     }
     uploaded_files.append(file_info)
+    schedule_retention(file_info)
     # 文本分析同样走后台队列
     ANALYSIS_RUNNING.add(file_info["id"])
     def _task():
@@ -1025,6 +2100,120 @@ async def analyze_text(payload: AnalyzeTextPayload, ctx: Dict[str, Any] = Depend
     EXECUTOR.submit(_task)
     return JSONResponse(status_code=202, content={"status": "accepted", "file_id": file_info["id"]})
 
+# —— 分钟级汇总：分析时按分钟统计各级别与各问题类型的行数，直方图只查询汇总表，不扫描日志 ——
+# 维度与数据库版 LogRollup 一致：level、problem_type，每行在每个维度下只计一次，各键之和即该分钟的行数
+ROLLUP_DB_PATH = os.path.join(DATA_DIR, "rollups.sqlite3")
+HISTOGRAM_MAX_BUCKETS = 2000
+_ROLLUP_DB_LOCK = threading.Lock()
+# 行首时间戳（可带方括号）：ISO 日期时间，或 syslog 的 "Mon DD HH:MM"（无年份，取上传年份）
+_LINE_MINUTE_RE = re.compile(r"\[?(?:(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2})|([A-Z][a-z]{2}) +(\d{1,2}) (\d{2}:\d{2}))")
+# 级别关键词：只带尾部 \b（带前导 \b 的正则慢约 3 倍），前一字符在匹配后检查
+_LINE_LEVEL_RE = re.compile(r"(fatal|panic|crit(?:ical)?|err(?:or)?|warn(?:ing)?|info|debug)\b")
+_LEVEL_NAMES = {"fatal": "critical", "panic": "critical", "crit": "critical", "critical": "critical",
+                "err": "error", "error": "error", "warn": "warning", "warning": "warning",
+                "info": "info", "debug": "debug"}
+_MONTHS = {m: i for i, m in enumerate(("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+                                       "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1)}
+
+def _rollup_db():
+    db = sqlite3.connect(ROLLUP_DB_PATH, timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE IF NOT EXISTS rollups (dim TEXT NOT NULL, minute TEXT NOT NULL, key TEXT NOT NULL, file_id INTEGER NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (dim, minute, key, file_id)) WITHOUT ROWID")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_rollups_file ON rollups (file_id)")
+    if db.execute("PRAGMA user_version").fetchone()[0] < 1:
+        # 旧版 rule 维度按规则命中计数（一行命中多条规则会重复计），无法换算为行数；文件重新分析后按 problem_type 重建
+        with db:
+            db.execute("DELETE FROM rollups WHERE dim = 'rule'")
+            db.execute("PRAGMA user_version = 1")
+    return db
+
+def compute_minute_rollups(content: str, pre: Dict[str, Any], year: int,
+                           rule_lines: Dict[str, List[int]]) -> Dict[tuple, int]:
+    """返回 {(维度, 键, 分钟): 行数}，维度为 level（含 unknown）或 problem_type。
+    problem_type 的键为该行命中的第一条规则名（按规则顺序；内存版没有单独的问题类型），
+    一行命中多条规则或同一规则多处匹配也只计一次。
+    无时间戳的行（如堆栈续行）归入上一条带时间戳的行所在分钟；首个时间戳之前的行不计
+    """
+    lines = pre["lines"]
+    last_line = len(lines) - (1 if lines and lines[-1] == "" else 0)
+    line_minute: List[Optional[str]] = [None] * (last_line + 1)  # 下标为行号
+    totals: Dict[str, int] = {}
+    minute = None
+    for ln in range(1, last_line + 1):
+        line = lines[ln - 1]
+        m = _LINE_MINUTE_RE.match(line) if line else None
+        if m:
+            if m.group(1):
+                minute = f"{m.group(1)}T{m.group(2)}"
+            elif m.group(3) in _MONTHS:
+                minute = f"{year:04d}-{_MONTHS[m.group(3)]:02d}-{int(m.group(4)):02d}T{m.group(5)}"
+        if minute is not None:
+            line_minute[ln] = minute
+            totals[minute] = totals.get(minute, 0) + 1
+    if not totals:
+        return {}
+
+    counts: Dict[tuple, int] = {}
+    leveled: Dict[str, int] = {}
+    nl = pre["newline_positions"]
+    low = pre["content_lower"]
+    last = 0
+    # 每行只取第一个级别关键词；匹配按位置递增，行号单调
+    for m in _LINE_LEVEL_RE.finditer(low):
+        pos = m.start()
+        if pos and low[pos - 1].isalnum():
+            continue
+        ln = bisect.bisect_right(nl, pos) + 1
+        if ln == last or ln > last_line:
+            continue
+        last = ln
+        minute = line_minute[ln]
+        if minute is None:
+            continue
+        key = ("level", _LEVEL_NAMES[m.group(1)], minute)
+        counts[key] = counts.get(key, 0) + 1
+        leveled[minute] = leveled.get(minute, 0) + 1
+    for minute, total in totals.items():
+        unknown = total - leveled.get(minute, 0)
+        if unknown > 0:
+            counts[("level", "unknown", minute)] = unknown
+    line_rule: Dict[int, str] = {}
+    for rule_name, hit_lines in rule_lines.items():
+        for ln in hit_lines:
+            line_rule.setdefault(ln, rule_name)
+    for ln, rule_name in line_rule.items():
+        minute = line_minute[ln] if 0 < ln <= last_line else None
+        if minute is not None:
+            key = ("problem_type", rule_name, minute)
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+def save_minute_rollups(file_id: int, counts: Dict[tuple, int]):
+    """替换文件的分钟汇总"""
+    with _ROLLUP_DB_LOCK:
+        db = _rollup_db()
+        try:
+            with db:
+                db.execute("DELETE FROM rollups WHERE file_id = ?", (file_id,))
+                db.executemany("INSERT INTO rollups (dim, key, minute, file_id, count) VALUES (?, ?, ?, ?, ?)",
+                               ((dim, key, minute, file_id, n) for (dim, key, minute), n in counts.items()))
+        finally:
+            db.close()
+
+def remove_rollups(file_ids: List[int]):
+    if not file_ids:
+        return
+    try:
+        with _ROLLUP_DB_LOCK:
+            db = _rollup_db()
+            try:
+                with db:
+                    db.executemany("DELETE FROM rollups WHERE file_id = ?", ((fid,) for fid in file_ids))
+            finally:
+                db.close()
+    except Exception as e:
+        print(f"删除分钟汇总失败: {e}")
+
 # 规则匹配逻辑
 
 
@@ -1051,14 +2240,21 @@ def _perform_analysis(file_id: int):
     # 分析
     issues = []
     pre = _precompute_content(content)
+    # 跳过索引的行号基于原始字节按 \n 切分；仅在与读入内容的换行数一致时使用
+    skip = load_skip_index(file_info) if file_info.get("path") else None
+    if skip and skip.get("newlines") == len(pre["newline_positions"]):
+        pre["skip"] = skip
     lines = pre["lines"]
     print(f"开始分析文件 {file_id}，规则数量: {len(detection_rules)}")
+    rule_lines: Dict[str, List[int]] = {}
     
     for rule in detection_rules:
         matches = evaluate_rule_matches(content, rule, pre)
         
         if not matches:
             continue
+        rule_lines[rule["name"]] = [_line_number_from_pos(m.start(), pre["newline_positions"])
+                                    for m in matches if m is not None]
             
         # 对于DSL规则或有多个匹配的情况，合并为一个问题
         if rule.get('dsl') or len(matches) > 1:
@@ -1125,6 +2321,15 @@ def _perform_analysis(file_id: int):
     
     print(f"分析完成，总问题数: {len(issues)}")
     
+    try:
+        year = datetime.fromisoformat(file_info.get("upload_time", "")).year
+    except ValueError:
+        year = datetime.now().year
+    try:
+        save_minute_rollups(file_id, compute_minute_rollups(content, pre, year, rule_lines))
+    except Exception as e:
+        print(f"写入分钟汇总失败 {file_id}: {e}")
+    
     result = {
         "file_id": file_id,
         "filename": file_info["filename"],
@@ -1186,14 +2391,169 @@ async def get_analysis_status(file_id: int, ctx: Dict[str, Any] = Depends(requir
     return {"status": "none"}
 
 # 分析结果查询
+RESULTS_MAX_PAGE = 1000
+# 摘要投影下保留的问题字段（去掉 context / matched_text 等大字段）
+_ISSUE_SUMMARY_KEYS = ("rule_name", "description", "line_number", "match_count", "severity")
+
+def _result_cursor(r: Dict[str, Any]) -> str:
+    return f"{r.get('analysis_time', '')}|{r.get('file_id', 0)}"
+
+def _cursor_key(cursor: str):
+    ts, _, fid = cursor.rpartition("|")
+    try:
+        return (ts, int(fid))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的游标")
+
+def _project_result(r: Dict[str, Any], fields: str, rule: Optional[str], severity: Optional[str]) -> Optional[Dict[str, Any]]:
+    """按规则/严重级别筛选问题，并按 fields 投影；筛选后无问题则返回 None"""
+    issues = r.get("issues", [])
+    if rule or severity:
+        issues = [i for i in issues
+                  if (not rule or i.get("rule_name") == rule)
+                  and (not severity or i.get("severity") == severity)]
+        if not issues:
+            return None
+    if fields == "summary":
+        issues = [{k: i[k] for k in _ISSUE_SUMMARY_KEYS if k in i} for i in issues]
+    return {**r, "issues": issues}
+
+def _iter_analysis_results(items: List[Dict[str, Any]], page: Dict[str, Any]):
+    """逐条编码分析结果为 JSON 片段，不在内存中拼接完整响应体"""
+    yield '{"results":['
+    emitted = 0
+    last = None
+    more = False
+    after = page["after"]
+    desc = page["order"] == "desc"
+    for r in (reversed(items) if desc else items):
+        if after is not None:
+            key = (r.get("analysis_time", ""), r.get("file_id", 0))
+            if (key >= after) if desc else (key <= after):
+                continue
+        t = r.get("analysis_time", "")
+        if (page["since"] and t < page["since"]) or (page["until"] and t > page["until"]):
+            continue
+        out = _project_result(r, page["fields"], page["rule"], page["severity"])
+        if out is None:
+            continue
+        if page["limit"] is not None and emitted >= page["limit"]:
+            more = True
+            break
+        yield ("," if emitted else "") + json.dumps(out, ensure_ascii=False)
+        emitted += 1
+        last = r
+    next_cursor = _result_cursor(last) if (more and last is not None) else None
+    yield '],"next_cursor":' + json.dumps(next_cursor) + ',"count":' + str(emitted) + '}'
+
 @app.get("/api/analysis/results")
-async def get_analysis_results(ctx: Dict[str, Any] = Depends(require_auth)):
+async def get_analysis_results(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: str = "full",
+    rule: Optional[str] = None,
+    severity: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    order: str = "asc",
+    ctx: Dict[str, Any] = Depends(require_auth),
+):
+    """分析结果列表（流式 JSON）。
+    cursor/limit：游标分页，游标取自上一页返回的 next_cursor；
+    fields：full 返回完整问题，summary 去掉上下文；
+    rule/severity/since/until：按规则名、严重级别、分析时间(ISO)过滤；
+    order：asc（旧→新，默认）或 desc（新→旧）。
+    """
+    if fields not in ("full", "summary"):
+        raise HTTPException(status_code=400, detail="fields 仅支持 full 或 summary")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order 仅支持 asc 或 desc")
     is_admin = (str(ctx["user"].get("username", "")).lower() == "admin")
     user_id = ctx["user"]["id"]
-    if is_admin:
-        return {"results": analysis_results}
-    # 非管理员按 owner 过滤
-    return {"results": [r for r in analysis_results if r.get("owner_id", 1) == user_id]}
+    # 浅拷贝引用列表即可，后台分析可能同时替换/追加结果
+    items = list(analysis_results)
+    if not is_admin:
+        # 非管理员按 owner 过滤
+        items = [r for r in items if r.get("owner_id", 1) == user_id]
+    page = {
+        "after": _cursor_key(cursor) if cursor else None,
+        "limit": max(1, min(int(limit), RESULTS_MAX_PAGE)) if limit is not None else None,
+        "fields": fields,
+        "rule": rule,
+        "severity": severity,
+        "since": since,
+        "until": until,
+        "order": order,
+    }
+    return StreamingResponse(_iter_analysis_results(items, page), media_type="application/json")
+
+@app.get("/api/analysis/histogram")
+async def get_analysis_histogram(
+    dim: str = "level",
+    file_id: Optional[List[int]] = Query(None),
+    key: Optional[List[str]] = Query(None),
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    bucket_minutes: int = 1,
+    ctx: Dict[str, Any] = Depends(require_auth),
+):
+    """按分钟汇总生成直方图（如每分钟错误数），只查询汇总表；计数均为行数。
+    dim：level（按级别，含 unknown）或 problem_type（按该行命中的第一条规则名）；file_id 可多选，不传时为当前用户可见的全部文件；
+    key：限定级别/问题类型；since/until：ISO 时间；bucket_minutes：桶宽（分钟），桶数超过上限时自动放宽。
+    """
+    if dim not in ("level", "problem_type"):
+        raise HTTPException(status_code=400, detail="dim 仅支持 level 或 problem_type")
+    is_admin = (str(ctx["user"].get("username", "")).lower() == "admin")
+    visible = None if is_admin else {f["id"] for f in uploaded_files if f.get("owner_id", 1) == ctx["user"]["id"]}
+    ids = file_id if file_id else (sorted(visible) if visible is not None else None)
+    if ids is not None and visible is not None:
+        ids = [i for i in ids if i in visible]
+    where, args = ["dim = ?"], [dim]
+    if ids is not None:
+        if not ids:
+            return {"dim": dim, "bucket_minutes": max(1, bucket_minutes), "buckets": []}
+        where.append(f"file_id IN ({','.join('?' * len(ids))})")
+        args.extend(ids)
+    if key:
+        where.append(f"key IN ({','.join('?' * len(key))})")
+        args.extend(key)
+    # 分钟键为 YYYY-MM-DDTHH:MM，可直接按字符串比较
+    if since:
+        where.append("minute >= ?")
+        args.append(since.replace(" ", "T")[:16])
+    if until:
+        where.append("minute <= ?")
+        args.append(until.replace(" ", "T")[:16])
+
+    def _query():
+        with _ROLLUP_DB_LOCK:
+            db = _rollup_db()
+            try:
+                return db.execute(f"SELECT minute, key, SUM(count) FROM rollups WHERE {' AND '.join(where)} "
+                                  f"GROUP BY minute, key ORDER BY minute", args).fetchall()
+            finally:
+                db.close()
+    rows = await asyncio.to_thread(_query)
+    bucket_minutes = max(1, bucket_minutes)
+    if not rows:
+        return {"dim": dim, "bucket_minutes": bucket_minutes, "buckets": []}
+    first, last = datetime.fromisoformat(rows[0][0]), datetime.fromisoformat(rows[-1][0])
+    span = int((last - first).total_seconds() // 60) + 1
+    bucket_minutes = max(bucket_minutes, -(-span // HISTOGRAM_MAX_BUCKETS))
+    width = timedelta(minutes=bucket_minutes)
+    epoch = datetime(1970, 1, 1)
+    buckets: Dict[datetime, Dict[str, int]] = {}
+    for minute, k, n in rows:
+        t = datetime.fromisoformat(minute)
+        start = epoch + (t - epoch) // width * width
+        counts = buckets.setdefault(start, {})
+        counts[k] = counts.get(k, 0) + n
+    return {
+        "dim": dim,
+        "bucket_minutes": bucket_minutes,
+        "buckets": [{"time": t.isoformat(timespec="minutes"), "counts": c, "total": sum(c.values())}
+                    for t, c in buckets.items()],
+    }
 
 @app.get("/api/analysis/{file_id}")
 async def get_file_analysis_result(file_id: int, ctx: Dict[str, Any] = Depends(require_auth)):
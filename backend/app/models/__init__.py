@@ -1,5 +1,5 @@
 from .user import User
-from .log import LogFile, LogEntry, ParseRule
+from .log import LogFile, LogEntry, LogLineStat, LogRollup, ParseRule
 from .report import Report
  
-__all__ = ["User", "LogFile", "LogEntry", "ParseRule", "Report"] 
\ No newline at end of file
+__all__ = ["User", "LogFile", "LogEntry", "LogLineStat", "LogRollup", "ParseRule", "Report"] 
\ No newline at end of file
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON, Enum
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON, Enum, Index, case, null
 from sqlalchemy.orm import relationship
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.sql import func
 from enum import Enum as PyEnum
 from ..database import Base
@@ -40,13 +41,17 @@ class LogFile(Base):
     processed_lines = Column(Integer, default=0)
     error_lines = Column(Integer, default=0)
     is_processed = Column(Boolean, default=False)
+    storage_mode = Column(String(20), default="full")  # full: 全部行入库；problems: 仅问题行及其上下文
     upload_user_id = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     # 关系
     upload_user = relationship("User", backref="uploaded_files")
-    log_entries = relationship("LogEntry", back_populates="log_file", cascade="all, delete-orphan")
+    # passive_deletes：删除文件时不逐条加载条目，由 services.log_storage 按分区 / 批量删除
+    log_entries = relationship("LogEntry", back_populates="log_file", cascade="all, delete-orphan", passive_deletes=True)
+    line_stats = relationship("LogLineStat", back_populates="log_file", cascade="all, delete-orphan", passive_deletes=True)
+    rollups = relationship("LogRollup", back_populates="log_file", cascade="all, delete-orphan", passive_deletes=True)
 
     def __repr__(self):
         return f"<LogFile(id={self.id}, filename='{self.filename}', type='{self.log_type.value}')>"
@@ -56,14 +61,16 @@ class LogEntry(Base):
     __tablename__ = "log_entries"
 
     id = Column(Integer, primary_key=True, index=True)
-    log_file_id = Column(Integer, ForeignKey("log_files.id"), nullable=False)
+    log_file_id = Column(Integer, ForeignKey("log_files.id", ondelete="CASCADE"), nullable=False)
     line_number = Column(Integer, nullable=False)
     raw_content = Column(Text, nullable=False)
     parsed_content = Column(JSON)
     timestamp = Column(DateTime(timezone=True))
     log_level = Column(Enum(LogLevel))
     source = Column(String(100))
-    message = Column(Text)
+    # message 通常是 raw_content 的后缀：此时只存偏移 message_offset，message 列为 NULL，读取时再截取
+    message_text = Column("message", Text)
+    message_offset = Column(Integer)
     problem_detected = Column(Boolean, default=False)
     problem_type = Column(String(100))
     problem_description = Column(Text)
@@ -72,10 +79,74 @@ class LogEntry(Base):
     # 关系
     log_file = relationship("LogFile", back_populates="log_entries")
 
+    # 读取优先级：message 列 > 按偏移截取 raw_content > NULL。
+    # message_offset 为 NULL 的行（偏移存储之前写入的旧行、或确实没有 message 的行）只看 message 列
+    @hybrid_property
+    def message(self):
+        if self.message_text is not None:
+            return self.message_text
+        if self.message_offset is None or self.raw_content is None:
+            return None
+        return self.raw_content[self.message_offset:]
+
+    @message.setter
+    def message(self, value):
+        self.message_text = value
+        self.message_offset = None
+
+    @message.expression
+    def message(cls):
+        return case(
+            (cls.message_text.is_not(None), cls.message_text),
+            (cls.message_offset.is_not(None), func.substr(cls.raw_content, cls.message_offset + 1)),
+            else_=null(),
+        )
+
     def __repr__(self):
         return f"<LogEntry(id={self.id}, line={self.line_number}, level='{self.log_level}')>"
 
 
+class LogLineStat(Base):
+    """按级别与来源聚合的行数统计（覆盖文件全部已解析行，不论是否入库 log_entries）"""
+    __tablename__ = "log_line_stats"
+
+    id = Column(Integer, primary_key=True, index=True)
+    log_file_id = Column(Integer, ForeignKey("log_files.id", ondelete="CASCADE"), nullable=False, index=True)
+    log_level = Column(Enum(LogLevel))
+    source = Column(String(100))
+    line_count = Column(Integer, nullable=False, default=0)
+    problem_count = Column(Integer, nullable=False, default=0)
+
+    # 关系
+    log_file = relationship("LogFile", back_populates="line_stats")
+
+    def __repr__(self):
+        return f"<LogLineStat(file={self.log_file_id}, level='{self.log_level}', source='{self.source}', lines={self.line_count})>"
+
+
+class LogRollup(Base):
+    """分钟级汇总：每分钟按级别（dimension=level）与问题类型（dimension=problem_type）统计的行数，供报表按时间范围统计。
+    维度与内存版 main.py 的 rollups 表一致，直方图统一由 /api/analysis/histogram 提供
+    """
+    __tablename__ = "log_rollups"
+    __table_args__ = (
+        Index("idx_log_rollups_bucket", "dimension", "bucket", "key"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    log_file_id = Column(Integer, ForeignKey("log_files.id", ondelete="CASCADE"), nullable=False, index=True)
+    bucket = Column(DateTime(timezone=True), nullable=False)  # 截断到分钟
+    dimension = Column(String(20), nullable=False)
+    key = Column(String(100), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+    # 关系
+    log_file = relationship("LogFile", back_populates="rollups")
+
+    def __repr__(self):
+        return f"<LogRollup(file={self.log_file_id}, {self.dimension}={self.key}, bucket={self.bucket}, count={self.count})>"
+
+
 class ParseRule(Base):
     __tablename__ = "parse_rules"
 
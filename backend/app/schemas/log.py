@@ -15,6 +15,7 @@ class LogFileResponse(BaseModel):
     processed_lines: int
     error_lines: int
     is_processed: bool
+    storage_mode: Optional[str] = "full"
     upload_user_id: int
     created_at: datetime
     updated_at: Optional[datetime]
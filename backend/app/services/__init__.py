@@ -1,5 +1,4 @@
 from .log_parser import LogParserService
-from .user_service import UserService
 from .report_service import ReportService
 
-__all__ = ["LogParserService", "UserService", "ReportService"] 
\ No newline at end of file
+__all__ = ["LogParserService", "ReportService"] 
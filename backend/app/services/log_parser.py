@@ -1,20 +1,303 @@
+import os
 import re
+import io
+import csv
 import json
 import time
-from typing import List, Dict, Optional, Tuple
+import threading
+import queue
+import asyncio
+from typing import List, Dict, Optional, Tuple, Callable, Any
 from datetime import datetime
+from functools import lru_cache
+from sqlalchemy import insert, func, text
 from sqlalchemy.orm import Session
-from ..models.log import LogEntry, LogFile, ParseRule, LogLevel, LogType
+from ..models.log import LogEntry, LogFile, LogLineStat, LogRollup, ParseRule, LogLevel, LogType
 from ..models.user import User
-from .dsl_parser import DSLRuleEngine
+from .log_storage import is_partitioned, ensure_partition, attach_partition, clear_log_file_entries
+from .dsl_parser import DSLRuleEngine, ASTNode, KeywordNode, BinaryOpNode, UnaryOpNode
+
+
+# 批量写入的行数；进度上报的最小间隔（秒）
+BULK_BATCH_SIZE = 5000
+PROGRESS_INTERVAL = 1.0
+
+# 流水线：读取 -> 解析/检测（线程池）-> 写入，阶段之间为有界队列
+PIPELINE_PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", "2"))
+PIPELINE_QUEUE_DEPTH = 4  # 每个队列最多缓存的批次数
+_PIPELINE_END = object()
+
+# 存储模式：full 全部行写入 log_entries；problems 仅写入问题行及前后 LOG_CONTEXT_LINES 行上下文，
+# 其余行只保留按级别/来源聚合的计数（log_line_stats），全文以原始文件为准
+STORAGE_MODES = ("full", "problems")
+DEFAULT_STORAGE_MODE = os.environ.get("LOG_STORAGE_MODE", "full")
+DEFAULT_CONTEXT_LINES = int(os.environ.get("LOG_CONTEXT_LINES", "3"))
+
+# 批量导入模式（仅 PostgreSQL + psycopg2）：先 COPY 到无索引的暂存表，解析完成后一次性并入 log_entries（已分区时直接挂为分区），
+# 全文 GIN 索引的维护按文件一次完成而不是逐行进行
+DEFAULT_BULK_LOAD = os.environ.get("LOG_BULK_LOAD", "0").lower() in ("1", "true", "yes")
+BULK_GIN_PENDING_LIST_LIMIT = os.environ.get("LOG_BULK_GIN_PENDING_LIST", "256MB")
+
+# COPY 写入的列顺序（与 _parse_log_line 返回的行字典对应）
+_ENTRY_COLUMNS = (
+    "log_file_id", "line_number", "raw_content", "parsed_content", "timestamp", "log_level",
+    "source", "message", "message_offset", "problem_detected", "problem_type", "problem_description",
+)
+
+# —— 时间戳快速解码：已知格式按固定位置切片，结果按原串缓存（同一秒内的行共享前缀） ——
+_MONTHS = {m: i for i, m in enumerate(
+    ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), 1)}
+
+
+def _hms(t: str) -> Tuple[int, int, int]:
+    if len(t) != 8 or t[2] != ":" or t[5] != ":":
+        raise ValueError(t)
+    return int(t[0:2]), int(t[3:5]), int(t[6:8])
+
+
+def _decode_syslog_ts(ts: str) -> datetime:
+    # "Jan 12 10:00:01" / "Jan  2 10:00:01"；与 strptime('%b %d ...') 一致，年份为 1900
+    mon, day, hms = ts.split()
+    month = _MONTHS.get(mon.lower())
+    if month is None:
+        raise ValueError(ts)
+    return datetime(1900, month, int(day), *_hms(hms))
+
+
+def _decode_iso_ts(ts: str) -> datetime:
+    # "2024-01-01 12:00:00"
+    if ts[4] != "-" or ts[7] != "-":
+        raise ValueError(ts)
+    return datetime(int(ts[0:4]), int(ts[5:7]), int(ts[8:10]), *_hms(ts[-8:]))
+
+
+def _decode_us_ts(ts: str) -> datetime:
+    # "01/01/2024 12:00:00"
+    if ts[2] != "/" or ts[5] != "/":
+        raise ValueError(ts)
+    return datetime(int(ts[6:10]), int(ts[0:2]), int(ts[3:5]), *_hms(ts[-8:]))
+
+
+_TS_DECODERS = {
+    "%b %d %H:%M:%S": _decode_syslog_ts,
+    "%Y-%m-%d %H:%M:%S": _decode_iso_ts,
+    "%m/%d/%Y %H:%M:%S": _decode_us_ts,
+}
+
+
+@lru_cache(maxsize=4096)
+def _decode_timestamp(ts: str, fmt: str) -> datetime:
+    """按格式解码时间戳；未知格式回退到 strptime。无效时间抛出 ValueError"""
+    decoder = _TS_DECODERS.get(fmt)
+    if decoder is None:
+        return datetime.strptime(ts, fmt)
+    return decoder(ts)
+
+
+# 时间戳搜索模式及对应格式（逐项提取的回退路径使用）
+_TIMESTAMP_PATTERNS = [
+    (re.compile(r'(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})'), "%Y-%m-%d %H:%M:%S"),   # 2024-01-01 12:00:00
+    (re.compile(r'(\w{3}\s+\d{1,2}\s+\d{2}:\d{2}:\d{2})'), "%b %d %H:%M:%S"),       # Jan 01 12:00:00
+    (re.compile(r'(\d{2}\/\d{2}\/\d{4}\s+\d{2}:\d{2}:\d{2})'), "%m/%d/%Y %H:%M:%S"), # 01/01/2024 12:00:00
+]
+
+# dmesg 单调时间戳 "[ 1234.567890] message"（开机以来的秒数，无绝对时间）
+_KERNEL_STAMP_RE = re.compile(r"\[\s*(?P<up>\d+\.\d+)\]\s*(?P<msg>.*)")
+
+# 已知行布局的整行模式：一次匹配取出时间戳、主机、进程、PID 与消息；
+# 按行首字符分派（字母开头为 BSD syslog，数字开头为 ISO/美式日期），均不匹配时回退到逐项提取
+_SYSLOG_TAIL = r"(?P<proc>[^\s:\[\]]+)(?:\[(?P<pid>\d+)\])?:\s*(?P<msg>.*)"
+_LINE_LAYOUTS_ALPHA = [
+    # Jan 12 10:00:01 host sshd[123]: message
+    (re.compile(r"(?P<ts>[A-Z][a-z]{2}\s+\d{1,2}\s+\d{2}:\d{2}:\d{2})\s+(?P<host>\S+)\s+" + _SYSLOG_TAIL),
+     "%b %d %H:%M:%S"),
+]
+_LINE_LAYOUTS_DIGIT = [
+    # 2024-01-01 12:00:00[.123] sshd[123]: message
+    (re.compile(r"(?P<ts>\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})[.\d]*\s+" + _SYSLOG_TAIL),
+     "%Y-%m-%d %H:%M:%S"),
+    # 01/01/2024 12:00:00 sshd[123]: message
+    (re.compile(r"(?P<ts>\d{2}/\d{2}/\d{4}\s+\d{2}:\d{2}:\d{2})\s+" + _SYSLOG_TAIL),
+     "%m/%d/%Y %H:%M:%S"),
+]
+
+# —— 按文件的格式识别：取前 N 行试探，选定专用解析函数 ——
+FORMAT_SNIFF_LINES = 50
+FORMAT_MIN_RATIO = 0.6  # 样本中至少该比例的行符合时才认定格式
+
+# <PRI>VERSION TIMESTAMP HOST APP PROCID MSGID [SD] MSG
+_RFC5424_RE = re.compile(
+    r"(?:<(?P<pri>\d{1,3})>)?1 (?P<ts>\S+) (?P<host>\S+) (?P<app>\S+) (?P<procid>\S+) (?P<msgid>\S+) "
+    r"(?P<sd>-|(?:\[(?:[^\]\\]|\\.)*\])+)(?: (?P<msg>.*))?"
+)
+_PRI_RE = re.compile(r"<\d{1,3}>")
+
+_JSON_TIME_KEYS = ("timestamp", "@timestamp", "time", "ts", "datetime")
+_JSON_MESSAGE_KEYS = ("message", "msg", "log", "text")
+_JSON_SOURCE_KEYS = ("source", "logger", "service", "app", "program", "name")
+_JSON_LEVELS = {
+    "debug": LogLevel.DEBUG, "trace": LogLevel.DEBUG,
+    "info": LogLevel.INFO, "notice": LogLevel.INFO,
+    "warn": LogLevel.WARNING, "warning": LogLevel.WARNING,
+    "error": LogLevel.ERROR, "err": LogLevel.ERROR,
+    "critical": LogLevel.CRITICAL, "crit": LogLevel.CRITICAL, "fatal": LogLevel.CRITICAL,
+    "alert": LogLevel.CRITICAL, "emerg": LogLevel.CRITICAL, "panic": LogLevel.CRITICAL,
+}
+
+# 细分格式 -> LogType（枚举只有三类，JSON 与通用文本归入 CUSTOM）
+_FORMAT_LOG_TYPES = {
+    "rfc3164": LogType.SYSLOG,
+    "rfc5424": LogType.SYSLOG,
+    "dmesg": LogType.KERNLOG,
+    "json": LogType.CUSTOM,
+    "generic": LogType.CUSTOM,
+}
+
+
+def _decode_iso8601(ts: str) -> datetime:
+    # RFC5424 / JSON 中的 ISO 8601（含 T、小数秒与时区）
+    return datetime.fromisoformat(ts[:-1] + "+00:00" if ts.endswith("Z") else ts)
+
+
+_TS_DECODERS["iso8601"] = _decode_iso8601
+
+
+# —— 已编译规则集：进程内缓存，规则变更时由 api/v1/rules.py 调用 invalidate_rule_cache() 失效 ——
+def _compile_dsl_plan(node: ASTNode) -> Callable[[str, str], bool]:
+    """把 DSL 语法树编译为闭包 (小写文本, 空白归一化文本) -> bool，语义与 DSLEvaluator 一致"""
+    if isinstance(node, KeywordNode):
+        keyword = node.keyword.lower().strip()
+        return lambda lower, normalized: keyword in normalized or keyword in lower
+    if isinstance(node, BinaryOpNode):
+        left, right = _compile_dsl_plan(node.left), _compile_dsl_plan(node.right)
+        if node.operator == "&":
+            return lambda lower, normalized: left(lower, normalized) and right(lower, normalized)
+        if node.operator == "|":
+            return lambda lower, normalized: left(lower, normalized) or right(lower, normalized)
+        raise ValueError(f"Unknown binary operator: {node.operator}")
+    if isinstance(node, UnaryOpNode) and node.operator == "!":
+        operand = _compile_dsl_plan(node.operand)
+        return lambda lower, normalized: not operand(lower, normalized)
+    raise ValueError(f"Unknown node type: {type(node)}")
+
+
+def _compile_json_path(path: str) -> Callable[[Any], bool]:
+    """预编译键路径（a.b.c）为访问函数：对象中存在该路径时返回 True"""
+    keys = tuple(path.split("."))
+    
+    def accessor(data: Any) -> bool:
+        current = data
+        for key in keys:
+            if isinstance(current, dict) and key in current:
+                current = current[key]
+            else:
+                return False
+        return True
+    return accessor
+
+
+_UNPARSED = object()
+
+
+def _load_json_object(content: str) -> Optional[dict]:
+    """每行最多解析一次；只有以 { 开头的行可能命中键路径，其它行直接跳过"""
+    text = content.lstrip()
+    if not text.startswith("{"):
+        return None
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+class _CompiledRuleset:
+    """编译后的规则集（按优先级降序）：正则预编译（IGNORECASE），关键字合并为一个预筛正则，
+    DSL 编译为闭包；每行的小写/归一化文本最多计算一次。match() 返回第一个命中的规则
+    """
+    
+    def __init__(self, rules: List[Dict]):
+        self.rules = rules
+        self._matchers: List[Tuple[str, Any, Dict]] = []
+        keywords: List[str] = []
+        for rule in rules:
+            rule_type = rule.get("rule_type", "regex")
+            if rule_type == "regex":
+                try:
+                    self._matchers.append(("regex", re.compile(rule["pattern"], re.IGNORECASE).search, rule))
+                except re.error:
+                    print(f"正则规则编译失败: {rule['name']}")
+            elif rule_type == "keyword":
+                keyword = rule["pattern"].lower()
+                keywords.append(keyword)
+                self._matchers.append(("keyword", keyword, rule))
+            elif rule_type == "dsl":
+                compiled = rule.get("compiled_dsl")
+                if compiled and compiled["compiled"]:
+                    self._matchers.append(("dsl", _compile_dsl_plan(compiled["ast"]), rule))
+            elif rule_type == "json_path":
+                self._matchers.append(("json_path", _compile_json_path(rule["pattern"]), rule))
+        # 所有关键字都不出现时一次性跳过全部关键字规则
+        self._any_keyword = re.compile("|".join(map(re.escape, keywords))).search if keywords else None
+    
+    def __len__(self) -> int:
+        return len(self._matchers)
+    
+    def match(self, content: str, json_obj: Any = _UNPARSED) -> Optional[Dict]:
+        """json_obj 为格式解析阶段已得到的 JSON 对象（None 表示非 JSON 行），避免重复解析"""
+        lower = normalized = None
+        keyword_present = None
+        for kind, matcher, rule in self._matchers:
+            if kind == "regex":
+                hit = matcher(content) is not None
+            elif kind == "keyword":
+                if lower is None:
+                    lower = content.lower()
+                if keyword_present is None:
+                    keyword_present = self._any_keyword(lower) is not None
+                hit = keyword_present and matcher in lower
+            elif kind == "dsl":
+                if lower is None:
+                    lower = content.lower()
+                if normalized is None:
+                    normalized = " ".join(lower.split())
+                hit = matcher(lower, normalized)
+            else:
+                if json_obj is _UNPARSED:
+                    json_obj = _load_json_object(content)
+                hit = json_obj is not None and matcher(json_obj)
+            if hit:
+                return rule
+        return None
+
+
+_RULESET_LOCK = threading.Lock()
+_RULESET_CACHE: Dict[str, Any] = {"fingerprint": None, "ruleset": None}
+
+
+def invalidate_rule_cache():
+    """规则增删改/启停后调用，下次解析时重新加载并编译"""
+    with _RULESET_LOCK:
+        _RULESET_CACHE["fingerprint"] = None
+        _RULESET_CACHE["ruleset"] = None
 
 
 class LogParserService:
     """日志解析服务 - 核心日志分析引擎"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, progress_callback: Optional[Callable[[int, int, int], None]] = None,
+                 storage_mode: Optional[str] = None, context_lines: Optional[int] = None,
+                 bulk_load: Optional[bool] = None):
         self.db = db
         self.builtin_rules = self._init_builtin_rules()
+        # 进度回调 (file_id, processed, total)；未提供时写入 Redis，不再为进度单独提交事务
+        self.progress_callback = progress_callback or self._publish_progress
+        self.storage_mode = storage_mode or DEFAULT_STORAGE_MODE
+        if self.storage_mode not in STORAGE_MODES:
+            raise ValueError(f"不支持的存储模式: {self.storage_mode}")
+        # 上下文行数不超过一个批次，保证只需相邻批次即可取到
+        self.context_lines = max(0, min(BULK_BATCH_SIZE, DEFAULT_CONTEXT_LINES if context_lines is None else context_lines))
+        self.bulk_load = DEFAULT_BULK_LOAD if bulk_load is None else bulk_load
     
     def _init_builtin_rules(self) -> List[Dict]:
         """初始化内置解析规则"""
@@ -71,62 +354,197 @@ class LogParserService:
         ]
     
     async def parse_log_file(self, log_file: LogFile, user: User) -> Dict:
-        """解析日志文件"""
+        """解析日志文件。整个流水线在线程中运行，不阻塞事件循环"""
+        return await asyncio.to_thread(self._parse_log_file_sync, log_file)
+    
+    def _parse_log_file_sync(self, log_file: LogFile) -> Dict:
+        """读取线程按批读行 -> 解析线程池解析并检测问题 -> 当前线程（唯一使用会话的线程）按文件顺序批量写入。
+        读取线程领先写入的批次数有上限（inflight），内存占用保持平稳。
+        重新解析时旧条目在新条目提交的同一事务中清除，读者不会看到新旧条目混杂
+        """
         start_time = time.time()
+        stop = threading.Event()
+        threads: List[threading.Thread] = []
+        staging: Optional[str] = None
         
         try:
-            # 读取文件内容
-            with open(log_file.file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                lines = f.readlines()
+            # 读取/解析线程只使用这两个值：写入线程提交后 log_file 会过期，跨线程访问会触发重新加载
+            file_id, file_path = log_file.id, log_file.file_path
             
-            # 更新文件统计信息
-            log_file.total_lines = len(lines)
-            self.db.commit()
+            # 按行惰性读取，文件大小用于估算总行数
+            file_size = os.path.getsize(file_path)
+            
+            # 识别文件格式并选定专用解析函数
+            log_format, log_type = self._detect_format(log_file.file_path)
+            line_parser = self._format_parser(log_format)
+            if log_type is not None:
+                log_file.log_type = log_type
             
             # 获取解析规则
             rules = self._get_parse_rules()
+            log_file.storage_mode = self.storage_mode
+            partitioned = is_partitioned(self.db)
+            if self.bulk_load and self._supports_copy():
+                staging = self._create_staging_table(log_file.id, unlogged=not partitioned)
+            else:
+                if partitioned:
+                    ensure_partition(self.db, log_file.id)
+                    self.db.commit()
+                # 重新解析：旧条目的清除与新条目的写入在同一事务中提交（直接写入时整个解析为一个事务）
+                clear_log_file_entries(self.db, log_file.id, partitioned)
+            # context 为 None 表示全部行入库
+            context = self.context_lines if self.storage_mode == "problems" else None
+            edge = context or 0
+            
+            workers = max(1, PIPELINE_PARSE_WORKERS)
+            line_q: "queue.Queue" = queue.Queue(maxsize=PIPELINE_QUEUE_DEPTH)
+            row_q: "queue.Queue" = queue.Queue(maxsize=PIPELINE_QUEUE_DEPTH)
+            failures: List[BaseException] = []
+            # 已读出但尚未写入的批次数上限：解析线程池乱序交付的批次在写入端暂存，不会无限增长
+            inflight = threading.Semaphore(workers + 2 * PIPELINE_QUEUE_DEPTH)
+            
+            def put(q: "queue.Queue", item) -> bool:
+                while not stop.is_set():
+                    try:
+                        q.put(item, timeout=0.1)
+                        return True
+                    except queue.Full:
+                        continue
+                return False
+            
+            def put_batch(item) -> bool:
+                while not stop.is_set():
+                    if inflight.acquire(timeout=0.1):
+                        return put(line_q, item)
+                return False
             
-            # 解析每一行
+            def reader():
+                # 批次延后一批发出，以便附带前后各 context 行（仅用于判断上下文，不重复写入）
+                try:
+                    chunk: List[str] = []
+                    first = 1
+                    bytes_read = 0
+                    pending = None
+                    tail: List[str] = []
+                    for line_number, line, bytes_read in self._iter_lines(file_path):
+                        chunk.append(line)
+                        if len(chunk) >= BULK_BATCH_SIZE:
+                            if pending is not None and not put_batch(pending + (chunk[:edge],)):
+                                return
+                            pending = (first, chunk, tail, bytes_read)
+                            tail = chunk[len(chunk) - edge:] if edge else []
+                            first, chunk = line_number + 1, []
+                    if chunk:
+                        if pending is not None and not put_batch(pending + (chunk[:edge],)):
+                            return
+                        pending = (first, chunk, tail, bytes_read)
+                    if pending is not None:
+                        put_batch(pending + ([],))
+                except BaseException as e:
+                    failures.append(e)
+                    stop.set()
+                finally:
+                    for _ in range(workers):
+                        put(line_q, _PIPELINE_END)
+            
+            def parser():
+                try:
+                    while not stop.is_set():
+                        try:
+                            item = line_q.get(timeout=0.1)
+                        except queue.Empty:
+                            continue
+                        if item is _PIPELINE_END:
+                            break
+                        first, chunk, before, bytes_read, after = item
+                        put(row_q, (first,) + self._parse_chunk(file_id, first, chunk, rules, line_parser,
+                                                                context, before, after) + (bytes_read,))
+                except BaseException as e:
+                    failures.append(e)
+                    stop.set()
+                finally:
+                    put(row_q, _PIPELINE_END)
+            
+            threads.append(threading.Thread(target=reader, name=f"log-reader-{file_id}", daemon=True))
+            threads.extend(threading.Thread(target=parser, name=f"log-parser-{file_id}-{i}", daemon=True)
+                           for i in range(workers))
+            for t in threads:
+                t.start()
+            
+            # 写入阶段：解析线程池可能乱序交付批次，按首行号暂存，与单线程解析一样按文件顺序写入
             processed_count = 0
+            stored_count = 0
             error_count = 0
-            problems_found = 0
-            problem_summary = {}
+            lines_seen = 0
+            problem_summary: Dict[str, int] = {}
+            line_stats: Dict[Tuple[Any, Any], List[int]] = {}
+            rollups: Dict[Tuple[str, str, datetime], int] = {}
+            last_progress = time.time()
+            finished = 0
+            max_bytes = 0
+            waiting: Dict[int, tuple] = {}
+            next_line = 1
             
-            for line_number, line in enumerate(lines, 1):
+            while finished < workers:
                 try:
-                    log_entry = self._parse_log_line(
-                        log_file.id, line_number, line.strip(), rules
-                    )
-                    
-                    if log_entry.problem_detected:
-                        problems_found += 1
-                        problem_type = log_entry.problem_type
-                        if problem_type not in problem_summary:
-                            problem_summary[problem_type] = 0
-                        problem_summary[problem_type] += 1
-                    
-                    self.db.add(log_entry)
-                    processed_count += 1
-                    
-                    # 批量提交以提高性能
-                    if processed_count % 1000 == 0:
-                        self.db.commit()
-                        log_file.processed_lines = processed_count
-                        self.db.commit()
-                        
-                except Exception as e:
-                    error_count += 1
-                    print(f"解析第 {line_number} 行时出错: {str(e)}")
+                    item = row_q.get(timeout=0.1)
+                except queue.Empty:
+                    if stop.is_set():
+                        break
                     continue
+                if item is _PIPELINE_END:
+                    finished += 1
+                    continue
+                waiting[item[0]] = item
+                while next_line in waiting:
+                    first, rows, parsed, errors, summary, stats, minutes, bytes_read = waiting.pop(next_line)
+                    next_line = first + parsed + errors
+                    inflight.release()
+                    if rows:
+                        self._bulk_insert_entries(rows, staging)
+                        if staging:
+                            self.db.commit()
+                    processed_count += parsed
+                    stored_count += len(rows)
+                    error_count += errors
+                    lines_seen += parsed + errors
+                    max_bytes = max(max_bytes, bytes_read)
+                    for problem_type, count in summary.items():
+                        problem_summary[problem_type] = problem_summary.get(problem_type, 0) + count
+                    for key, (lines, problems) in stats.items():
+                        acc = line_stats.setdefault(key, [0, 0])
+                        acc[0] += lines
+                        acc[1] += problems
+                    for key, count in minutes.items():
+                        rollups[key] = rollups.get(key, 0) + count
+                now = time.time()
+                if now - last_progress >= PROGRESS_INTERVAL:
+                    self.progress_callback(log_file.id, processed_count,
+                                           self._estimate_total(lines_seen, max_bytes, file_size))
+                    last_progress = now
             
-            # 最终提交
-            self.db.commit()
+            if failures:
+                raise failures[0]
+            if waiting:
+                raise RuntimeError(f"解析批次缺失：第 {next_line} 行起的批次未交付")
+            
+            self._save_line_stats(log_file.id, line_stats)
+            self._save_rollups(log_file.id, rollups)
+            if staging:
+                clear_log_file_entries(self.db, log_file.id, partitioned)
+                if partitioned:
+                    attach_partition(self.db, staging, log_file.id)
+                else:
+                    self._merge_staging_table(staging)
+                staging = None
             
             # 更新文件状态
+            log_file.total_lines = processed_count + error_count
             log_file.processed_lines = processed_count
             log_file.error_lines = error_count
             log_file.is_processed = True
             self.db.commit()
+            self.progress_callback(log_file.id, processed_count, log_file.total_lines)
             
             processing_time = time.time() - start_time
             
@@ -134,7 +552,10 @@ class LogParserService:
                 "total_lines": log_file.total_lines,
                 "processed_lines": processed_count,
                 "error_lines": error_count,
-                "problems_found": problems_found,
+                "log_format": log_format,
+                "storage_mode": self.storage_mode,
+                "stored_entries": stored_count,
+                "problems_found": sum(problem_summary.values()),
                 "problem_summary": [
                     {"type": k, "count": v} for k, v in problem_summary.items()
                 ],
@@ -143,12 +564,199 @@ class LogParserService:
             
         except Exception as e:
             # 标记为处理失败
+            stop.set()
+            self.db.rollback()
+            if staging:
+                self._drop_staging_table(staging)
             log_file.is_processed = False
             self.db.commit()
             raise Exception(f"解析文件失败: {str(e)}")
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+    
+    def _parse_chunk(self, log_file_id: int, first_line: int, lines: List[str], rules: "_CompiledRuleset",
+                     line_parser, context: Optional[int] = None, before: List[str] = (), after: List[str] = ()
+                     ) -> Tuple[List[Dict[str, Any]], int, int, Dict[str, int], Dict[Tuple[Any, Any], List[int]],
+                                Dict[Tuple[str, str, datetime], int]]:
+        """解析一批行，返回 (待写入的行字典, 解析成功行数, 出错行数, 问题类型计数, (级别, 来源) -> [行数, 问题行数],
+        (维度, 键, 分钟) -> 行数)。无时间戳的行不计入分钟汇总。
+        context 不为 None 时只保留问题行及其前后 context 行；before/after 为相邻批次的边界行，仅用于判断上下文
+        """
+        rows: List[Dict[str, Any]] = []
+        errors = 0
+        summary: Dict[str, int] = {}
+        stats: Dict[Tuple[Any, Any], List[int]] = {}
+        minutes: Dict[Tuple[str, str, datetime], int] = {}
+        for line_number, line in enumerate(lines, first_line):
+            try:
+                row = self._parse_log_line(log_file_id, line_number, line.strip(), rules, line_parser)
+            except Exception as e:
+                errors += 1
+                print(f"解析第 {line_number} 行时出错: {str(e)}")
+                continue
+            acc = stats.setdefault((row["log_level"], row["source"]), [0, 0])
+            acc[0] += 1
+            minute = row["timestamp"].replace(second=0, microsecond=0) if row["timestamp"] else None
+            if minute is not None:
+                key = ("level", row["log_level"].value if row["log_level"] else "unknown", minute)
+                minutes[key] = minutes.get(key, 0) + 1
+            if row["problem_detected"]:
+                acc[1] += 1
+                summary[row["problem_type"]] = summary.get(row["problem_type"], 0) + 1
+                if minute is not None:
+                    key = ("problem_type", row["problem_type"] or "", minute)
+                    minutes[key] = minutes.get(key, 0) + 1
+            rows.append(row)
+        parsed = len(rows)
+        if context is not None:
+            problem_lines = [r["line_number"] for r in rows if r["problem_detected"]]
+            problem_lines.extend(n for n, line in enumerate(before, first_line - len(before))
+                                 if rules.match(line.strip()) is not None)
+            problem_lines.extend(n for n, line in enumerate(after, first_line + len(lines))
+                                 if rules.match(line.strip()) is not None)
+            keep = set()
+            for n in problem_lines:
+                keep.update(range(n - context, n + context + 1))
+            rows = [r for r in rows if r["line_number"] in keep]
+        return rows, parsed, errors, summary, stats, minutes
+    
+    @staticmethod
+    def _iter_lines(path: str):
+        """逐行读取文件，产出 (行号, 行文本, 已读字节数)；内存占用与文件大小无关"""
+        pos = 0
+        with open(path, 'rb') as f:
+            for line_number, raw in enumerate(f, 1):
+                pos += len(raw)
+                yield line_number, raw.decode('utf-8', errors='ignore'), pos
+    
+    @staticmethod
+    def _estimate_total(lines_read: int, bytes_read: int, file_size: int) -> int:
+        """按已读字节比例估算总行数"""
+        if bytes_read <= 0 or bytes_read >= file_size:
+            return lines_read
+        return int(lines_read * file_size / bytes_read)
+    
+    def _supports_copy(self) -> bool:
+        bind = self.db.get_bind()
+        return bind.dialect.name == "postgresql" and bind.dialect.driver == "psycopg2"
+    
+    def _bulk_insert_entries(self, rows: List[Dict[str, Any]], table: Optional[str] = None):
+        """批量写入日志条目：PostgreSQL(psycopg2) 使用 COPY（可指定暂存表），其它数据库使用 Core insert() 的 executemany"""
+        if self._supports_copy():
+            self._copy_entries(rows, table or LogEntry.__tablename__)
+        else:
+            self.db.execute(insert(LogEntry.__table__), rows)
+    
+    @staticmethod
+    def _staging_table_name(log_file_id: int) -> str:
+        return f"{LogEntry.__tablename__}_stage_{int(log_file_id)}"
+    
+    def _create_staging_table(self, log_file_id: int, unlogged: bool = True) -> str:
+        """创建无索引的暂存表；结构与默认值（含 id 序列）同 log_entries，残留的同名表先删除。
+        log_entries 已分区时暂存表最终直接挂为分区，因此建为普通表
+        """
+        name = self._staging_table_name(log_file_id)
+        self._drop_staging_table(name)
+        self.db.execute(text(
+            f"CREATE {'UNLOGGED ' if unlogged else ''}TABLE {name} "
+            f"(LIKE {LogEntry.__tablename__} INCLUDING DEFAULTS)"
+        ))
+        self.db.commit()
+        return name
     
-    def _get_parse_rules(self) -> List[Dict]:
-        """获取所有解析规则（内置 + 自定义）"""
+    def _merge_staging_table(self, name: str):
+        """暂存表一次性并入 log_entries（与文件状态在同一事务中提交）。
+        调大 gin_pending_list_limit，使 GIN 新条目先进入待处理列表，再排序后批量合并进索引
+        """
+        cols = ", ".join(("id", "created_at") + _ENTRY_COLUMNS)
+        self.db.execute(text("SELECT set_config('gin_pending_list_limit', :limit, true)"),
+                        {"limit": BULK_GIN_PENDING_LIST_LIMIT})
+        self.db.execute(text(
+            f"INSERT INTO {LogEntry.__tablename__} ({cols}) SELECT {cols} FROM {name} ORDER BY line_number"
+        ))
+        self.db.execute(text(f"DROP TABLE {name}"))
+    
+    def _drop_staging_table(self, name: str):
+        self.db.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        self.db.commit()
+    
+    def _copy_entries(self, rows: List[Dict[str, Any]], table: str):
+        """通过 COPY ... FROM STDIN (CSV) 写入；在会话当前事务内执行"""
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for row in rows:
+            ts = row["timestamp"]
+            level = row["log_level"]
+            parsed = row["parsed_content"]
+            writer.writerow((
+                row["log_file_id"], row["line_number"], row["raw_content"],
+                json.dumps(parsed, ensure_ascii=False) if parsed is not None else None,
+                ts.isoformat() if ts else None,
+                level.name if level else None,
+                row["source"], row["message"], row["message_offset"],
+                "t" if row["problem_detected"] else "f",
+                row["problem_type"], row["problem_description"],
+            ))
+        buf.seek(0)
+        cols = ", ".join(_ENTRY_COLUMNS)
+        # 未加引号的空字段在 CSV 模式下视为 NULL；raw_content 非空列需保留空字符串
+        sql = (f"COPY {table} ({cols}) FROM STDIN "
+               f"WITH (FORMAT csv, FORCE_NOT_NULL (raw_content))")
+        cursor = self.db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(sql, buf)
+        finally:
+            cursor.close()
+    
+    def _save_line_stats(self, log_file_id: int, line_stats: Dict[Tuple[Any, Any], List[int]]):
+        """写入按级别/来源聚合的行数（重新解析时先清除旧统计）"""
+        self.db.query(LogLineStat).filter(LogLineStat.log_file_id == log_file_id).delete(synchronize_session=False)
+        if line_stats:
+            self.db.execute(insert(LogLineStat.__table__), [
+                {"log_file_id": log_file_id, "log_level": level, "source": source,
+                 "line_count": lines, "problem_count": problems}
+                for (level, source), (lines, problems) in line_stats.items()
+            ])
+    
+    def _save_rollups(self, log_file_id: int, rollups: Dict[Tuple[str, str, datetime], int]):
+        """写入分钟级汇总（重新解析时先清除旧汇总）"""
+        self.db.query(LogRollup).filter(LogRollup.log_file_id == log_file_id).delete(synchronize_session=False)
+        if rollups:
+            self.db.execute(insert(LogRollup.__table__), [
+                {"log_file_id": log_file_id, "dimension": dimension, "key": key[:100], "bucket": bucket, "count": count}
+                for (dimension, key, bucket), count in rollups.items()
+            ])
+    
+    def _publish_progress(self, file_id: int, processed: int, total: int):
+        """默认进度上报：写入 Redis（log_parse_progress:{file_id}），失败时忽略"""
+        try:
+            from ..database import redis_client
+            key = f"log_parse_progress:{file_id}"
+            redis_client.hset(key, mapping={"processed": processed, "total": total or 0, "updated_at": time.time()})
+            redis_client.expire(key, 3600)
+        except Exception:
+            pass
+    
+    def _get_parse_rules(self) -> _CompiledRuleset:
+        """获取编译后的规则集（内置 + 自定义）。
+        进程内缓存；除显式失效外，还按规则表指纹（数量/最大ID/最近更新时间）校验，兼容多进程部署
+        """
+        fingerprint = tuple(self.db.query(
+            func.count(ParseRule.id), func.max(ParseRule.id), func.max(ParseRule.updated_at)
+        ).one())
+        with _RULESET_LOCK:
+            if _RULESET_CACHE["ruleset"] is not None and _RULESET_CACHE["fingerprint"] == fingerprint:
+                return _RULESET_CACHE["ruleset"]
+        ruleset = _CompiledRuleset(self._load_parse_rules())
+        with _RULESET_LOCK:
+            _RULESET_CACHE["fingerprint"] = fingerprint
+            _RULESET_CACHE["ruleset"] = ruleset
+        return ruleset
+    
+    def _load_parse_rules(self) -> List[Dict]:
+        """从数据库加载所有解析规则（内置 + 自定义），按优先级降序"""
         rules = self.builtin_rules.copy()
         
         # 获取数据库中的自定义规则
@@ -178,65 +786,229 @@ class LogParserService:
         return sorted(rules, key=lambda x: x["priority"], reverse=True)
     
     def _parse_log_line(self, log_file_id: int, line_number: int, 
-                       content: str, rules: List[Dict]) -> LogEntry:
-        """解析单行日志"""
-        log_entry = LogEntry(
-            log_file_id=log_file_id,
-            line_number=line_number,
-            raw_content=content,
-            problem_detected=False
-        )
-        
-        # 尝试解析时间戳
-        timestamp = self._extract_timestamp(content)
-        if timestamp:
-            log_entry.timestamp = timestamp
-        
-        # 尝试解析日志级别
-        level = self._extract_log_level(content)
-        if level:
-            log_entry.log_level = level
-        
-        # 尝试解析来源
-        source = self._extract_source(content)
-        if source:
-            log_entry.source = source
-        
-        # 提取消息内容
-        message = self._extract_message(content)
-        log_entry.message = message
+                       content: str, rules: _CompiledRuleset,
+                       line_parser: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None) -> Dict[str, Any]:
+        """解析单行日志，返回 log_entries 的行字典（供批量写入）。
+        依次尝试：文件格式对应的专用解析 -> 已知行布局 -> 逐项提取
+        """
+        fields = line_parser(content) if line_parser else None
+        if fields is None:
+            fields = self._tokenize_line(content)
+        if fields is None:
+            fields = {
+                "timestamp": self._extract_timestamp(content),
+                "source": self._extract_source(content),
+                "message": self._extract_message(content),
+                "parsed_content": None,
+            }
+        level = fields.pop("log_level", None) or self._extract_log_level(content)
+        # 以 { 开头却没有得到对象，说明已尝试解析且不是 JSON 对象，规则匹配时无需再解析
+        json_obj = fields.pop("json_object", None if content.startswith("{") else _UNPARSED)
+        row = {
+            "log_file_id": log_file_id,
+            "line_number": line_number,
+            "raw_content": content,
+            "log_level": level,
+            **fields,
+            "problem_detected": False,
+            "problem_type": None,
+            "problem_description": None,
+        }
+        # 消息是原文后缀时只记录偏移，不重复存储文本
+        message = row.get("message")
+        if message is not None and content.endswith(message):
+            row["message_offset"] = len(content) - len(message)
+            row["message"] = None
+        else:
+            row["message_offset"] = None
         
-        # 应用解析规则检测问题
-        for rule in rules:
-            if self._apply_rule(content, rule):
-                log_entry.problem_detected = True
-                log_entry.problem_type = rule["problem_type"]
-                log_entry.problem_description = rule["problem_description"]
-                break  # 只应用第一个匹配的规则（按优先级排序）
+        # 应用解析规则检测问题（只取第一个匹配的规则，按优先级排序）；
+        # JSON 行复用格式解析阶段得到的对象
+        rule = rules.match(content, json_obj)
+        if rule is not None:
+            row["problem_detected"] = True
+            row["problem_type"] = rule["problem_type"]
+            row["problem_description"] = rule["problem_description"]
         
-        return log_entry
+        return row
+    
+    def _detect_format(self, path: str) -> Tuple[str, Optional[LogType]]:
+        """读取前 FORMAT_SNIFF_LINES 个非空行，返回 (格式, LogType)；无法认定时返回 ("generic", None)"""
+        sample: List[str] = []
+        for _, line, _ in self._iter_lines(path):
+            line = line.strip()
+            if line:
+                sample.append(line)
+                if len(sample) >= FORMAT_SNIFF_LINES:
+                    break
+        if not sample:
+            return "generic", None
+        best, best_hits, kernel_hits = "generic", 0, 0
+        for fmt in ("json", "rfc5424", "rfc3164", "dmesg"):
+            parser = self._format_parser(fmt)
+            parsed = [parser(line) for line in sample]
+            hits = sum(1 for f in parsed if f is not None)
+            if hits > best_hits:
+                best, best_hits = fmt, hits
+                kernel_hits = sum(1 for f in parsed if f is not None and f.get("source") == "kernel")
+        if best_hits < len(sample) * FORMAT_MIN_RATIO:
+            return "generic", None
+        log_type = _FORMAT_LOG_TYPES[best]
+        # kern.log：syslog 格式但几乎全部来自内核
+        if best == "rfc3164" and kernel_hits >= best_hits * 0.8:
+            log_type = LogType.KERNLOG
+        return best, log_type
+    
+    def _format_parser(self, log_format: str) -> Optional[Callable[[str], Optional[Dict[str, Any]]]]:
+        return {
+            "rfc3164": self._parse_rfc3164,
+            "rfc5424": self._parse_rfc5424,
+            "dmesg": self._parse_dmesg,
+            "json": self._parse_json_line,
+        }.get(log_format)
+    
+    @staticmethod
+    def _syslog_fields(m: "re.Match", timestamp: Optional[datetime]) -> Dict[str, Any]:
+        parsed = {}
+        if m.groupdict().get("host"):
+            parsed["host"] = m.group("host")
+        if m.group("pid"):
+            parsed["pid"] = int(m.group("pid"))
+        message = m.group("msg")
+        # syslog 中转发的内核行带有 dmesg 时间戳
+        if message.startswith("["):
+            km = _KERNEL_STAMP_RE.match(message)
+            if km:
+                parsed["uptime"] = float(km.group("up"))
+                message = km.group("msg")
+        return {
+            "timestamp": timestamp,
+            "source": m.group("proc")[:100],
+            "message": message.strip(),
+            "parsed_content": parsed or None,
+        }
+    
+    def _parse_rfc3164(self, content: str) -> Optional[Dict[str, Any]]:
+        """BSD syslog：[<PRI>]Mmm dd hh:mm:ss host proc[pid]: msg"""
+        if content.startswith("<"):
+            pm = _PRI_RE.match(content)
+            if pm:
+                content = content[pm.end():]
+        pattern, fmt = _LINE_LAYOUTS_ALPHA[0]
+        m = pattern.match(content)
+        if not m:
+            return None
+        try:
+            return self._syslog_fields(m, _decode_timestamp(m.group("ts"), fmt))
+        except ValueError:
+            return None
+    
+    def _parse_rfc5424(self, content: str) -> Optional[Dict[str, Any]]:
+        """RFC5424：<PRI>1 ISO时间 host app procid msgid [SD] msg（"-" 表示空值）"""
+        m = _RFC5424_RE.match(content)
+        if not m:
+            return None
+        timestamp = None
+        if m.group("ts") != "-":
+            try:
+                timestamp = _decode_timestamp(m.group("ts"), "iso8601")
+            except ValueError:
+                return None
+        parsed = {}
+        for key in ("host", "procid", "msgid"):
+            if m.group(key) != "-":
+                parsed[key] = m.group(key)
+        if m.group("sd") != "-":
+            parsed["structured_data"] = m.group("sd")
+        app = m.group("app")
+        return {
+            "timestamp": timestamp,
+            "source": app[:100] if app != "-" else None,
+            "message": (m.group("msg") or "").lstrip("\ufeff").strip(),
+            "parsed_content": parsed or None,
+        }
+    
+    def _parse_dmesg(self, content: str) -> Optional[Dict[str, Any]]:
+        """dmesg：[ 1234.567890] msg；单调时间写入 parsed_content.uptime"""
+        m = _KERNEL_STAMP_RE.match(content)
+        if not m:
+            return None
+        return {
+            "timestamp": None,
+            "source": "kernel",
+            "message": m.group("msg").strip(),
+            "parsed_content": {"uptime": float(m.group("up"))},
+        }
+    
+    def _parse_json_line(self, content: str) -> Optional[Dict[str, Any]]:
+        """JSON lines：常见字段映射为时间/来源/级别/消息。对象原文已在 raw_content 中，不再另存到 parsed_content；
+        解析得到的对象通过 json_object 交给规则匹配（json_path），不写入数据库
+        """
+        if not content.startswith("{"):
+            return None
+        try:
+            data = json.loads(content)
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+        fields: Dict[str, Any] = {"timestamp": None, "source": None, "message": content, "parsed_content": None,
+                                  "json_object": data}
+        for key in _JSON_TIME_KEYS:
+            value = data.get(key)
+            if isinstance(value, str):
+                try:
+                    fields["timestamp"] = _decode_timestamp(value, "iso8601")
+                    break
+                except ValueError:
+                    continue
+        for key in _JSON_MESSAGE_KEYS:
+            if isinstance(data.get(key), str):
+                fields["message"] = data[key]
+                break
+        for key in _JSON_SOURCE_KEYS:
+            if isinstance(data.get(key), str):
+                fields["source"] = data[key][:100]
+                break
+        level = data.get("level") or data.get("severity")
+        if isinstance(level, str) and level.lower() in _JSON_LEVELS:
+            fields["log_level"] = _JSON_LEVELS[level.lower()]
+        return fields
+    
+    def _tokenize_line(self, content: str) -> Optional[Dict[str, Any]]:
+        """按已知行布局一次性解析；不匹配任何布局时返回 None"""
+        if not content:
+            return None
+        first = content[0]
+        if first == "[":
+            return self._parse_dmesg(content)
+        if first == "{":
+            return self._parse_json_line(content)
+        if first.isalpha():
+            layouts = _LINE_LAYOUTS_ALPHA
+        elif first.isdigit():
+            layouts = _LINE_LAYOUTS_DIGIT
+        else:
+            return None
+        for pattern, fmt in layouts:
+            m = pattern.match(content)
+            if not m:
+                continue
+            try:
+                timestamp = _decode_timestamp(m.group("ts"), fmt)
+            except ValueError:
+                continue
+            return self._syslog_fields(m, timestamp)
+        return None
     
     def _extract_timestamp(self, content: str) -> Optional[datetime]:
         """提取时间戳"""
-        # 常见的时间戳格式
-        timestamp_patterns = [
-            r'(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})',  # 2024-01-01 12:00:00
-            r'(\w{3}\s+\d{1,2}\s+\d{2}:\d{2}:\d{2})',    # Jan 01 12:00:00
-            r'(\d{2}\/\d{2}\/\d{4}\s+\d{2}:\d{2}:\d{2})', # 01/01/2024 12:00:00
-        ]
-        
-        for pattern in timestamp_patterns:
-            match = re.search(pattern, content)
+        for pattern, fmt in _TIMESTAMP_PATTERNS:
+            match = pattern.search(content)
             if match:
                 try:
-                    timestamp_str = match.group(1)
-                    # 尝试不同的时间格式解析
-                    for fmt in ['%Y-%m-%d %H:%M:%S', '%b %d %H:%M:%S', '%m/%d/%Y %H:%M:%S']:
-                        try:
-                            return datetime.strptime(timestamp_str, fmt)
-                        except ValueError:
-                            continue
-                except Exception:
+                    return _decode_timestamp(match.group(1), fmt)
+                except ValueError:
                     continue
         
         return None
@@ -292,50 +1064,3 @@ class LogParserService:
             message = re.sub(pattern, '', message)
         
         return message.strip()
-    
-    def _apply_rule(self, content: str, rule: Dict) -> bool:
-        """应用解析规则"""
-        try:
-            pattern = rule["pattern"]
-            rule_type = rule.get("rule_type", "regex")
-            
-            if rule_type == "regex":
-                return bool(re.search(pattern, content, re.IGNORECASE))
-            elif rule_type == "keyword":
-                return pattern.lower() in content.lower()
-            elif rule_type == "dsl":
-                # 使用DSL规则引擎
-                compiled_rule = rule.get("compiled_dsl")
-                if compiled_rule and compiled_rule["compiled"]:
-                    return DSLRuleEngine.match_rule(compiled_rule, content)
-                return False
-            elif rule_type == "json_path":
-                # 对于JSON格式的日志
-                try:
-                    data = json.loads(content)
-                    # 简单的JSON路径解析（可以后续扩展）
-                    return self._check_json_path(data, pattern)
-                except json.JSONDecodeError:
-                    return False
-            
-            return False
-            
-        except re.error:
-            # 正则表达式错误
-            return False
-    
-    def _check_json_path(self, data: dict, path: str) -> bool:
-        """检查JSON路径"""
-        # 简单实现，可以后续扩展为更复杂的JSONPath
-        keys = path.split('.')
-        current = data
-        
-        try:
-            for key in keys:
-                if isinstance(current, dict) and key in current:
-                    current = current[key]
-                else:
-                    return False
-            return True
-        except Exception:
-            return False 
\ No newline at end of file
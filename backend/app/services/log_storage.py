@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from ..config import LOG_RETENTION_DAYS
+from ..models.log import LogEntry, LogFile, LogLineStat, LogRollup
+
+
+# log_entries 按 log_file_id 做 LIST 分区（每个文件一个分区，另有 DEFAULT 分区存放迁移前的旧数据），
+# 删除文件 / 过期清理先并发脱离（DETACH ... CONCURRENTLY）再 DROP 分区，只是元数据操作；未分区（或非 PostgreSQL）时退化为按文件的批量 DELETE
+
+
+def partition_name(log_file_id: int) -> str:
+    return f"{LogEntry.__tablename__}_p{int(log_file_id)}"
+
+
+def is_partitioned(db: Session) -> bool:
+    """log_entries 是否为分区表"""
+    if db.get_bind().dialect.name != "postgresql":
+        return False
+    relkind = db.execute(text(
+        "SELECT c.relkind FROM pg_class c WHERE c.oid = to_regclass(:name)"
+    ), {"name": LogEntry.__tablename__}).scalar()
+    return relkind == "p"
+
+
+def partition_exists(db: Session, log_file_id: int) -> bool:
+    return db.execute(text("SELECT to_regclass(:name) IS NOT NULL"),
+                      {"name": partition_name(log_file_id)}).scalar()
+
+
+def default_partition(db: Session) -> Optional[str]:
+    """log_entries 的 DEFAULT 分区（存放分区化之前的旧数据）的表名，没有时返回 None"""
+    return db.execute(text(
+        "SELECT NULLIF(partdefid, 0)::regclass::text FROM pg_partitioned_table WHERE partrelid = to_regclass(:name)"
+    ), {"name": LogEntry.__tablename__}).scalar()
+
+
+def ensure_partition(db: Session, log_file_id: int):
+    """为文件创建分区（已存在时跳过）；调用方负责提交。
+    分区化之前上传的文件，其行仍在 DEFAULT 分区中，PostgreSQL 会拒绝创建与之重叠的分区：
+    此时在同一事务中把这些行搬进独立表，再挂为该文件的分区
+    """
+    file_id = int(log_file_id)
+    if partition_exists(db, file_id):
+        return
+    default = default_partition(db)
+    if default and db.execute(text(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE log_file_id = :id)"),
+                              {"id": file_id}).scalar():
+        table = f"{partition_name(file_id)}_legacy"
+        cols = ", ".join(c.name for c in LogEntry.__table__.columns)
+        db.execute(text(f"CREATE TABLE {table} (LIKE {LogEntry.__tablename__} INCLUDING DEFAULTS)"))
+        db.execute(text(
+            f"WITH moved AS (DELETE FROM {default} WHERE log_file_id = :id RETURNING {cols}) "
+            f"INSERT INTO {table} ({cols}) SELECT {cols} FROM moved"
+        ), {"id": file_id})
+        attach_partition(db, table, file_id)
+        return
+    db.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(file_id)} "
+        f"PARTITION OF {LogEntry.__tablename__} FOR VALUES IN ({file_id})"
+    ))
+
+
+def clear_log_file_entries(db: Session, log_file_id: int, partitioned: Optional[bool] = None):
+    """清除文件已有的日志条目（重新解析前调用），不提交：与新写入的条目在同一事务中生效，失败回滚时旧条目保留。
+    分区表上 TRUNCATE 文件分区（只锁该分区），DELETE 只会落到 DEFAULT 分区中的旧数据；未分区时为一次批量删除
+    """
+    if partitioned is None:
+        partitioned = is_partitioned(db)
+    if partitioned and partition_exists(db, log_file_id):
+        db.execute(text(f"TRUNCATE {partition_name(log_file_id)}"))
+    db.execute(LogEntry.__table__.delete().where(LogEntry.log_file_id == log_file_id))
+
+
+def attach_partition(db: Session, table: str, log_file_id: int):
+    """把已写好数据的独立表挂为文件分区：先加 CHECK 约束跳过挂载时的全表校验，
+    分区索引在挂载时按父表定义一次性建好。文件已有分区（重新解析）时先删除旧分区；调用方负责提交
+    """
+    file_id = int(log_file_id)
+    name = partition_name(file_id)
+    db.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {table}_file_check CHECK (log_file_id = {file_id})"))
+    db.execute(text(f"DROP TABLE IF EXISTS {name}"))
+    db.execute(text(f"ALTER TABLE {LogEntry.__tablename__} ATTACH PARTITION {table} FOR VALUES IN ({file_id})"))
+    db.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {table}_file_check"))
+    db.execute(text(f"ALTER TABLE {table} RENAME TO {name}"))
+
+
+def drop_partition(db: Session, log_file_id: int):
+    """脱离并删除文件分区。DETACH PARTITION ... CONCURRENTLY 只对父表加 SHARE UPDATE EXCLUSIVE 锁，
+    不阻塞其它文件的查询与写入；它不能在事务块中执行，因此在独立的自动提交连接上进行，立即生效。
+    此前中断的并发脱离（detach pending）先 FINALIZE；父表有 DEFAULT 分区时 PostgreSQL 不允许并发脱离，
+    退回普通 DETACH（短暂持有父表的 ACCESS EXCLUSIVE 锁，见 init.sql 的 drop_empty_default_log_partition()）
+    """
+    name = partition_name(log_file_id)
+    parent = LogEntry.__tablename__
+    with db.get_bind().connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        pending = conn.execute(text("SELECT inhdetachpending FROM pg_inherits WHERE inhrelid = to_regclass(:name)"),
+                               {"name": name}).scalar()
+        if pending:
+            conn.execute(text(f"ALTER TABLE {parent} DETACH PARTITION {name} FINALIZE"))
+        elif pending is not None:
+            concurrently = " CONCURRENTLY" if default_partition(conn) is None else ""
+            conn.execute(text(f"ALTER TABLE {parent} DETACH PARTITION {name}{concurrently}"))
+        conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+
+
+def drop_log_file_entries(db: Session, log_file_id: int):
+    """删除文件的全部日志条目、行数统计与分钟汇总；调用方负责提交。
+    分区表上文件分区由 drop_partition() 在独立连接上删除：并发脱离要等待已开始的事务结束，
+    因此先提交调用方当前的事务；分区删除随即生效，不随调用方之后的回滚恢复
+    """
+    if is_partitioned(db):
+        db.commit()
+        drop_partition(db, log_file_id)
+    # 分区表上此语句只会落到 DEFAULT 分区（旧数据）；未分区时为一次批量删除
+    db.execute(LogEntry.__table__.delete().where(LogEntry.log_file_id == log_file_id))
+    db.execute(LogLineStat.__table__.delete().where(LogLineStat.log_file_id == log_file_id))
+    db.execute(LogRollup.__table__.delete().where(LogRollup.log_file_id == log_file_id))
+
+
+def delete_log_file(db: Session, log_file: LogFile):
+    """删除文件记录及其条目，不经 ORM 逐条加载 log_entries"""
+    drop_log_file_entries(db, log_file.id)
+    db.delete(log_file)
+    db.commit()
+
+
+def apply_retention(db: Session, older_than: Optional[datetime] = None) -> List[int]:
+    """删除上传时间早于 older_than（默认按 LOG_RETENTION_DAYS 计算）的文件，返回被删除的文件ID"""
+    if older_than is None:
+        if LOG_RETENTION_DAYS <= 0:
+            return []
+        older_than = datetime.now().astimezone() - timedelta(days=LOG_RETENTION_DAYS)
+    expired = db.query(LogFile).filter(LogFile.created_at < older_than).all()
+    removed = []
+    for log_file in expired:
+        removed.append(log_file.id)
+        delete_log_file(db, log_file)
+    return removed
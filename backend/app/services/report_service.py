@@ -0,0 +1,333 @@
+import os
+import json
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import Session
+from ..models.log import LogFile, LogEntry, LogLineStat, LogRollup
+from ..models.report import Report, ReportType, ReportStatus
+
+
+# 报表在后台线程池中生成；完成后的内容写入 reports 表，并以序列化结果缓存到 Redis，重复查看/分享直接读缓存
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", "2"))
+REPORT_CACHE_TTL = int(os.environ.get("REPORT_CACHE_TTL", "3600"))
+TIMELINE_MAX_POINTS = 200
+PROBLEM_SAMPLES_PER_TYPE = 5
+
+_REPORT_EXECUTOR = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="report")
+
+
+def report_to_dict(report: Report, include_content: bool = True) -> Dict[str, Any]:
+    """报表的 JSON 表示（接口返回与缓存共用）"""
+    data = {
+        "id": report.id,
+        "title": report.title,
+        "description": report.description,
+        "report_type": report.report_type.value,
+        "status": report.status.value,
+        "log_file_ids": report.log_file_ids,
+        "date_range_start": report.date_range_start.isoformat() if report.date_range_start else None,
+        "date_range_end": report.date_range_end.isoformat() if report.date_range_end else None,
+        "filters": report.filters,
+        "summary": report.summary,
+        "is_public": bool(report.is_public),
+        "share_token": report.share_token,
+        "share_expires_at": report.share_expires_at.isoformat() if report.share_expires_at else None,
+        "generated_by": report.generated_by,
+        "generated_at": report.generated_at.isoformat() if report.generated_at else None,
+        "created_at": report.created_at.isoformat() if report.created_at else None,
+    }
+    if include_content:
+        data["content"] = report.content
+        data["charts_data"] = report.charts_data
+    return data
+
+
+def _cache_key(report_id: int) -> str:
+    return f"report_content:{report_id}"
+
+
+def get_cached_report(report_id: int) -> Optional[Dict[str, Any]]:
+    """读取已完成报表的缓存；Redis 不可用时返回 None"""
+    try:
+        from ..database import redis_client
+        raw = redis_client.get(_cache_key(report_id))
+        return json.loads(raw) if raw else None
+    except Exception:
+        return None
+
+
+def cache_report(data: Dict[str, Any]):
+    try:
+        from ..database import redis_client
+        redis_client.set(_cache_key(data["id"]), json.dumps(data, ensure_ascii=False), ex=REPORT_CACHE_TTL)
+    except Exception:
+        pass
+
+
+def invalidate_report_cache(report_id: int):
+    try:
+        from ..database import redis_client
+        redis_client.delete(_cache_key(report_id))
+    except Exception:
+        pass
+
+
+def submit_report_generation(report_id: int):
+    """提交后台生成任务；每个任务使用线程自己的会话"""
+    _REPORT_EXECUTOR.submit(_generate_in_background, report_id)
+
+
+def _generate_in_background(report_id: int):
+    from ..database import ScopedSession
+    db = ScopedSession()
+    try:
+        ReportService(db).generate(report_id)
+    except Exception as e:
+        print(f"报表 {report_id} 生成失败: {str(e)}")
+    finally:
+        ScopedSession.remove()
+
+
+class ReportService:
+    """报表服务：状态流转 PENDING -> GENERATING -> COMPLETED / FAILED。
+    内容只来自已汇总的数据（log_files、log_line_stats、log_rollups，问题样例经问题行索引读取少量行），不重新扫描日志
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def create_report(self, data: Dict[str, Any], user_id: int) -> Report:
+        """创建待生成的报表（调用方随后提交后台生成）"""
+        report = Report(
+            title=data["title"],
+            description=data.get("description"),
+            report_type=ReportType(data["report_type"]),
+            status=ReportStatus.PENDING,
+            log_file_ids=list(dict.fromkeys(data["log_file_ids"])),
+            date_range_start=data.get("date_range_start"),
+            date_range_end=data.get("date_range_end"),
+            filters=data.get("filters"),
+            generated_by=user_id,
+        )
+        self.db.add(report)
+        self.db.commit()
+        self.db.refresh(report)
+        return report
+
+    def share_report(self, report: Report, is_public: bool, expires_hours: Optional[int]) -> Report:
+        report.is_public = is_public
+        if is_public:
+            report.share_token = report.share_token or secrets.token_urlsafe(24)
+            report.share_expires_at = (datetime.now().astimezone() + timedelta(hours=expires_hours)
+                                       if expires_hours else None)
+        else:
+            report.share_token = None
+            report.share_expires_at = None
+        self.db.commit()
+        invalidate_report_cache(report.id)
+        return report
+
+    def generate(self, report_id: int) -> Optional[Report]:
+        """生成报表内容并缓存；失败时标记为 FAILED，原因写入 summary。生成期间报表被删除时返回 None，不写缓存"""
+        report = self.db.get(Report, report_id)
+        if report is None:
+            return None
+        report.status = ReportStatus.GENERATING
+        self.db.commit()
+        try:
+            content, charts, summary = self.build_content(report)
+            report.content = content
+            report.charts_data = charts
+            report.summary = summary
+            report.status = ReportStatus.COMPLETED
+            report.generated_at = datetime.now().astimezone()
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            if not self._exists(report_id):
+                return None  # 生成期间报表已被删除（提交时更新不到行）
+            report.status = ReportStatus.FAILED
+            report.summary = f"报表生成失败: {str(e)}"
+            self.db.commit()
+            invalidate_report_cache(report_id)
+            raise
+        try:
+            self.db.refresh(report)  # 写缓存前确认报表仍存在
+        except InvalidRequestError:
+            return None
+        cache_report(report_to_dict(report))
+        # 删除接口先提交再清缓存：删除若在上面的确认之后、写缓存之前完成，它的清除早于本次写入，由这里补清
+        if not self._exists(report_id):
+            invalidate_report_cache(report_id)
+            return None
+        return report
+
+    def _exists(self, report_id: int) -> bool:
+        return self.db.query(Report.id).filter(Report.id == report_id).scalar() is not None
+
+    def build_content(self, report: Report) -> Tuple[Dict[str, Any], Dict[str, Any], str]:
+        """按报表类型组装 (content, charts_data, summary)"""
+        file_ids = list(report.log_file_ids or [])
+        start, end = report.date_range_start, report.date_range_end
+        problem_types = (report.filters or {}).get("problem_types")
+
+        files = self._file_overview(file_ids)
+        levels = self._level_counts(file_ids, start, end)
+        problems = self._problem_counts(file_ids, start, end, problem_types)
+        totals = {
+            "files": len(files),
+            "total_lines": sum(f["total_lines"] for f in files),
+            "error_lines": sum(f["error_lines"] for f in files),
+            "problems": sum(problems.values()),
+        }
+
+        content: Dict[str, Any] = {"totals": totals, "level_counts": levels, "problem_counts": problems}
+        charts: Dict[str, Any] = {"level_distribution": levels, "problem_types": problems}
+        kind = report.report_type
+        if kind in (ReportType.DETAILED, ReportType.TREND_ANALYSIS, ReportType.PROBLEM_ANALYSIS):
+            timeline = self._timeline(file_ids, start, end, problem_types)
+            charts["timeline"] = timeline
+            if kind == ReportType.TREND_ANALYSIS:
+                content["peaks"] = self._peaks(timeline)
+        if kind in (ReportType.DETAILED, ReportType.PROBLEM_ANALYSIS):
+            content["problem_samples"] = self._problem_samples(file_ids, list(problems))
+        if kind == ReportType.DETAILED:
+            content["files"] = files
+
+        return content, charts, self._summary_text(totals, levels, problems)
+
+    def _file_overview(self, file_ids: List[int]) -> List[Dict[str, Any]]:
+        if not file_ids:
+            return []
+        problems = dict(self.db.query(LogLineStat.log_file_id, func.sum(LogLineStat.problem_count))
+                        .filter(LogLineStat.log_file_id.in_(file_ids))
+                        .group_by(LogLineStat.log_file_id).all())
+        return [
+            {
+                "id": f.id,
+                "filename": f.original_filename,
+                "log_type": f.log_type.value if f.log_type else None,
+                "total_lines": f.total_lines or 0,
+                "error_lines": f.error_lines or 0,
+                "problems": int(problems.get(f.id) or 0),
+                "is_processed": bool(f.is_processed),
+            }
+            for f in self.db.query(LogFile).filter(LogFile.id.in_(file_ids)).order_by(LogFile.id)
+        ]
+
+    def _level_counts(self, file_ids: List[int], start: Optional[datetime], end: Optional[datetime]) -> Dict[str, int]:
+        """按级别计数：未限定时间范围时用整文件统计，否则用分钟汇总（不含无时间戳的行）"""
+        if not file_ids:
+            return {}
+        if start is None and end is None:
+            rows = (self.db.query(LogLineStat.log_level, func.sum(LogLineStat.line_count))
+                    .filter(LogLineStat.log_file_id.in_(file_ids))
+                    .group_by(LogLineStat.log_level).all())
+            return {(level.value if level else "unknown"): int(n) for level, n in rows}
+        return self._rollup_totals(file_ids, "level", start, end)
+
+    def _problem_counts(self, file_ids: List[int], start: Optional[datetime], end: Optional[datetime],
+                        problem_types: Optional[List[str]]) -> Dict[str, int]:
+        """按问题类型计数：未限定时间范围时经问题行部分索引计数，否则用分钟汇总"""
+        if not file_ids:
+            return {}
+        if start is None and end is None:
+            query = (self.db.query(LogEntry.problem_type, func.count(LogEntry.id))
+                     .filter(LogEntry.log_file_id.in_(file_ids), LogEntry.problem_detected == True))
+            if problem_types:
+                query = query.filter(LogEntry.problem_type.in_(problem_types))
+            counts = {(t or ""): int(n) for t, n in query.group_by(LogEntry.problem_type).all()}
+        else:
+            counts = self._rollup_totals(file_ids, "problem_type", start, end, problem_types)
+        return dict(sorted(counts.items(), key=lambda kv: kv[1], reverse=True))
+
+    def _rollup_query(self, file_ids: List[int], dimension: str, start: Optional[datetime],
+                      end: Optional[datetime], keys: Optional[List[str]] = None):
+        query = self.db.query(LogRollup).filter(LogRollup.log_file_id.in_(file_ids),
+                                                LogRollup.dimension == dimension)
+        if start is not None:
+            query = query.filter(LogRollup.bucket >= start)
+        if end is not None:
+            query = query.filter(LogRollup.bucket <= end)
+        if keys:
+            query = query.filter(LogRollup.key.in_(keys))
+        return query
+
+    def _rollup_totals(self, file_ids: List[int], dimension: str, start: Optional[datetime],
+                       end: Optional[datetime], keys: Optional[List[str]] = None) -> Dict[str, int]:
+        query = self._rollup_query(file_ids, dimension, start, end, keys)
+        return {k: int(n) for k, n in query.with_entities(LogRollup.key, func.sum(LogRollup.count))
+                .group_by(LogRollup.key).all()}
+
+    def _timeline(self, file_ids: List[int], start: Optional[datetime], end: Optional[datetime],
+                  problem_types: Optional[List[str]]) -> Dict[str, Any]:
+        """错误/严重级别行数与问题数的时间序列；桶宽按跨度自动选择，最多 TIMELINE_MAX_POINTS 个点"""
+        if not file_ids:
+            return {"bucket_minutes": 1, "points": []}
+        series: Dict[Tuple[datetime, str], int] = {}
+        for dimension, keys, name in (("level", ["error", "critical"], "errors"),
+                                      ("problem_type", problem_types, "problems")):
+            query = self._rollup_query(file_ids, dimension, start, end, keys)
+            for bucket, n in (query.with_entities(LogRollup.bucket, func.sum(LogRollup.count))
+                              .group_by(LogRollup.bucket).all()):
+                series[(bucket, name)] = series.get((bucket, name), 0) + int(n)
+        if not series:
+            return {"bucket_minutes": 1, "points": []}
+
+        first = min(b for b, _ in series)
+        last = max(b for b, _ in series)
+        span = (last - first) // timedelta(minutes=1) + 1
+        bucket_minutes = max(1, -(-span // TIMELINE_MAX_POINTS))
+        width = timedelta(minutes=bucket_minutes)
+        points: Dict[datetime, Dict[str, int]] = {}
+        for (bucket, name), n in series.items():
+            key = first + (bucket - first) // width * width
+            point = points.setdefault(key, {"errors": 0, "problems": 0})
+            point[name] += n
+        return {
+            "bucket_minutes": bucket_minutes,
+            "points": [{"time": t.isoformat(), **counts} for t, counts in sorted(points.items())],
+        }
+
+    @staticmethod
+    def _peaks(timeline: Dict[str, Any], top: int = 5) -> Dict[str, List[Dict[str, Any]]]:
+        points = timeline.get("points", [])
+        return {
+            name: [{"time": p["time"], "count": p[name]}
+                   for p in sorted(points, key=lambda p: p[name], reverse=True)[:top] if p[name]]
+            for name in ("errors", "problems")
+        }
+
+    def _problem_samples(self, file_ids: List[int], problem_types: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """每种问题类型取前几条问题行作为样例（经问题行索引，只读取少量行）"""
+        samples: Dict[str, List[Dict[str, Any]]] = {}
+        for problem_type in problem_types:
+            rows = (self.db.query(LogEntry)
+                    .filter(LogEntry.log_file_id.in_(file_ids), LogEntry.problem_detected == True,
+                            LogEntry.problem_type == (problem_type or None))
+                    .order_by(LogEntry.log_file_id, LogEntry.line_number)
+                    .limit(PROBLEM_SAMPLES_PER_TYPE).all())
+            samples[problem_type] = [
+                {
+                    "log_file_id": e.log_file_id,
+                    "line_number": e.line_number,
+                    "timestamp": e.timestamp.isoformat() if e.timestamp else None,
+                    "message": e.message,
+                    "problem_description": e.problem_description,
+                }
+                for e in rows
+            ]
+        return samples
+
+    @staticmethod
+    def _summary_text(totals: Dict[str, int], levels: Dict[str, int], problems: Dict[str, int]) -> str:
+        text = (f"共 {totals['files']} 个文件、{totals['total_lines']} 行日志，"
+                f"发现 {totals['problems']} 个问题，错误级别 {levels.get('error', 0) + levels.get('critical', 0)} 行")
+        if problems:
+            top = next(iter(problems))
+            text += f"；最多的问题类型为「{top or '未分类'}」（{problems[top]} 次）"
+        return text
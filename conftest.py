@@ -0,0 +1,13 @@
+"""
+pytest 公共配置：在收集任何测试模块之前把数据库指向临时 SQLite 库、把内存版 main.py 的持久化目录
+（LOG_ANALYZER_DATA）指向临时目录，测试不读写仓库的 database/ 目录。
+backend.app.database 在首次导入时按 DATABASE_URL 建引擎；先被收集的模块（如 test_dsl_rules.py 导入
+backend.app.services）会以默认的 PostgreSQL 连接串建好引擎，测试文件各自的设置就不再生效，
+因此这里无条件覆盖，不依赖收集顺序
+"""
+
+import os
+import tempfile
+
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="loganalyzer-test-"), "test.sqlite3")
+os.environ["LOG_ANALYZER_DATA"] = tempfile.mkdtemp(prefix="loganalyzer-data-")
@@ -10,12 +10,13 @@ CREATE EXTENSION IF NOT EXISTS "pg_trgm";
 -- 创建索引函数
 CREATE OR REPLACE FUNCTION create_indexes_if_not_exists() RETURNS void AS $$
 BEGIN
-    -- 为日志条目创建全文搜索索引
+    -- 为日志条目创建全文搜索索引（只建在 raw_content 上：message 多以偏移引用 raw_content，不再是独立副本）
+    -- fastupdate：批量导入时新条目先进入待处理列表，再批量合并进索引
     IF NOT EXISTS (
         SELECT 1 FROM pg_indexes 
         WHERE indexname = 'idx_log_entries_search'
     ) THEN
-        CREATE INDEX idx_log_entries_search ON log_entries USING gin(to_tsvector('english', raw_content));
+        CREATE INDEX idx_log_entries_search ON log_entries USING gin(to_tsvector('english', raw_content)) WITH (fastupdate = on);
     END IF;
 
     -- 为时间戳创建索引
@@ -33,6 +34,118 @@ BEGIN
     ) THEN
         CREATE INDEX idx_log_entries_problem ON log_entries (problem_detected, problem_type);
     END IF;
+
+    -- 按文件的键集分页：行号顺序与时间顺序
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_indexes 
+        WHERE indexname = 'idx_log_entries_file_line'
+    ) THEN
+        CREATE INDEX idx_log_entries_file_line ON log_entries (log_file_id, line_number, id);
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_indexes 
+        WHERE indexname = 'idx_log_entries_file_time'
+    ) THEN
+        CREATE INDEX idx_log_entries_file_time ON log_entries (log_file_id, timestamp, id);
+    END IF;
+
+    -- 只查问题行时的分页（问题行稀疏，部分索引很小）
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_indexes 
+        WHERE indexname = 'idx_log_entries_file_problem'
+    ) THEN
+        CREATE INDEX idx_log_entries_file_problem ON log_entries (log_file_id, problem_type, line_number, id)
+            WHERE problem_detected;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 为旧库补齐新增列（与应用启动时执行的 upgrade_schema() 一致），语句幂等，可重复执行：SELECT upgrade_log_schema();
+CREATE OR REPLACE FUNCTION upgrade_log_schema() RETURNS void AS $$
+BEGIN
+    ALTER TABLE IF EXISTS log_files ADD COLUMN IF NOT EXISTS storage_mode varchar(20) DEFAULT 'full';
+    ALTER TABLE IF EXISTS log_entries ADD COLUMN IF NOT EXISTS message_offset integer;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 迁移已有数据：message 为 raw_content 后缀的行改存偏移（message_offset），并重建全文索引。
+-- 返回迁移的行数；执行后再运行 VACUUM (FULL) log_entries 回收空间
+CREATE OR REPLACE FUNCTION compact_log_entry_messages() RETURNS bigint AS $$
+DECLARE
+    moved bigint;
+BEGIN
+    ALTER TABLE log_entries ADD COLUMN IF NOT EXISTS message_offset integer;
+
+    UPDATE log_entries
+       SET message_offset = char_length(raw_content) - char_length(message),
+           message = NULL
+     WHERE message IS NOT NULL
+       AND right(raw_content, char_length(message)) = message;
+    GET DIAGNOSTICS moved = ROW_COUNT;
+
+    DROP INDEX IF EXISTS idx_log_entries_search;
+    CREATE INDEX idx_log_entries_search ON log_entries USING gin(to_tsvector('english', raw_content)) WITH (fastupdate = on);
+
+    RETURN moved;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 将 log_entries 转为按 log_file_id 的 LIST 分区表（每个文件一个分区，由应用在解析时创建，删除文件即 DROP 分区）。
+-- 原表整体挂为 DEFAULT 分区，旧数据无需搬迁；表不存在或已是分区表时直接返回。
+-- 应用建表后执行一次：SELECT partition_log_entries();
+CREATE OR REPLACE FUNCTION partition_log_entries() RETURNS void AS $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('log_entries')) IS DISTINCT FROM 'r' THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE log_entries RENAME TO log_entries_default;
+    ALTER TABLE log_entries_default RENAME CONSTRAINT log_entries_pkey TO log_entries_default_pkey;
+    ALTER INDEX IF EXISTS ix_log_entries_id RENAME TO ix_log_entries_default_id;
+    DROP INDEX IF EXISTS idx_log_entries_search;
+    DROP INDEX IF EXISTS idx_log_entries_timestamp;
+    DROP INDEX IF EXISTS idx_log_entries_problem;
+    DROP INDEX IF EXISTS idx_log_entries_file_line;
+    DROP INDEX IF EXISTS idx_log_entries_file_time;
+    DROP INDEX IF EXISTS idx_log_entries_file_problem;
+
+    -- 分区表的主键必须包含分区键
+    CREATE TABLE log_entries (
+        LIKE log_entries_default INCLUDING DEFAULTS,
+        PRIMARY KEY (log_file_id, id),
+        FOREIGN KEY (log_file_id) REFERENCES log_files (id) ON DELETE CASCADE
+    ) PARTITION BY LIST (log_file_id);
+    ALTER SEQUENCE log_entries_id_seq OWNED BY log_entries.id;
+    CREATE INDEX ix_log_entries_id ON log_entries (id);
+    PERFORM create_indexes_if_not_exists();
+
+    -- 约束旧数据的文件ID范围：新建文件分区时无需扫描 DEFAULT 分区
+    EXECUTE format('ALTER TABLE log_entries_default ADD CONSTRAINT log_entries_default_legacy CHECK (log_file_id <= %s)',
+                   COALESCE((SELECT max(id) FROM log_files), 0));
+    ALTER TABLE log_entries ATTACH PARTITION log_entries_default DEFAULT;
+END;
+$$ LANGUAGE plpgsql;
+
+-- DEFAULT 分区为空时（旧数据已随重新解析搬入文件分区或已删除）将其脱离并删除，返回是否删除。
+-- 有 DEFAULT 分区时 PostgreSQL 不允许 DETACH PARTITION ... CONCURRENTLY，删除文件只能短暂锁住整个父表
+CREATE OR REPLACE FUNCTION drop_empty_default_log_partition() RETURNS boolean AS $$
+DECLARE
+    def regclass;
+    has_rows boolean;
+BEGIN
+    SELECT NULLIF(partdefid, 0)::regclass INTO def
+      FROM pg_partitioned_table WHERE partrelid = to_regclass('log_entries');
+    IF def IS NULL THEN
+        RETURN false;
+    END IF;
+    EXECUTE format('SELECT EXISTS (SELECT 1 FROM %s)', def) INTO has_rows;
+    IF has_rows THEN
+        RETURN false;
+    END IF;
+    EXECUTE format('ALTER TABLE log_entries DETACH PARTITION %s', def);
+    EXECUTE format('DROP TABLE %s', def);
+    RETURN true;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -106,7 +106,7 @@ export default function DashboardPage() {
 
 	const fetchAnalysisResults = async () => { 
 		try { 
-			const r = await authedFetch(`${apiBase}/api/analysis/results`)
+			const r = await authedFetch(`${apiBase}/api/analysis/results?fields=summary`)
 			if (r.ok) { 
 				const d = await r.json()
 				setAnalysisResults(d.results || []) 
@@ -147,11 +147,11 @@ export default function LogsPage() {
 
 	const openFilePreview = async (fileId: number, filename: string) => {
 		try { 
-			const r = await authedFetch(`${apiBase}/api/logs/${fileId}`)
+			const r = await authedFetch(`${apiBase}/api/logs/${fileId}/raw`)
 			if (r.ok) { 
-				const d = await r.json()
+				const text = await r.text()
 				setPreviewTitle(filename)
-				setPreviewContent(d.content || '')
+				setPreviewContent(text || '')
 				setPreviewMode('shell')
 				setPreviewVisible(true)
 			} 
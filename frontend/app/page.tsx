@@ -315,7 +315,7 @@ export default function Home() {
 	const fetchRuleFolders = async () => { try { const r = await authedFetch(`${getApiBase()}/api/rule-folders`); if (r.ok) { const d = await r.json(); const folders = (d.folders || []).sort((a:any,b:any)=> (b.id||0) - (a.id||0)); setRuleFolders(folders); if (folders && folders.length && selectedFolderId === null) setSelectedFolderId(folders[0].id) } } catch {} }
 	const fetchUsers = async () => { try { const r = await authedFetch(`${getApiBase()}/api/users`); if (r.ok) { const d = await r.json(); setUsers(d.users || []) } } catch {} }
 	const fetchMe = async () => { try { const r = await authedFetch(`${getApiBase()}/api/auth/me`); if (r.ok) { const d = await r.json(); setCurrentUser(d.user) } } catch {} }
-	const fetchAnalysisResults = async () => { try { const r = await authedFetch(`${getApiBase()}/api/analysis/results`); if (r.ok) { const d = await r.json(); setAnalysisResults(d.results || []) } } catch {} }
+	const fetchAnalysisResults = async () => { try { const r = await authedFetch(`${getApiBase()}/api/analysis/results?fields=summary`); if (r.ok) { const d = await r.json(); setAnalysisResults(d.results || []) } } catch {} }
 
 	useEffect(() => {
 		const base = computeApiBase(); setApiBase(base)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+分析结果列表接口测试：游标分页、摘要投影、规则/严重级别/时间过滤
+"""
+
+import sys
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend', 'app'))
+
+# 持久化目录指向临时目录（须在导入 main 之前设置）：测试不读写仓库的 database/ 目录。
+# pytest 下根目录 conftest.py 已统一设置；直接运行本文件时在这里设置
+if "main" not in sys.modules:
+    os.environ["LOG_ANALYZER_DATA"] = tempfile.mkdtemp(prefix="loganalyzer-data-")
+
+from fastapi.testclient import TestClient
+import main
+
+
+def _client():
+    token = "test-results-token"
+    main.sessions[token] = {"user_id": 1, "expiry": datetime.utcnow() + timedelta(hours=1)}
+    client = TestClient(main.app)
+    client.headers.update({"Authorization": f"Bearer {token}"})
+    return client
+
+
+def _fake_results():
+    out = []
+    for i in range(1, 6):
+        out.append({
+            "file_id": i,
+            "filename": f"f{i}.log",
+            "analysis_time": f"2024-01-0{i}T00:00:00",
+            "issues": [
+                {"rule_name": "OOM Killer", "line_number": 3, "matched_text": "oom", "context": "x" * 100, "severity": "high"},
+                {"rule_name": "Network Error", "line_number": 7, "matched_text": "refused", "context": "y" * 100, "severity": "medium" if i % 2 else "high"},
+            ],
+            "summary": {"total_issues": 2},
+            "owner_id": 1,
+        })
+    return out
+
+
+def test_results_pagination_and_projection():
+    """游标分页应覆盖所有结果且不重复；summary 不包含上下文"""
+    old = main.analysis_results
+    main.analysis_results = _fake_results()
+    try:
+        client = _client()
+        seen = []
+        cursor = None
+        while True:
+            params = {"limit": 2, "fields": "summary"}
+            if cursor:
+                params["cursor"] = cursor
+            d = client.get("/api/analysis/results", params=params).json()
+            for r in d["results"]:
+                assert all("context" not in i and "matched_text" not in i for i in r["issues"])
+            seen.extend(r["file_id"] for r in d["results"])
+            cursor = d["next_cursor"]
+            if not cursor:
+                break
+        assert seen == [1, 2, 3, 4, 5]
+
+        d = client.get("/api/analysis/results", params={"order": "desc", "limit": 2}).json()
+        assert [r["file_id"] for r in d["results"]] == [5, 4]
+        assert "context" in d["results"][0]["issues"][0]
+    finally:
+        main.analysis_results = old
+
+
+def test_results_filters():
+    """按规则、严重级别、时间过滤"""
+    old = main.analysis_results
+    main.analysis_results = _fake_results()
+    try:
+        client = _client()
+        d = client.get("/api/analysis/results", params={"rule": "Network Error", "severity": "high"}).json()
+        assert [r["file_id"] for r in d["results"]] == [2, 4]
+        assert all(len(r["issues"]) == 1 for r in d["results"])
+
+        d = client.get("/api/analysis/results", params={"since": "2024-01-03", "until": "2024-01-04T23:59:59"}).json()
+        assert [r["file_id"] for r in d["results"]] == [3, 4]
+        assert d["next_cursor"] is None
+    finally:
+        main.analysis_results = old
+
+
+if __name__ == "__main__":
+    test_results_pagination_and_projection()
+    test_results_filters()
+    print("✅ 分析结果接口测试通过")
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+日志文件接口测试：流式上传、按行对齐的预览、原始内容下载（Range）、条件请求与倒排索引搜索
+"""
+
+import sys
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend', 'app'))
+
+# 持久化目录指向临时目录（须在导入 main 之前设置）：测试不读写仓库的 database/ 目录。
+# pytest 下根目录 conftest.py 已统一设置；直接运行本文件时在这里设置
+if "main" not in sys.modules:
+    os.environ["LOG_ANALYZER_DATA"] = tempfile.mkdtemp(prefix="loganalyzer-data-")
+
+import asyncio
+import json
+from fastapi.testclient import TestClient
+import main
+
+# 真实的索引写入函数（_with_isolated_store 会替换为空操作）
+_SAVE_INDEX, _SAVE_ANALYSIS_INDEX = main.save_index, main.save_analysis_index
+
+
+SAMPLE = "".join(f"第{i}行 kernel: line {i}\n" for i in range(1, 201)).encode("utf-8")
+
+
+def _client():
+    token = "test-files-token"
+    main.sessions[token] = {"user_id": 1, "expiry": datetime.utcnow() + timedelta(hours=1)}
+    client = TestClient(main.app)
+    client.headers.update({"Authorization": f"Bearer {token}"})
+    return client
+
+
+def _upload(client, tmp_dir):
+    main.FILES_DIR = tmp_dir
+    r = client.post("/api/logs/upload", files={"file": ("sample.log", SAMPLE)})
+    assert r.status_code == 200
+    d = r.json()
+    assert d["size"] == len(SAMPLE) and d["lines"] == 200
+    return d["file_id"]
+
+
+class _InlineExecutor:
+    """测试中同步执行后台任务，便于断言"""
+    def submit(self, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+
+def _with_isolated_store(fn):
+    def wrapper():
+        old = (main.uploaded_files, main.FILES_DIR, main.save_index, main.EXECUTOR, main.SEARCH_INDEX_PATH, main.SKIP_INDEX_DIR,
+               main.ROLLUP_DB_PATH, main.analysis_results, main.save_analysis_index, main.save_analysis_runs)
+        main.uploaded_files = []
+        main.save_index = lambda *a: None
+        main.EXECUTOR = _InlineExecutor()
+        main.analysis_results = []
+        main.save_analysis_index = main.save_analysis_runs = lambda *a: None
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                main.SEARCH_INDEX_PATH = os.path.join(tmp_dir, "search_index.sqlite3")
+                main.SKIP_INDEX_DIR = os.path.join(tmp_dir, "skip_index")
+                main.ROLLUP_DB_PATH = os.path.join(tmp_dir, "rollups.sqlite3")
+                try:
+                    fn(_client(), tmp_dir)
+                finally:
+                    for p in list(main._MMAP_CACHE):
+                        main.evict_mapped(p)
+        finally:
+            (main.uploaded_files, main.FILES_DIR, main.save_index, main.EXECUTOR,
+             main.SEARCH_INDEX_PATH, main.SKIP_INDEX_DIR,
+             main.ROLLUP_DB_PATH, main.analysis_results, main.save_analysis_index, main.save_analysis_runs) = old
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+
+
+@_with_isolated_store
+def test_upload_size_limit(client, tmp_dir):
+    """超限上传在解析请求体前即被拒绝（声明长度与 chunked 两种情况），不会落盘"""
+    main.FILES_DIR = tmp_dir
+    old = main.MAX_CONTENT_BYTES
+    main.MAX_CONTENT_BYTES = 1024
+    try:
+        big = b"x" * (main.MAX_CONTENT_BYTES + main.UPLOAD_FORM_OVERHEAD + 1)
+        r = client.post("/api/logs/upload", files={"file": ("big.log", big)})
+        assert r.status_code == 413
+
+        def chunked():
+            yield b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.log\"\r\n\r\n"
+            for _ in range(100):
+                yield b"x" * 1024
+        r = client.post("/api/logs/upload", content=chunked(),
+                        headers={"Content-Type": "multipart/form-data; boundary=b"})
+        assert r.status_code == 413
+
+        # 小于表单开销余量但超过文件上限的内容由处理函数按实际文件大小拒绝
+        assert client.post("/api/logs/upload", files={"file": ("a.log", b"x" * 2048)}).status_code == 400
+    finally:
+        main.MAX_CONTENT_BYTES = old
+    assert main.uploaded_files == [] and os.listdir(tmp_dir) == []
+
+
+@_with_isolated_store
+def test_upload_keeps_raw_bytes(client, tmp_dir):
+    """上传按原始字节保存：下载返回原文件，预览与分析读取时丢弃非法 UTF-8 字节"""
+    main.FILES_DIR = tmp_dir
+    data = "第1行 ok\n".encode("utf-8") + b"bad \xff\xfe byte\n"
+    fid = client.post("/api/logs/upload", files={"file": ("raw.log", data)}).json()["file_id"]
+    assert client.get(f"/api/logs/{fid}/raw").content == data
+    assert client.get(f"/api/logs/{fid}/preview").json()["chunk"] == "第1行 ok\nbad  byte\n"
+
+
+@_with_isolated_store
+def test_preview_line_aligned(client, tmp_dir):
+    """按字节与按行预览都应落在行边界上，且不切断多字节字符"""
+    fid = _upload(client, tmp_dir)
+    d = client.get(f"/api/logs/{fid}/preview", params={"offset": 3, "size": 100}).json()
+    assert d["chunk"].startswith("第2行") and d["chunk"].endswith("\n")
+    assert SAMPLE[d["offset"]:d["next_offset"]].decode("utf-8") == d["chunk"]
+
+    d = client.get(f"/api/logs/{fid}/preview", params={"start_line": 150, "line_count": 2}).json()
+    assert d["chunk"] == "第150行 kernel: line 150\n第151行 kernel: line 151\n"
+    assert d["next_line"] == 152
+
+
+@_with_isolated_store
+def test_preview_conditional_request(client, tmp_dir):
+    """携带 If-None-Match 的重复请求返回 304"""
+    fid = _upload(client, tmp_dir)
+    r = client.get(f"/api/logs/{fid}/preview")
+    assert r.status_code == 200 and r.headers.get("etag")
+    r2 = client.get(f"/api/logs/{fid}/preview", headers={"If-None-Match": r.headers["etag"]})
+    assert r2.status_code == 304
+
+
+@_with_isolated_store
+def test_raw_download_range(client, tmp_dir):
+    """元数据接口不再返回正文；原始内容支持整文件与 Range 请求"""
+    fid = _upload(client, tmp_dir)
+    meta = client.get(f"/api/logs/{fid}").json()
+    assert "content" not in meta and meta["raw_url"] == f"/api/logs/{fid}/raw"
+
+    r = client.get(f"/api/logs/{fid}/raw")
+    assert r.status_code == 200 and r.content == SAMPLE
+    assert r.headers["accept-ranges"] == "bytes"
+
+    r = client.get(f"/api/logs/{fid}/raw", headers={"Range": "bytes=10-29"})
+    assert r.status_code == 206 and r.content == SAMPLE[10:30]
+    assert r.headers["content-range"] == f"bytes 10-29/{len(SAMPLE)}"
+
+    r = client.get(f"/api/logs/{fid}/raw", headers={"Range": f"bytes={len(SAMPLE)}-"})
+    assert r.status_code == 416
+
+
+@_with_isolated_store
+def test_search_index(client, tmp_dir):
+    """倒排索引搜索：AND/NOT/短语，以及删除后不再命中"""
+    fid = _upload(client, tmp_dir)
+    d = client.get("/api/search", params={"q": '"line 12" | "line 150"'}).json()
+    assert d["files"][0]["lines"] == [12, 150]
+    assert d["files"][0]["matches"][0]["text"] == "第12行 kernel: line 12"
+
+    d = client.get("/api/search", params={"q": 'kernel & !"line 1"', "limit": 5}).json()
+    assert d["total_matches"] == 199 and d["truncated"] and len(d["files"][0]["lines"]) == 5
+
+    assert client.delete(f"/api/logs/{fid}").status_code == 200
+    assert client.get("/api/search", params={"q": "kernel"}).json()["files"] == []
+
+
+@_with_isolated_store
+def test_search_noise_phrase(client, tmp_dir):
+    """只含噪声词元的短语无法由倒排表裁剪：候选较多时顺序扫描文件校验，且不占用 mmap 锁"""
+    import threading
+    main.FILES_DIR = tmp_dir
+    data = "".join(f"req {i} addr {'0x1234' if i % 100 == 7 else hex(i)}\n" for i in range(1, 1001)).encode("utf-8")
+    fid = client.post("/api/logs/upload", files={"file": ("n.log", data)}).json()["file_id"]
+    files = {f["id"]: f for f in main.uploaded_files}
+
+    out = {}
+    with main._MMAP_LOCK:
+        t = threading.Thread(target=lambda: out.update(main.run_search('"0x1234"', files, 100, False)))
+        t.start()
+        t.join(10)
+        assert not t.is_alive()
+    assert out["files"][0]["lines"] == list(range(7, 1001, 100))
+
+    d = client.get("/api/search", params={"q": '"0x1234" & !"req 507"'}).json()
+    assert d["total_matches"] == 9 and d["files"][0]["matches"][0]["text"] == "req 7 addr 0x1234"
+
+
+@_with_isolated_store
+def test_skip_index_rule_matches(client, tmp_dir):
+    """块级跳过索引：命中结果与全量扫描一致，不可能命中的块被跳过"""
+    fid = _upload(client, tmp_dir)
+    info = next(f for f in main.uploaded_files if f["id"] == fid)
+    skip = main.load_skip_index(info)
+    assert skip and skip["newlines"] == 200
+
+    content = SAMPLE.decode("utf-8")
+    pre = main._precompute_content(content)
+    rules = [{"id": 9001, "name": "t1", "dsl": '"line 42" | "line 199"'},
+             {"id": 9002, "name": "t2", "dsl": '"no such text"'}]
+    for rule in rules:
+        full = [(m.start(), m.group()) for m in main.evaluate_rule_matches(content, rule, pre)]
+        fast = [(m.start(), m.group()) for m in main.evaluate_rule_matches(content, rule, dict(pre, skip=skip))]
+        assert full == fast
+    assert main._candidate_line_spans(skip, lambda b: main._bloom_maybe(b, main._phrase_trigrams("no such text")), 200) == []
+
+
+@_with_isolated_store
+def test_skip_index_unicode_case_folding(client, tmp_dir):
+    """跳过索引与匹配使用同一份解码、小写后的文本：非 ASCII 大小写折叠与被丢弃的非法字节不会导致漏报"""
+    main.FILES_DIR = tmp_dir
+    old = main.SKIP_BLOCK_BYTES
+    main.SKIP_BLOCK_BYTES = 256
+    try:
+        filler = b"".join(b"filler line %d\n" % i for i in range(60))
+        data = (filler + "\u212aERNEL panic\n".encode("utf-8") + filler + b"disk fa\xffilure\n"
+                + filler + "\u017fegfault at 0\n".encode("utf-8") + filler)
+        fid = client.post("/api/logs/upload", files={"file": ("u.log", data)}).json()["file_id"]
+    finally:
+        main.SKIP_BLOCK_BYTES = old
+    skip = main.load_skip_index(next(f for f in main.uploaded_files if f["id"] == fid))
+    assert skip and len(skip["blooms"]) > 4
+
+    content = data.decode("utf-8", errors="ignore")
+    pre = main._precompute_content(content)
+    rules = [{"id": 9101, "name": "u1", "dsl": '"kernel panic"'},
+             {"id": 9102, "name": "u2", "dsl": '"disk failure"'},
+             {"id": 9103, "name": "u3", "patterns": ["segfault"], "is_regex": False}]
+    for rule in rules:
+        full = [m.group() for m in main.evaluate_rule_matches(content, rule, pre)]
+        fast = [m.group() for m in main.evaluate_rule_matches(content, rule, dict(pre, skip=skip))]
+        assert len(full) == 1 and full == fast
+
+
+@_with_isolated_store
+def test_grep_stream(client, tmp_dir):
+    """正则检索：多块扫描行号连续正确，达到上限时标记截断"""
+    import json
+    fid = _upload(client, tmp_dir)
+    old = (main.GREP_CHUNK_BYTES, main.GREP_WORKERS)
+    main.GREP_CHUNK_BYTES, main.GREP_WORKERS = 256, 1
+    try:
+        r = client.get(f"/api/logs/{fid}/grep", params={"pattern": r"line 1\d?$"})
+        assert r.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(x) for x in r.text.splitlines()]
+        assert [x["line"] for x in rows[:-1]] == [1] + list(range(10, 20))
+        assert rows[0]["text"] == "第1行 kernel: line 1"
+        assert rows[-1]["done"] and not rows[-1]["truncated"] and rows[-1]["scanned_bytes"] == len(SAMPLE)
+
+        rows = [json.loads(x) for x in client.get(f"/api/logs/{fid}/grep", params={"pattern": "KERNEL", "ignore_case": True, "max_hits": 3}).text.splitlines()]
+        assert [x["line"] for x in rows[:-1]] == [1, 2, 3]
+        assert rows[-1]["truncated"] and rows[-1]["reason"] == "max_hits"
+    finally:
+        main.GREP_CHUNK_BYTES, main.GREP_WORKERS = old
+    assert client.get(f"/api/logs/{fid}/grep", params={"pattern": "("}).status_code == 400
+
+
+@_with_isolated_store
+def test_grep_catastrophic_pattern_timeout(client, tmp_dir):
+    """灾难性回溯的正则在 timeout_ms 内返回 timeout，超时的工作进程被终止，之后的检索不受影响"""
+    import json
+    main.FILES_DIR = tmp_dir
+    data = b"a" * 40 + b"!\n" + b"b" * 40 + b"\n"
+    fid = client.post("/api/logs/upload", files={"file": ("slow.log", data)}).json()["file_id"]
+    client.get(f"/api/logs/{fid}/grep", params={"pattern": "b"})  # 预热工作进程
+
+    t = time.perf_counter()
+    r = client.get(f"/api/logs/{fid}/grep", params={"pattern": "(a+)+$", "timeout_ms": 200})
+    took = time.perf_counter() - t
+    rows = [json.loads(x) for x in r.text.splitlines()]
+    assert rows[-1]["reason"] == "timeout" and rows[-1]["truncated"]
+    assert took < 1.5
+
+    rows = [json.loads(x) for x in client.get(f"/api/logs/{fid}/grep", params={"pattern": "^b+$"}).text.splitlines()]
+    assert [x["line"] for x in rows[:-1]] == [2] and rows[-1]["reason"] is None
+
+
+@_with_isolated_store
+def test_minute_histogram(client, tmp_dir):
+    """分析后按分钟汇总各级别、各问题类型的行数（一行命中多条规则只计一次）；直方图按桶合并，删除文件后汇总一并清除"""
+    main.FILES_DIR = tmp_dir
+    log = ("2024-03-01 10:00:01 INFO start\n"
+           "2024-03-01 10:00:30 ERROR Out of memory: OOM killer, disk full\n"
+           "    at frame 1\n"
+           "2024-03-01 10:01:05 error disk full\n"
+           "2024-03-01 10:07:00 WARN slow\n").encode("utf-8")
+    fid = client.post("/api/logs/upload", files={"file": ("m.log", log)}).json()["file_id"]
+    assert client.post(f"/api/logs/{fid}/analyze").status_code == 202
+
+    d = client.get("/api/analysis/histogram").json()
+    assert [b["time"] for b in d["buckets"]] == ["2024-03-01T10:00", "2024-03-01T10:01", "2024-03-01T10:07"]
+    assert d["buckets"][0]["counts"] == {"info": 1, "error": 1, "unknown": 1}
+
+    d = client.get("/api/analysis/histogram", params={"dim": "problem_type", "bucket_minutes": 5}).json()
+    assert d["buckets"] == [{"time": "2024-03-01T10:00", "counts": {"OOM Killer": 1, "Disk Space Error": 1}, "total": 2}]
+    assert client.get("/api/analysis/histogram", params={"dim": "rule"}).status_code == 400
+
+    d = client.get("/api/analysis/histogram", params={"key": "error", "since": "2024-03-01T10:01", "file_id": fid}).json()
+    assert [(b["time"], b["total"]) for b in d["buckets"]] == [("2024-03-01T10:01", 1)]
+
+    assert client.delete(f"/api/logs/{fid}").status_code == 200
+    assert client.get("/api/analysis/histogram").json()["buckets"] == []
+
+
+class _DeferredExecutor:
+    """收集后台任务，由测试决定何时执行"""
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.tasks.append((fn, args, kwargs))
+
+    def run(self):
+        for fn, args, kwargs in self.tasks:
+            fn(*args, **kwargs)
+
+
+@_with_isolated_store
+def test_rollups_survive_file_id_reuse(client, tmp_dir):
+    """删除文件后 ID 被新上传复用：删除时的后台任务晚于新文件分析执行，也不会清掉新文件的分钟汇总"""
+    main.FILES_DIR = tmp_dir
+    old = b"2024-03-01 10:00:01 ERROR Out of memory: kill\n"
+    new = b"2024-03-02 11:00:01 ERROR disk full\n"
+    fid = client.post("/api/logs/upload", files={"file": ("a.log", old)}).json()["file_id"]
+    assert client.post(f"/api/logs/{fid}/analyze").status_code == 202
+
+    inline, deferred = main.EXECUTOR, _DeferredExecutor()
+    main.EXECUTOR = deferred
+    try:
+        assert client.delete(f"/api/logs/{fid}").status_code == 200
+    finally:
+        main.EXECUTOR = inline
+    assert client.get("/api/analysis/histogram").json()["buckets"] == []
+
+    reused = client.post("/api/logs/upload", files={"file": ("b.log", new)}).json()["file_id"]
+    assert reused == fid
+    assert client.post(f"/api/logs/{reused}/analyze").status_code == 202
+    deferred.run()
+    d = client.get("/api/analysis/histogram", params={"file_id": reused}).json()
+    assert [(b["time"], b["total"]) for b in d["buckets"]] == [("2024-03-02T11:00", 1)]
+
+
+@_with_isolated_store
+def test_retention_purge_saves_snapshot(client, tmp_dir):
+    """保留期清理在后台线程只序列化事件循环上取的快照；清理期间上传并写入的索引不会被较旧的快照覆盖"""
+    main.FILES_DIR = tmp_dir
+    old = (main.INDEX_PATH, main.ANALYSIS_INDEX_PATH, main.RETENTION_DAYS, main._remove_files_and_save)
+    main.INDEX_PATH = os.path.join(tmp_dir, "uploaded_files.json")
+    main.ANALYSIS_INDEX_PATH = os.path.join(tmp_dir, "analysis_results.json")
+    main.save_index, main.save_analysis_index = _SAVE_INDEX, _SAVE_ANALYSIS_INDEX
+    main.RETENTION_DAYS = 30
+    try:
+        fid = client.post("/api/logs/upload", files={"file": ("old.log", SAMPLE)}).json()["file_id"]
+        main.uploaded_files[0]["upload_time"] = (datetime.now() - timedelta(days=31)).isoformat()
+        main.rebuild_retention_heap()
+
+        snapshots = []
+        def remove_after_upload(removed, snapshot):
+            # 后台线程开始写之前，事件循环上又有一次上传修改并保存了索引
+            snapshots.append(snapshot)
+            main.uploaded_files.append({"id": fid + 1, "filename": "new.log", "upload_time": datetime.now().isoformat()})
+            main.save_index()
+            old[3](removed, snapshot)
+        main._remove_files_and_save = remove_after_upload
+        assert asyncio.run(main.purge_old_uploads()) == 1
+
+        assert snapshots[0][1] == [] and snapshots[0][1] is not main.uploaded_files
+        with open(main.INDEX_PATH, encoding="utf-8") as f:
+            assert [x["id"] for x in json.load(f)] == [fid + 1]
+        with open(main.ANALYSIS_INDEX_PATH, encoding="utf-8") as f:
+            assert json.load(f) == []
+    finally:
+        main.INDEX_PATH, main.ANALYSIS_INDEX_PATH, main.RETENTION_DAYS, main._remove_files_and_save = old
+
+
+def test_retention_days():
+    """保留天数与 config.LOG_RETENTION_DAYS 为同一配置；为 0 时不登记过期，上传的文件不会被后台清理"""
+    import config
+    assert main.RETENTION_DAYS == config.LOG_RETENTION_DAYS
+    old = main.RETENTION_DAYS
+    try:
+        main.RETENTION_DAYS = 0
+        assert main._retention_expiry("2000-01-01T00:00:00") == float("inf")
+        main.RETENTION_DAYS = 30
+        assert main._retention_expiry("2000-01-01T00:00:00") == datetime(2000, 1, 31).timestamp()
+    finally:
+        main.RETENTION_DAYS = old
+
+
+if __name__ == "__main__":
+    test_upload_size_limit()
+    test_upload_keeps_raw_bytes()
+    test_preview_line_aligned()
+    test_preview_conditional_request()
+    test_raw_download_range()
+    test_search_index()
+    test_search_noise_phrase()
+    test_skip_index_rule_matches()
+    test_skip_index_unicode_case_folding()
+    test_grep_stream()
+    test_grep_catastrophic_pattern_timeout()
+    test_minute_histogram()
+    test_rollups_survive_file_id_reuse()
+    test_retention_purge_saves_snapshot()
+    test_retention_days()
+    print("✅ 日志文件接口测试通过")
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+日志解析服务测试：时间戳解码缓存、按文件格式识别、JSON 行解析、读取/解析/写入流水线
+"""
+
+import sys
+import os
+import tempfile
+from datetime import datetime, timezone
+
+sys.path.append(os.path.dirname(__file__))
+
+# 使用临时 SQLite 库：pytest 下由根目录 conftest.py 在收集前统一设置；直接运行本文件时在这里设置
+# （须在首次导入 backend.app.database 之前）
+if "backend.app.database" not in sys.modules:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "log_parser_test.sqlite3")
+
+from backend.app.services import log_parser
+from backend.app.services.log_parser import LogParserService, _decode_timestamp
+
+
+def _service(**kwargs) -> LogParserService:
+    return LogParserService(None, lambda *a: None, **kwargs)
+
+
+def test_timestamp_cache_per_format():
+    """缓存按 (原串, 格式) 区分：同一字符串在不同格式下各自解码，结果与 strptime 一致，无效时间每次都报错"""
+    _decode_timestamp.cache_clear()
+    cases = [
+        ("Jan  2 03:04:05", "%b %d %H:%M:%S"),
+        ("2024-01-02 03:04:05", "%Y-%m-%d %H:%M:%S"),
+        ("01/02/2024 03:04:05", "%m/%d/%Y %H:%M:%S"),
+        ("01/02/2024 03:04:05", "%d/%m/%Y %H:%M:%S"),  # 无专用解码器，回退 strptime
+    ]
+    for _ in range(2):
+        for ts, fmt in cases:
+            assert _decode_timestamp(ts, fmt) == datetime.strptime(ts, fmt)
+    assert _decode_timestamp("01/02/2024 03:04:05", "%m/%d/%Y %H:%M:%S").month == 1
+    assert _decode_timestamp("01/02/2024 03:04:05", "%d/%m/%Y %H:%M:%S").month == 2
+    assert _decode_timestamp.cache_info().hits >= len(cases)
+
+    assert _decode_timestamp("2024-01-02T03:04:05Z", "iso8601") == datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    for _ in range(2):
+        for ts, fmt in (("Foo  2 03:04:05", "%b %d %H:%M:%S"), ("2024-13-02 03:04:05", "%Y-%m-%d %H:%M:%S"),
+                        ("not a time", "iso8601")):
+            try:
+                _decode_timestamp(ts, fmt)
+                assert False, ts
+            except ValueError:
+                pass
+
+
+def _write(tmp_dir: str, name: str, lines) -> str:
+    path = os.path.join(tmp_dir, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def test_detect_format():
+    """按前若干行识别格式：各格式的样本、kern.log、低于比例阈值时回退 generic"""
+    from backend.app.models.log import LogType
+    svc = _service()
+    samples = {
+        "rfc3164": ([f"Jan 12 10:00:{i:02d} host sshd[{i}]: session opened" for i in range(20)], LogType.SYSLOG),
+        "kern": ([f"<6>Jan 12 10:00:{i:02d} host kernel: [ {i}.5] usb 1-1: new device" for i in range(20)], LogType.KERNLOG),
+        "rfc5424": ([f'<34>1 2024-01-12T10:00:{i:02d}.003Z host app 12 ID47 [ex@1 a="b"] started' for i in range(20)],
+                    LogType.SYSLOG),
+        "dmesg": ([f"[ {i}.000123] eth0: link up" for i in range(20)], LogType.KERNLOG),
+        "json": ([f'{{"ts": "2024-01-12T10:00:{i:02d}", "level": "info", "msg": "ok {i}"}}' for i in range(20)],
+                 LogType.CUSTOM),
+        "generic": (["plain text"] * 12 + [f"[ {i}.0] eth0" for i in range(8)], None),
+    }
+    expected_format = {"kern": "rfc3164"}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, (lines, log_type) in samples.items():
+            path = _write(tmp_dir, f"{name}.log", [""] + lines)
+            assert svc._detect_format(path) == (expected_format.get(name, name), log_type), name
+        assert svc._detect_format(_write(tmp_dir, "empty.log", [""])) == ("generic", None)
+
+
+def test_format_line_parsers():
+    """各格式专用解析函数取出的时间、来源、消息与结构化字段"""
+    svc = _service()
+    f = svc._parse_rfc3164("<13>Jan  2 10:00:01 web01 kernel: [ 12.50] Out of memory")
+    assert (f["timestamp"], f["source"], f["message"]) == (datetime(1900, 1, 2, 10, 0, 1), "kernel", "Out of memory")
+    assert f["parsed_content"] == {"host": "web01", "uptime": 12.5}
+    assert svc._parse_rfc3164("Foo  2 10:00:01 web01 kernel: x") is None
+
+    f = svc._parse_rfc5424('<34>1 2024-01-12T10:00:01Z host app - - [ex@1 a="x\\]y"][b@2] hello')
+    assert f["timestamp"] == datetime(2024, 1, 12, 10, 0, 1, tzinfo=timezone.utc)
+    assert (f["source"], f["message"]) == ("app", "hello")
+    assert f["parsed_content"] == {"host": "host", "structured_data": '[ex@1 a="x\\]y"][b@2]'}
+    assert svc._parse_rfc5424("<34>1 garbage") is None
+
+    f = svc._parse_dmesg("[  3.141592] EXT4-fs error")
+    assert f == {"timestamp": None, "source": "kernel", "message": "EXT4-fs error", "parsed_content": {"uptime": 3.141592}}
+    assert svc._parse_dmesg("no stamp") is None
+
+    f = svc._tokenize_line("2024-01-02 03:04:05.123 app[7]: started")
+    assert (f["timestamp"], f["source"], f["message"], f["parsed_content"]) == (
+        datetime(2024, 1, 2, 3, 4, 5), "app", "started", {"pid": 7})
+    assert svc._tokenize_line("-- no layout --") is None
+
+
+def test_json_lines():
+    """JSON 行：映射字段、对象只以原文存储一次；格式错误或非对象的行按普通文本处理；json_path 规则复用同一次解析"""
+    from backend.app.models.log import LogLevel
+    from backend.app.services.log_parser import _CompiledRuleset
+    svc = _service()
+    rules = _CompiledRuleset(svc.builtin_rules + [
+        {"name": "trace", "pattern": "error.stack", "rule_type": "json_path", "problem_type": "异常堆栈",
+         "problem_description": "", "priority": 1},
+    ])
+    parse = lambda line: svc._parse_log_line(1, 1, line, rules, svc._parse_json_line)
+
+    line = '{"@timestamp": "2024-01-12T10:00:01+08:00", "level": "ERROR", "logger": "api", "msg": "bad request", "error": {"stack": "x"}}'
+    row = parse(line)
+    assert row["raw_content"] == line and row["parsed_content"] is None
+    assert (row["log_level"], row["source"], row["message"], row["message_offset"]) == (LogLevel.ERROR, "api", "bad request", None)
+    assert row["timestamp"].isoformat() == "2024-01-12T10:00:01+08:00"
+    assert row["problem_type"] == "异常堆栈" and "json_object" not in row
+
+    # 没有消息字段时消息即原文，只记录偏移
+    row = parse('{"level": "info", "n": 1}')
+    assert (row["message"], row["message_offset"], row["problem_detected"]) == (None, 0, False)
+
+    for line in ('{"level": "error", "msg": ', '["error", 1]', '"error"', "{not json}"):
+        assert svc._parse_json_line(line) is None
+        row = parse(line)
+        assert row["parsed_content"] is None and row["raw_content"] == line and not row["problem_detected"]
+    assert parse('{"a": ')["log_level"] is None and parse('["error"]')["log_level"] == LogLevel.ERROR
+
+
+def _db_session():
+    from backend.app.database import Base, engine, SessionLocal
+    from backend.app import models  # noqa: F401  注册全部表
+    assert engine.dialect.name == "sqlite", f"测试应使用临时 SQLite 库，实际为 {engine.url}"
+    Base.metadata.create_all(engine)
+    return SessionLocal()
+
+
+def test_ruleset_cache():
+    """编译后的规则集按规则表指纹缓存：规则增加或显式失效后重新编译，新规则立即生效"""
+    from backend.app.models.log import ParseRule, ParseRuleType
+    db = _db_session()
+    try:
+        svc = _service()
+        svc.db = db
+        log_parser.invalidate_rule_cache()
+        first = svc._get_parse_rules()
+        assert svc._get_parse_rules() is first
+        assert first.match("custom-marker 42") is None
+
+        rule = ParseRule(name="marker", rule_type=ParseRuleType.KEYWORD, pattern="custom-marker",
+                         problem_type="自定义", priority=1)
+        db.add(rule)
+        db.commit()
+        second = svc._get_parse_rules()
+        assert second is not first and second.match("custom-marker 42")["problem_type"] == "自定义"
+
+        log_parser.invalidate_rule_cache()
+        assert svc._get_parse_rules() is not second
+        db.delete(rule)
+        db.commit()
+        assert svc._get_parse_rules().match("custom-marker 42") is None
+    finally:
+        log_parser.invalidate_rule_cache()
+        db.close()
+
+
+def _sample_log(tmp_dir: str, n: int = 1000) -> str:
+    lines = []
+    for i in range(1, n + 1):
+        if i % 97 == 0:
+            lines.append(f"2024-01-12 10:{i // 60 % 60:02d}:{i % 60:02d} kernel[1]: Out of memory: kill process {i}")
+        elif i % 41 == 0:
+            lines.append(f"plain line without layout {i}")
+        else:
+            lines.append(f"2024-01-12 10:{i // 60 % 60:02d}:{i % 60:02d} app[{i}]: INFO request {i} done")
+    return _write(tmp_dir, "pipeline.log", lines)
+
+
+def _parse_with_pipeline(db, path: str, storage_mode: str = "full", fail_from: int = 0, log_file=None):
+    """小批次 + 多解析线程，并随机延迟各批次，使批次乱序到达写入端；fail_from 起的批次解析时抛出异常。
+    传入 log_file 时重新解析该文件
+    """
+    import random
+    from backend.app.models.log import LogFile
+    if log_file is None:
+        log_file = LogFile(filename="p", original_filename="p.log", file_path=path, file_size=os.path.getsize(path))
+        db.add(log_file)
+        db.commit()
+    svc = _service(storage_mode=storage_mode, context_lines=2, bulk_load=False)
+    svc.db = db
+    original = svc._parse_chunk
+
+    def delayed(log_file_id, first_line, *args, **kwargs):
+        import time
+        time.sleep(random.random() * 0.01)
+        if fail_from and first_line >= fail_from:
+            raise RuntimeError("parser exploded")
+        return original(log_file_id, first_line, *args, **kwargs)
+    svc._parse_chunk = delayed
+    old = (log_parser.BULK_BATCH_SIZE, log_parser.PIPELINE_PARSE_WORKERS)
+    log_parser.BULK_BATCH_SIZE, log_parser.PIPELINE_PARSE_WORKERS = 37, 4
+    try:
+        return log_file, svc, svc._parse_log_file_sync(log_file)
+    finally:
+        log_parser.BULK_BATCH_SIZE, log_parser.PIPELINE_PARSE_WORKERS = old
+
+
+def test_pipeline_matches_single_threaded():
+    """流水线写入的行（含顺序）、计数与单线程一次解析全部行的结果一致；problems 模式的上下文跨批次边界正确"""
+    from backend.app.models.log import LogEntry
+    db = _db_session()
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = _sample_log(tmp_dir)
+            lines = [line for _, line, _ in LogParserService._iter_lines(path)]
+            for mode, context in (("full", None), ("problems", 2)):
+                log_file, svc, result = _parse_with_pipeline(db, path, mode)
+                rules = svc._get_parse_rules()
+                expected, parsed, errors, summary, _, _ = svc._parse_chunk(
+                    log_file.id, 1, lines, rules, svc._format_parser("generic"), context)
+                stored = db.query(LogEntry).filter(LogEntry.log_file_id == log_file.id).order_by(LogEntry.id).all()
+                assert [(e.line_number, e.raw_content, e.message, e.problem_type) for e in stored] == \
+                    [(r["line_number"], r["raw_content"], r["raw_content"][r["message_offset"]:]
+                      if r["message_offset"] is not None else r["message"], r["problem_type"]) for r in expected]
+                assert (result["total_lines"], result["processed_lines"], result["error_lines"]) == (1000, parsed, errors)
+                assert result["stored_entries"] == len(expected) and result["problems_found"] == sum(summary.values()) == 10
+                assert log_file.is_processed and log_file.storage_mode == mode
+            assert len(expected) == 10 * 5
+    finally:
+        db.close()
+
+
+def test_pipeline_propagates_parser_errors():
+    """解析线程出错时整个解析失败并回滚状态，流水线线程全部退出"""
+    import threading
+    db = _db_session()
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = _sample_log(tmp_dir)
+            try:
+                _parse_with_pipeline(db, path, fail_from=100)
+                assert False, "应抛出异常"
+            except Exception as e:
+                assert "parser exploded" in str(e)
+            from backend.app.models.log import LogFile
+            assert db.query(LogFile).order_by(LogFile.id.desc()).first().is_processed is False
+            assert not any(t.name.startswith("log-") and t.is_alive() for t in threading.enumerate())
+    finally:
+        db.close()
+
+
+def test_reparse_replaces_entries():
+    """重新解析同一文件：旧条目被替换而不是叠加；重新解析失败时回滚，保留上一次的条目"""
+    from backend.app.models.log import LogEntry, LogLineStat
+    db = _db_session()
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = _sample_log(tmp_dir)
+
+            def stored(file_id):
+                return [(e.line_number, e.problem_type) for e in
+                        db.query(LogEntry).filter(LogEntry.log_file_id == file_id).order_by(LogEntry.line_number)]
+
+            log_file, _, _ = _parse_with_pipeline(db, path, "full")
+            assert len(stored(log_file.id)) == 1000
+            _, _, result = _parse_with_pipeline(db, path, "problems", log_file=log_file)
+            problems = stored(log_file.id)
+            assert len(problems) == result["stored_entries"] == 10 * 5
+            assert [n for n, _ in problems] == sorted({n + d for n in range(97, 1001, 97) for d in range(-2, 3)})
+            assert sum(s.line_count for s in db.query(LogLineStat).filter(LogLineStat.log_file_id == log_file.id)) == \
+                result["processed_lines"]
+
+            try:
+                _parse_with_pipeline(db, path, "full", fail_from=500, log_file=log_file)
+                assert False, "应抛出异常"
+            except Exception as e:
+                assert "parser exploded" in str(e)
+            assert stored(log_file.id) == problems
+    finally:
+        db.close()
+
+
+def test_upgrade_schema_adds_missing_columns():
+    """旧库（建表早于新增列）启动时补齐列：已有行取默认值，重复执行不报错、不重复添加"""
+    from sqlalchemy import create_engine, inspect, text
+    from backend.app.database import upgrade_schema
+    from backend.app.models.log import LogFile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_engine("sqlite:///" + os.path.join(tmp_dir, "old.sqlite3"))
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("CREATE TABLE log_files (id INTEGER PRIMARY KEY, filename VARCHAR(255), "
+                                  "original_filename VARCHAR(255), file_path VARCHAR(500), file_size INTEGER)"))
+                conn.execute(text("INSERT INTO log_files VALUES (1, 'a', 'a.log', '/tmp/a.log', 1)"))
+            with engine.begin() as conn:
+                assert "log_files.storage_mode" in upgrade_schema(conn)
+            with engine.begin() as conn:
+                assert upgrade_schema(conn) == []
+            assert "storage_mode" in {c["name"] for c in inspect(engine).get_columns("log_files")}
+            with engine.connect() as conn:
+                assert conn.execute(text("SELECT storage_mode FROM log_files WHERE id = 1")).scalar() == "full"
+                assert conn.execute(LogFile.__table__.select().with_only_columns(LogFile.storage_mode)).scalar() == "full"
+        finally:
+            engine.dispose()
+
+
+def test_message_with_null_offset():
+    """旧库补齐 message_offset 后：旧行（偏移为 NULL）读 message 列，新行按偏移截取，二者皆空时为 NULL；
+    Python 属性与 SQL 表达式结果一致
+    """
+    from sqlalchemy import create_engine, text, select
+    from sqlalchemy.orm import Session
+    from backend.app.database import upgrade_schema
+    from backend.app.models.log import LogEntry
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_engine("sqlite:///" + os.path.join(tmp_dir, "old.sqlite3"))
+        try:
+            with engine.begin() as conn:
+                LogEntry.__table__.create(conn)
+                conn.execute(text("ALTER TABLE log_entries DROP COLUMN message_offset"))
+                conn.execute(text("INSERT INTO log_entries (id, log_file_id, line_number, raw_content, message, problem_detected) "
+                                  "VALUES (1, 1, 1, 'app: legacy text', 'legacy text', 0), (2, 1, 2, 'no message', NULL, 0)"))
+            with engine.begin() as conn:
+                assert upgrade_schema(conn) == ["log_entries.message_offset"]
+            with Session(engine) as db:
+                db.add(LogEntry(id=3, log_file_id=1, line_number=3, raw_content="app: stored by offset",
+                                message_offset=5, problem_detected=False))
+                db.commit()
+                expected = {1: "legacy text", 2: None, 3: "stored by offset"}
+                assert {e.id: e.message for e in db.query(LogEntry)} == expected
+                assert dict(db.execute(select(LogEntry.id, LogEntry.message)).all()) == expected
+                assert db.query(LogEntry.id).filter(LogEntry.message.is_(None)).all() == [(2,)]
+        finally:
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    test_timestamp_cache_per_format()
+    test_detect_format()
+    test_format_line_parsers()
+    test_json_lines()
+    test_ruleset_cache()
+    test_pipeline_matches_single_threaded()
+    test_pipeline_propagates_parser_errors()
+    test_reparse_replaces_entries()
+    test_upgrade_schema_adds_missing_columns()
+    test_message_with_null_offset()
+    print("✅ 日志解析服务测试通过")
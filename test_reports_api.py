@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+报表测试：按已汇总数据生成内容、Redis 缓存与失效、按用户隔离、分享链接，以及生成期间删除报表
+"""
+
+import sys
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(__file__))
+
+# 使用临时 SQLite 库：pytest 下由根目录 conftest.py 在收集前统一设置；直接运行本文件时在这里设置
+# （须在首次导入 backend.app.database 之前）
+if "backend.app.database" not in sys.modules:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "reports_test.sqlite3")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from backend.app import database
+from backend.app.api.v1 import reports as reports_api
+from backend.app.models.log import LogFile
+from backend.app.models.report import Report, ReportType
+from backend.app.services.log_parser import LogParserService
+from backend.app.services.report_service import ReportService, get_cached_report, _cache_key
+
+
+class _FakeRedis:
+    """进程内的 Redis 替身，只实现报表缓存用到的命令；on_set 用于在写缓存时插入并发操作"""
+
+    def __init__(self):
+        self.data = {}
+        self.on_set = None
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        if self.on_set:
+            self.on_set(key)
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+def _with_db(fn):
+    """建表、替换 Redis，并提供解析好的样例文件"""
+    def wrapper():
+        from backend.app import models  # noqa: F401  注册全部表
+        assert database.engine.dialect.name == "sqlite", f"测试应使用临时 SQLite 库，实际为 {database.engine.url}"
+        database.Base.metadata.create_all(database.engine)
+        old_redis = database.redis_client
+        database.redis_client = _FakeRedis()
+        db = database.SessionLocal()
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                fn(db, _parsed_file(db, tmp_dir))
+        finally:
+            db.close()
+            database.redis_client = old_redis
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+
+
+def _parsed_file(db, tmp_dir: str) -> int:
+    """120 行、每分钟一行（10:01 起）：每 20 行一次内存溢出，其余每 15 行一次磁盘空间不足"""
+    lines = []
+    for i in range(1, 121):
+        ts = (datetime(2024, 1, 12, 10, 0) + timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:%S")
+        if i % 20 == 0:
+            lines.append(f"{ts} kernel[1]: Out of memory: kill process {i}")
+        elif i % 15 == 0:
+            lines.append(f"{ts} app[2]: ERROR disk full on /var")
+        else:
+            lines.append(f"{ts} app[2]: INFO request {i} done")
+    path = os.path.join(tmp_dir, "report.log")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    log_file = LogFile(filename="r", original_filename="report.log", file_path=path, file_size=os.path.getsize(path))
+    db.add(log_file)
+    db.commit()
+    svc = LogParserService(db, lambda *a: None, storage_mode="full", bulk_load=False)
+    svc._parse_log_file_sync(log_file)
+    return log_file.id
+
+
+def _report(db, file_id: int, report_type: ReportType, user_id: int = 1, **kwargs) -> Report:
+    return ReportService(db).create_report(
+        {"title": report_type.value, "report_type": report_type.value, "log_file_ids": [file_id], **kwargs}, user_id)
+
+
+@_with_db
+def test_report_content(db, file_id):
+    """各类型报表的计数、时间线、峰值与问题样例与样例文件一致；限定时间范围时改用分钟汇总"""
+    report = ReportService(db).generate(_report(db, file_id, ReportType.SUMMARY).id)
+    content = report.content
+    assert content["totals"] == {"files": 1, "total_lines": 120, "error_lines": 0, "problems": 12}
+    assert content["problem_counts"] == {"内存溢出": 6, "磁盘空间": 6}
+    assert sum(content["level_counts"].values()) == 120
+    assert "timeline" not in report.charts_data and "problem_samples" not in content
+    assert report.summary.startswith("共 1 个文件、120 行日志，发现 12 个问题")
+
+    report = ReportService(db).generate(_report(db, file_id, ReportType.TREND_ANALYSIS).id)
+    points = report.charts_data["timeline"]["points"]
+    assert sum(p["problems"] for p in points) == 12 and report.charts_data["timeline"]["bucket_minutes"] == 1
+    assert len(report.content["peaks"]["problems"]) == 5
+
+    report = ReportService(db).generate(_report(db, file_id, ReportType.DETAILED).id)
+    samples = report.content["problem_samples"]
+    assert [s["line_number"] for s in samples["内存溢出"]] == [20, 40, 60, 80, 100]
+    assert samples["磁盘空间"][0]["message"].endswith("disk full on /var")
+    assert report.content["files"][0]["problems"] == 12
+
+    report = ReportService(db).generate(_report(
+        db, file_id, ReportType.PROBLEM_ANALYSIS,
+        date_range_start=datetime(2024, 1, 12, 10, 0), date_range_end=datetime(2024, 1, 12, 10, 59)).id)
+    assert report.content["problem_counts"] == {"磁盘空间": 3, "内存溢出": 2}
+    assert sum(p["problems"] for p in report.charts_data["timeline"]["points"]) == 5
+
+
+def _client(user: dict) -> TestClient:
+    app = FastAPI()
+    app.include_router(reports_api.router, prefix="/api/v1")
+    app.dependency_overrides[reports_api.get_current_user] = lambda: dict(user)
+    return TestClient(app)
+
+
+def _wait_completed(client: TestClient, report_id: int) -> dict:
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        data = client.get(f"/api/v1/reports/{report_id}").json()
+        if data["status"] in ("completed", "failed"):
+            return data
+        time.sleep(0.02)
+    raise AssertionError("报表生成超时")
+
+
+def _create(client: TestClient, file_id: int, title: str = "日报") -> int:
+    r = client.post("/api/v1/reports", json={"title": title, "report_type": "summary", "log_file_ids": [file_id]})
+    assert r.status_code == 202 and r.json()["status"] == "pending"
+    return r.json()["id"]
+
+
+@_with_db
+def test_report_cache(db, file_id):
+    """完成后写入缓存，重复查看直接读缓存；重新生成与分享设置变更会清除缓存"""
+    user = {"id": 1, "username": "admin"}
+    client = _client(user)
+    rid = _create(client, file_id)
+    data = _wait_completed(client, rid)
+    assert data["status"] == "completed" and data["content"]["totals"]["problems"] == 12
+    assert get_cached_report(rid)["content"] == data["content"]
+
+    # 库中直接改标题：缓存命中时仍返回缓存内容
+    db.query(Report).filter(Report.id == rid).update({"title": "改名"})
+    db.commit()
+    assert client.get(f"/api/v1/reports/{rid}").json()["title"] == "日报"
+
+    assert client.post(f"/api/v1/reports/{rid}/regenerate").status_code == 202
+    assert _wait_completed(client, rid)["title"] == "改名"
+    assert get_cached_report(rid)["title"] == "改名"
+
+    assert client.post(f"/api/v1/reports/{rid}/share", json={"is_public": True}).status_code == 200
+    assert get_cached_report(rid) is None
+    assert client.get(f"/api/v1/reports/{rid}").json()["is_public"] is True
+    assert get_cached_report(rid)["is_public"] is True
+
+
+@_with_db
+def test_report_ownership(db, file_id):
+    """他人的报表在列表中不可见，查看/分享/重新生成/删除都返回 404，缓存命中也不例外"""
+    owner = {"id": 1, "username": "admin"}
+    other = {"id": 2, "username": "guest"}
+    client = _client(owner)
+    rid = _create(client, file_id)
+    _wait_completed(client, rid)
+    assert get_cached_report(rid) is not None
+
+    client = _client(other)
+    assert rid not in [r["id"] for r in client.get("/api/v1/reports").json()]
+    assert client.get(f"/api/v1/reports/{rid}").status_code == 404
+    assert client.post(f"/api/v1/reports/{rid}/share", json={"is_public": True}).status_code == 404
+    assert client.post(f"/api/v1/reports/{rid}/regenerate").status_code == 404
+    assert client.delete(f"/api/v1/reports/{rid}").status_code == 404
+    database.redis_client.delete(_cache_key(rid))
+    assert client.get(f"/api/v1/reports/{rid}").status_code == 404
+
+    client = _client(owner)
+    assert rid in [r["id"] for r in client.get("/api/v1/reports").json()]
+    assert client.get(f"/api/v1/reports/{rid}").json()["generated_by"] == 1
+    assert client.delete(f"/api/v1/reports/{rid}").status_code == 200
+    assert client.get(f"/api/v1/reports/{rid}").status_code == 404
+    assert get_cached_report(rid) is None
+
+
+@_with_db
+def test_report_share_flow(db, file_id):
+    """分享链接无需登录即可查看；过期或取消分享后失效，重新分享沿用原链接"""
+    client = _client({"id": 1, "username": "admin"})
+    rid = _create(client, file_id)
+    _wait_completed(client, rid)
+
+    shared = client.post(f"/api/v1/reports/{rid}/share", json={"is_public": True, "expires_hours": 1}).json()
+    token = shared["share_token"]
+    assert token and shared["share_expires_at"]
+    data = client.get(f"/api/v1/reports/shared/{token}").json()
+    assert data["id"] == rid and data["content"]["totals"]["problems"] == 12
+    assert client.get("/api/v1/reports/shared/not-a-token").status_code == 404
+
+    db.query(Report).filter(Report.id == rid).update({"share_expires_at": datetime.now() - timedelta(minutes=1)})
+    db.commit()
+    assert client.get(f"/api/v1/reports/shared/{token}").status_code == 404
+
+    again = client.post(f"/api/v1/reports/{rid}/share", json={"is_public": True, "expires_hours": 1}).json()
+    assert again["share_token"] == token
+    assert client.get(f"/api/v1/reports/shared/{token}").status_code == 200
+
+    client.post(f"/api/v1/reports/{rid}/share", json={"is_public": False})
+    assert client.get(f"/api/v1/reports/shared/{token}").status_code == 404
+
+
+@_with_db
+def test_generate_after_delete(db, file_id):
+    """生成期间或写缓存时报表被删除：generate 返回 None，不留下已删除报表的缓存"""
+    def delete_report(report_id):
+        other = database.SessionLocal()
+        try:
+            other.query(Report).filter(Report.id == report_id).delete()
+            other.commit()
+        finally:
+            other.close()
+
+    rid = _report(db, file_id, ReportType.SUMMARY).id
+    svc = ReportService(db)
+    build = svc.build_content
+
+    def build_then_delete(report):
+        result = build(report)
+        delete_report(rid)
+        return result
+    svc.build_content = build_then_delete
+    assert svc.generate(rid) is None
+    assert get_cached_report(rid) is None
+    db.expunge_all()  # 已删除报表的对象仍在会话中，SQLite 会复用其 ID
+
+    # 删除在写缓存前完成、且删除接口的清缓存早于本次写入
+    rid = _report(db, file_id, ReportType.SUMMARY).id
+
+    def delete_before_write(key):
+        database.redis_client.on_set = None
+        delete_report(rid)
+        database.redis_client.delete(key)
+    database.redis_client.on_set = delete_before_write
+    assert ReportService(db).generate(rid) is None
+    assert get_cached_report(rid) is None
+
+
+if __name__ == "__main__":
+    test_report_content()
+    test_report_cache()
+    test_report_ownership()
+    test_report_share_flow()
+    test_generate_after_delete()
+    print("✅ 报表测试通过")